@@ -10,8 +10,17 @@ from microsoft_teams.api import (
 )
 from microsoft_teams.apps import ActivityContext, App
 
-from cua.cua_agent import ComputerUseAgent
+from config import Config
+from cua.client import close_openai_client, setup_openai_client
+from cua.cua_agent import (
+    ComputerUseAgent,
+    close_shared_resources,
+    start_shared_resources,
+)
+from cua.image_pipeline import shutdown_executors
+from scheduler import AgentScheduler, RunQueueFull, SessionBusy
 from storage.cua_session import CuaSession
+from storage.session_archive import SessionArchive
 from storage.session_storage import SessionStorage
 
 logger = logging.getLogger(__name__)
@@ -20,7 +29,70 @@ logging.basicConfig(
 )
 
 app = App()
-session_storage = SessionStorage()
+scheduler = AgentScheduler(
+    max_concurrent_runs=Config.MAX_CONCURRENT_RUNS,
+    max_queued_runs=Config.MAX_QUEUED_RUNS,
+)
+session_storage = SessionStorage(
+    max_sessions=Config.SESSION_MAX_COUNT,
+    idle_ttl=Config.SESSION_IDLE_TTL,
+    archive=(
+        SessionArchive(Config.SESSION_ARCHIVE_PATH, max_age=Config.SESSION_ARCHIVE_TTL)
+        if Config.SESSION_ARCHIVE_PATH
+        else None
+    ),
+    # Sessions with a run in progress or queued are never evicted
+    is_busy=scheduler.is_active,
+)
+
+
+async def schedule_agent_run(
+    ctx: ActivityContext,
+    session_id: str,
+    session: CuaSession,
+    query: str,
+    activity_id: str | None = None,
+) -> bool:
+    """Run the CUA agent in the background, returns False if it could not be scheduled."""
+    # Store conversation reference for background task
+    conversation_ref = ctx.conversation_ref
+
+    async def send_text(text: str):
+        await app.activity_sender.send(MessageActivityInput(text=text), conversation_ref)
+
+    async def background_task():
+        """Run the CUA agent in the background and handle any errors."""
+        try:
+            cua_agent = ComputerUseAgent(app, conversation_ref, session, activity_id)
+            await cua_agent.run(query)
+        except Exception as e:
+            logger.error(f"Background task error: {e}")
+            traceback.print_exc()
+            try:
+                await send_text(f"Error: {str(e)}")
+            except Exception:
+                pass
+
+    async def on_queued(position: int):
+        await send_text(
+            f"All agents are busy, your task is number {position} in the queue."
+        )
+
+    try:
+        scheduler.submit(session_id, background_task, on_queued=on_queued)
+    except SessionBusy:
+        await ctx.send("The session is already in progress.")
+        return False
+    except RunQueueFull:
+        await ctx.send("Too many tasks are waiting right now, please try again later.")
+        return False
+    return True
+
+
+def session_key(ctx: ActivityContext) -> str:
+    """Runs are scheduled per user, like sessions are stored."""
+    user_id = ctx.activity.from_.aad_object_id if ctx.activity.from_ else None
+    return user_id or ctx.activity.conversation.id
 
 
 @app.on_install_add
@@ -42,9 +114,7 @@ async def on_approve_safety_check(ctx: ActivityContext[AdaptiveCardInvokeActivit
     session.signal = "acknowledged_pending_safety_checks"
 
     # Continue the task with the approved safety check
-    conversation_ref = ctx.conversation_ref
-    cua_agent = ComputerUseAgent(app, conversation_ref, session, None)
-    await cua_agent.run("")
+    await schedule_agent_run(ctx, session_key(ctx), session, "")
     return None
 
 
@@ -63,14 +133,13 @@ async def on_toggle_pause(ctx: ActivityContext[AdaptiveCardInvokeActivity]):
         session.signal = "pause_requested"
         session.status = "Paused"
         await ctx.send("Pausing the session...")
-    else:
+    # Continue the task with empty message since we're just resuming. The session
+    # stays paused when the run cannot be scheduled, a scheduled run only starts
+    # once this handler yields.
+    elif await schedule_agent_run(ctx, session_key(ctx), session, ""):
         session.signal = None
         session.status = "Running"
         await ctx.send("Resuming the session...")
-        # Continue the task with empty message since we're just resuming
-        conversation_ref = ctx.conversation_ref
-        cua_agent = ComputerUseAgent(app, conversation_ref, session, None)
-        await cua_agent.run("")
     return None
 
 
@@ -85,10 +154,9 @@ async def on_retry(ctx: ActivityContext[AdaptiveCardInvokeActivity]):
         return None
 
     if session.status == "Error":
-        session.status = "Running"
-        conversation_ref = ctx.conversation_ref
-        cua_agent = ComputerUseAgent(app, conversation_ref, session, None)
-        await cua_agent.run("")
+        # Stays in the error state when the run cannot be scheduled, so it can be retried
+        if await schedule_agent_run(ctx, session_key(ctx), session, ""):
+            session.status = "Running"
     else:
         await ctx.send("The session is not in an error state.")
     return None
@@ -106,19 +174,18 @@ async def on_cua(ctx: ActivityContext[MessageActivity]):
     session = await session_storage.get_session(user_id) if user_id else None
 
     # Check if there's an active session
-    if session and session.current_step.next_action != "user_interaction":
+    if scheduler.is_active(session_key(ctx)) or (
+        session and session.current_step.next_action != "user_interaction"
+    ):
         await ctx.send("The session is already in progress.")
         return
 
     # Create new session if none exists or previous one is complete
     is_new_session = session is None
-    session = session or CuaSession.create()
+    session = session or CuaSession.create(max_history=Config.SESSION_HISTORY_STEPS)
     if user_id:
         await session_storage.set_session(user_id, session)
 
-    # Store conversation reference for background task
-    conversation_ref = ctx.conversation_ref
-
     # Send initial message and get activity ID
     if is_new_session:
         sent = await ctx.send("Starting up the CUA agent to do this work.")
@@ -126,21 +193,7 @@ async def on_cua(ctx: ActivityContext[MessageActivity]):
     else:
         activity_id = None
 
-    async def background_task():
-        """Run the CUA agent in the background and handle any errors."""
-        try:
-            cua_agent = ComputerUseAgent(app, conversation_ref, session, activity_id)
-            await cua_agent.run(query)
-        except Exception as e:
-            logger.error(f"Background task error: {e}")
-            traceback.print_exc()
-            try:
-                error_activity = MessageActivityInput(text=f"Error: {str(e)}")
-                await app.activity_sender.send(error_activity, conversation_ref)
-            except Exception:
-                pass
-
-    asyncio.create_task(background_task())
+    await schedule_agent_run(ctx, session_key(ctx), session, query, activity_id)
 
 
 @app.event("error")
@@ -149,5 +202,22 @@ async def on_error(event):
     traceback.print_exc()
 
 
+async def main():
+    # Create the shared model client up front, its connections are reused by every session
+    setup_openai_client()
+    session_storage.start()
+    # Launch the browsers or connect to the desktops while the app starts
+    warm_up = asyncio.create_task(start_shared_resources())
+    try:
+        await app.start()
+    finally:
+        warm_up.cancel()
+        await scheduler.drain(Config.SHUTDOWN_DRAIN_TIMEOUT)
+        await session_storage.close()
+        await close_shared_resources()
+        await close_openai_client()
+        shutdown_executors()
+
+
 if __name__ == "__main__":
-    asyncio.run(app.start())
+    asyncio.run(main())
@@ -0,0 +1,83 @@
+import base64
+import io
+import json
+import logging
+from functools import lru_cache
+from typing import Callable
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_MIME_TYPE = "image/jpeg"
+MIN_THUMBNAIL_WIDTH = 160
+MIN_THUMBNAIL_QUALITY = 35
+
+# Builds a card from a base64 JPEG thumbnail (or None) and the number of history
+# steps to include (None for all of them)
+BuildCard = Callable[[str | None, int | None], dict]
+
+
+@lru_cache(maxsize=8)
+def make_thumbnail(screenshot_base64: str, max_width: int, quality: int) -> str:
+    """Downscale a base64 screenshot and return it as a base64 JPEG."""
+    image = Image.open(io.BytesIO(base64.b64decode(screenshot_base64)))
+    image = image.convert("RGB")
+    if image.width > max_width:
+        image = image.resize(
+            (max_width, max(round(image.height * max_width / image.width), 1)),
+            Image.Resampling.BILINEAR,
+        )
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality, optimize=True)
+    return base64.b64encode(buffer.getvalue()).decode("utf-8")
+
+
+def card_size(card: dict) -> int:
+    """Size in bytes of the card once serialized for Teams."""
+    return len(json.dumps(card, ensure_ascii=False, separators=(",", ":")).encode())
+
+
+def fit_card(
+    build: BuildCard,
+    screenshot_base64: str | None,
+    history_length: int,
+    max_bytes: int,
+    thumbnail_width: int = 512,
+    thumbnail_quality: int = 60,
+) -> dict:
+    """
+    Build a card that fits in `max_bytes`. The screenshot is sent as a JPEG thumbnail,
+    when the card is still too large the oldest history steps are left out first,
+    then the thumbnail gets smaller, and as a last resort it is dropped.
+    """
+    thumbnail = (
+        make_thumbnail(screenshot_base64, thumbnail_width, thumbnail_quality)
+        if screenshot_base64
+        else None
+    )
+    card = build(thumbnail, None)
+    if card_size(card) <= max_bytes:
+        return card
+
+    history_limit = history_length
+    while history_limit > 0:
+        history_limit //= 2
+        card = build(thumbnail, history_limit)
+        if card_size(card) <= max_bytes:
+            return card
+
+    width, quality = thumbnail_width, thumbnail_quality
+    while thumbnail and (width > MIN_THUMBNAIL_WIDTH or quality > MIN_THUMBNAIL_QUALITY):
+        width = max(int(width * 0.7), MIN_THUMBNAIL_WIDTH)
+        quality = max(quality - 10, MIN_THUMBNAIL_QUALITY)
+        thumbnail = make_thumbnail(screenshot_base64, width, quality)
+        card = build(thumbnail, 0)
+        if card_size(card) <= max_bytes:
+            return card
+
+    card = build(None, 0)
+    size = card_size(card)
+    if size > max_bytes:
+        logger.warning(f"Card is {size} bytes, over the budget of {max_bytes} bytes")
+    return card
@@ -1,3 +1,4 @@
+from functools import lru_cache
 from typing import TypedDict
 
 from openai.types.responses.response_computer_tool_call import (
@@ -11,11 +12,115 @@ class ProgressStepDict(TypedDict):
     message: str  # Any message associated with the step
 
 
+@lru_cache(maxsize=8)
+def _progress_card_header(status: str) -> dict:
+    # Only depends on the status, so it is built once and shared between cards
+    return {
+        "type": "Container",
+        "style": "emphasis",
+        "items": [
+            {
+                "type": "ColumnSet",
+                "columns": [
+                    {
+                        "type": "Column",
+                        "width": "stretch",
+                        "items": [
+                            {
+                                "type": "TextBlock",
+                                "text": "🤖 Computer Use Agent",
+                                "weight": "Bolder",
+                                "size": "Large",
+                                "wrap": True,
+                            }
+                        ],
+                    },
+                    {
+                        "type": "Column",
+                        "width": "auto",
+                        "items": [
+                            {
+                                "type": "TextBlock",
+                                "text": f"Status: {status}",
+                                "weight": "Bolder",
+                                "wrap": True,
+                            }
+                        ],
+                    },
+                    {
+                        "type": "Column",
+                        "width": "auto",
+                        "items": [
+                            {
+                                "type": "ActionSet",
+                                "actions": [
+                                    {
+                                        "type": "Action.Execute",
+                                        "verb": "toggle_pause",
+                                        "title": ("⏸️" if status == "Running" else "▶️"),
+                                        "data": {
+                                            "current_status": status,
+                                        },
+                                    }
+                                ],
+                            }
+                        ],
+                    },
+                ],
+            }
+        ],
+    }
+
+
+def render_history_step(step_number: int, step: ProgressStepDict) -> dict:
+    """Render one step of the history section. Steps never change once rendered."""
+    step_facts = [
+        {
+            "title": "Action",
+            "value": step.get("action", "No action"),
+        },
+        {
+            "title": "Next Action",
+            "value": step.get("next_action", "None"),
+        },
+    ]
+
+    if step.get("message"):
+        step_facts.append(
+            {
+                "title": "Message",
+                "value": step["message"],
+            }
+        )
+
+    return {
+        "type": "Container",
+        "style": "emphasis",
+        "items": [
+            {
+                "type": "TextBlock",
+                "text": f"Step {step_number}",
+                "weight": "Bolder",
+                "size": "Medium",
+                "wrap": True,
+            },
+            {
+                "type": "FactSet",
+                "facts": step_facts,
+            },
+        ],
+    }
+
+
 def create_cua_progress_card(
     screenshot: str = None,
     current_step: ProgressStepDict = None,
     history: list[ProgressStepDict] = None,
     status: str = "Running",
+    rendered_history: list[dict] = None,
+    max_history_steps: int | None = None,
+    screenshot_mime_type: str = "image/png",
+    total_steps: int | None = None,
 ) -> dict:
     """Create a progress card showing the current state of the computer use session.
 
@@ -26,77 +131,24 @@ def create_cua_progress_card(
         history: List of previous steps with format:
                 [{"action": str, "next_action": str, "message": str}, ...]
         status: Current status of the agent (Running/Paused)
+        rendered_history: Steps already rendered with render_history_step, used instead of history
+        max_history_steps: Only show the last steps of the history, with a count of the hidden ones
+        screenshot_mime_type: Image format of the screenshot
+        total_steps: Number of steps in the whole history, when rendered_history only
+                     holds the latest ones
     """
     card = {
         "type": "AdaptiveCard",
         "$schema": "http://adaptivecards.io/schemas/adaptive-card.json",
         "version": "1.5",
-        "body": [
-            {
-                "type": "Container",
-                "style": "emphasis",
-                "items": [
-                    {
-                        "type": "ColumnSet",
-                        "columns": [
-                            {
-                                "type": "Column",
-                                "width": "stretch",
-                                "items": [
-                                    {
-                                        "type": "TextBlock",
-                                        "text": "🤖 Computer Use Agent",
-                                        "weight": "Bolder",
-                                        "size": "Large",
-                                        "wrap": True,
-                                    }
-                                ],
-                            },
-                            {
-                                "type": "Column",
-                                "width": "auto",
-                                "items": [
-                                    {
-                                        "type": "TextBlock",
-                                        "text": f"Status: {status}",
-                                        "weight": "Bolder",
-                                        "wrap": True,
-                                    }
-                                ],
-                            },
-                            {
-                                "type": "Column",
-                                "width": "auto",
-                                "items": [
-                                    {
-                                        "type": "ActionSet",
-                                        "actions": [
-                                            {
-                                                "type": "Action.Execute",
-                                                "verb": "toggle_pause",
-                                                "title": (
-                                                    "⏸️" if status == "Running" else "▶️"
-                                                ),
-                                                "data": {
-                                                    "current_status": status,
-                                                },
-                                            }
-                                        ],
-                                    }
-                                ],
-                            },
-                        ],
-                    }
-                ],
-            }
-        ],
+        "body": [_progress_card_header(status)],
     }
 
     if screenshot:
         card["body"].append(
             {
                 "type": "Image",
-                "url": f"data:image/png;base64,{screenshot}",
+                "url": f"data:{screenshot_mime_type};base64,{screenshot}",
                 "msTeams": {
                     "allowExpand": True,
                 },
@@ -142,7 +194,15 @@ def create_cua_progress_card(
 
         card["body"].append(current_section)
 
-    if history:
+    if rendered_history is None and history:
+        rendered_history = [
+            render_history_step(i + 1, step) for i, step in enumerate(history)
+        ]
+
+    if rendered_history:
+        shown = rendered_history
+        if max_history_steps is not None and len(rendered_history) > max_history_steps:
+            shown = rendered_history[len(rendered_history) - max_history_steps :]
         history_container = {
             "type": "Container",
             "style": "default",
@@ -157,46 +217,17 @@ def create_cua_progress_card(
                 }
             ],
         }
-
-        for i, step in enumerate(history):
-            step_facts = [
-                {
-                    "title": "Action",
-                    "value": step.get("action", "No action"),
-                },
-                {
-                    "title": "Next Action",
-                    "value": step.get("next_action", "None"),
-                },
-            ]
-
-            if step.get("message"):
-                step_facts.append(
-                    {
-                        "title": "Message",
-                        "value": step["message"],
-                    }
-                )
-
+        hidden = (total_steps or len(rendered_history)) - len(shown)
+        if hidden:
             history_container["items"].append(
                 {
-                    "type": "Container",
-                    "style": "emphasis",
-                    "items": [
-                        {
-                            "type": "TextBlock",
-                            "text": f"Step {i + 1}",
-                            "weight": "Bolder",
-                            "size": "Medium",
-                            "wrap": True,
-                        },
-                        {
-                            "type": "FactSet",
-                            "facts": step_facts,
-                        },
-                    ],
+                    "type": "TextBlock",
+                    "text": f"{hidden} earlier steps not shown",
+                    "isSubtle": True,
+                    "wrap": True,
                 }
             )
+        history_container["items"].extend(shown)
 
         card["body"].extend(
             [
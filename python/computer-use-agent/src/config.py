@@ -21,8 +21,186 @@ class Config:
     OPENAI_MODEL_NAME = os.environ.get("OPENAI_MODEL_NAME", None)
     OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", None)
 
+    # Connection pool shared by every request to the model. HTTP/2 is only used when
+    # the h2 package is installed.
+    OPENAI_MAX_CONNECTIONS = int(os.environ.get("OPENAI_MAX_CONNECTIONS", "100"))
+    OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(
+        os.environ.get("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20")
+    )
+    OPENAI_KEEPALIVE_EXPIRY = float(os.environ.get("OPENAI_KEEPALIVE_EXPIRY", "120"))
+    OPENAI_HTTP2 = os.environ.get("OPENAI_HTTP2", "true").lower() == "true"
+    # Model requests that time out, are throttled or hit a server error are retried
+    # with exponential backoff, within RETRY_DEADLINE seconds overall. Each attempt
+    # times out after twice the p95 latency, kept between the RESPONSE_TIMEOUT bounds.
+    RETRY_MAX_ATTEMPTS = int(os.environ.get("RETRY_MAX_ATTEMPTS", "4"))
+    RETRY_BASE_DELAY = float(os.environ.get("RETRY_BASE_DELAY", "0.5"))
+    RETRY_MAX_DELAY = float(os.environ.get("RETRY_MAX_DELAY", "8"))
+    RETRY_DEADLINE = float(os.environ.get("RETRY_DEADLINE", "120"))
+    RESPONSE_TIMEOUT_MIN = float(os.environ.get("RESPONSE_TIMEOUT_MIN", "10"))
+    RESPONSE_TIMEOUT_MAX = float(os.environ.get("RESPONSE_TIMEOUT_MAX", "60"))
+    # Send a second, identical model request when the first has not answered after the
+    # HEDGE_PERCENTILE latency, using at most HEDGE_BUDGET extra requests per request.
+    HEDGE_REQUESTS = os.environ.get("HEDGE_REQUESTS", "false").lower() == "true"
+    HEDGE_PERCENTILE = float(os.environ.get("HEDGE_PERCENTILE", "0.9"))
+    HEDGE_MIN_DELAY = float(os.environ.get("HEDGE_MIN_DELAY", "1.0"))
+    HEDGE_BUDGET = float(os.environ.get("HEDGE_BUDGET", "0.1"))
+    # Progress card updates sent per second to a conversation, newer cards replace
+    # the ones still waiting.
+    CARD_UPDATES_PER_SECOND = float(os.environ.get("CARD_UPDATES_PER_SECOND", "1.0"))
+    # Steps shown in the history section of the progress card, older ones are counted
+    CARD_HISTORY_STEPS = int(os.environ.get("CARD_HISTORY_STEPS", "10"))
+    # Progress cards are kept under CARD_MAX_BYTES, screenshots are shown as JPEG
+    # thumbnails at most CARD_THUMBNAIL_WIDTH pixels wide.
+    CARD_MAX_BYTES = int(os.environ.get("CARD_MAX_BYTES", "80000"))
+    CARD_THUMBNAIL_WIDTH = int(os.environ.get("CARD_THUMBNAIL_WIDTH", "512"))
+    CARD_THUMBNAIL_QUALITY = int(os.environ.get("CARD_THUMBNAIL_QUALITY", "60"))
+    # Stream model responses so actions start as soon as they are complete and the
+    # progress card shows the text as it is generated.
+    STREAM_RESPONSES = os.environ.get("STREAM_RESPONSES", "false").lower() == "true"
+    # Minimum seconds between progress card updates while text streams in
+    STREAM_CARD_UPDATE_INTERVAL = float(
+        os.environ.get("STREAM_CARD_UPDATE_INTERVAL", "1.0")
+    )
+
+    # Agent runs in progress at once, more wait in a queue of at most MAX_QUEUED_RUNS.
+    # At shutdown, runs get SHUTDOWN_DRAIN_TIMEOUT seconds to finish before being cancelled.
+    MAX_CONCURRENT_RUNS = int(os.environ.get("MAX_CONCURRENT_RUNS", "4"))
+    MAX_QUEUED_RUNS = int(os.environ.get("MAX_QUEUED_RUNS", "20"))
+    SHUTDOWN_DRAIN_TIMEOUT = float(os.environ.get("SHUTDOWN_DRAIN_TIMEOUT", "30"))
+
+    # Sessions kept in memory, the least recently used ones and those idle for more than
+    # SESSION_IDLE_TTL seconds are evicted. With SESSION_ARCHIVE_PATH set, sessions are
+    # snapshotted to that SQLite file after every step and when evicted, so they can be
+    # resumed after a restart for SESSION_ARCHIVE_TTL seconds.
+    SESSION_MAX_COUNT = int(os.environ.get("SESSION_MAX_COUNT", "100"))
+    SESSION_IDLE_TTL = float(os.environ.get("SESSION_IDLE_TTL", "3600"))
+    SESSION_ARCHIVE_PATH = os.environ.get("SESSION_ARCHIVE_PATH", None)
+    SESSION_ARCHIVE_TTL = float(os.environ.get("SESSION_ARCHIVE_TTL", "604800"))
+    # Steps a session keeps in memory, at least CARD_HISTORY_STEPS.
+    # Raw model responses are written to RESPONSE_JOURNAL_DIR when it is set.
+    SESSION_HISTORY_STEPS = int(os.environ.get("SESSION_HISTORY_STEPS", "50"))
+    RESPONSE_JOURNAL_DIR = os.environ.get("RESPONSE_JOURNAL_DIR", None)
+    # Completed tasks are recorded in TRAJECTORY_DIR. With TRAJECTORY_REPLAY, asking the
+    # same task again repeats its actions without the model while each screen is within
+    # TRAJECTORY_MAX_DISTANCE bits (of a 256 bit hash) of the recorded one.
+    TRAJECTORY_DIR = os.environ.get("TRAJECTORY_DIR", None)
+    TRAJECTORY_REPLAY = os.environ.get("TRAJECTORY_REPLAY", "true").lower() == "true"
+    TRAJECTORY_MAX_DISTANCE = int(os.environ.get("TRAJECTORY_MAX_DISTANCE", "10"))
+
     # By default, we use VNC to control the computer.
     # But you may use a playwright browser instead.
     USE_BROWSER = os.environ.get("USE_BROWSER", "false").lower() == "true"
     VNC_ADDRESS = os.environ.get("VNC_ADDRESS", "localhost::5900")
     VNC_PASSWORD = os.environ.get("VNC_PASSWORD", "secret")
+
+    # Chromium processes kept running for browser sessions, each session gets its own
+    # context and a browser hosts at most BROWSER_POOL_MAX_CONTEXTS of them.
+    BROWSER_POOL_SIZE = int(os.environ.get("BROWSER_POOL_SIZE", "1"))
+    BROWSER_POOL_MAX_CONTEXTS = int(os.environ.get("BROWSER_POOL_MAX_CONTEXTS", "4"))
+    BROWSER_POOL_ACQUIRE_TIMEOUT = float(
+        os.environ.get("BROWSER_POOL_ACQUIRE_TIMEOUT", "30")
+    )
+    BROWSER_START_URL = os.environ.get("BROWSER_START_URL", "https://bing.com")
+    # Browser screenshots are captured in memory as "png" or "jpeg" (with a 0-100 quality).
+    BROWSER_SCREENSHOT_FORMAT = os.environ.get("BROWSER_SCREENSHOT_FORMAT", "png").lower()
+    BROWSER_SCREENSHOT_QUALITY = (
+        int(os.environ["BROWSER_SCREENSHOT_QUALITY"])
+        if os.environ.get("BROWSER_SCREENSHOT_QUALITY")
+        else None
+    )
+    # Set to a directory to keep every browser screenshot, one folder per session.
+    SCREENSHOT_DIR = os.environ.get("SCREENSHOT_DIR", None)
+
+    # How screenshots are fitted to the size the model sees. IMAGE_RESAMPLE is a
+    # Pillow filter name, IMAGE_FORMAT is "png", "jpeg" or "webp" and encoding runs
+    # on a "thread" or "process" pool (IMAGE_EXECUTOR).
+    IMAGE_RESAMPLE = os.environ.get("IMAGE_RESAMPLE", "bilinear").lower()
+    IMAGE_FORMAT = os.environ.get("IMAGE_FORMAT", "png").lower()
+    IMAGE_QUALITY = int(os.environ.get("IMAGE_QUALITY", "80"))
+    IMAGE_PNG_COMPRESS_LEVEL = int(os.environ.get("IMAGE_PNG_COMPRESS_LEVEL", "1"))
+    IMAGE_EXECUTOR = os.environ.get("IMAGE_EXECUTOR", "thread").lower()
+    IMAGE_MAX_WORKERS = (
+        int(os.environ["IMAGE_MAX_WORKERS"])
+        if os.environ.get("IMAGE_MAX_WORKERS")
+        else None
+    )
+
+    # Screenshots sent to the model are at most SCREENSHOT_MAX_WIDTH x SCREENSHOT_MAX_HEIGHT,
+    # encoded with IMAGE_FORMAT and IMAGE_QUALITY. With SCREENSHOT_ADAPTIVE, screenshots
+    # where less than SCREENSHOT_SMALL_CHANGE_RATIO of the screen changed are sent as
+    # JPEG at SCREENSHOT_SMALL_CHANGE_QUALITY.
+    SCREENSHOT_MAX_WIDTH = (
+        int(os.environ["SCREENSHOT_MAX_WIDTH"])
+        if os.environ.get("SCREENSHOT_MAX_WIDTH")
+        else None
+    )
+    SCREENSHOT_MAX_HEIGHT = (
+        int(os.environ["SCREENSHOT_MAX_HEIGHT"])
+        if os.environ.get("SCREENSHOT_MAX_HEIGHT")
+        else None
+    )
+    SCREENSHOT_ADAPTIVE = os.environ.get("SCREENSHOT_ADAPTIVE", "false").lower() == "true"
+    SCREENSHOT_SMALL_CHANGE_RATIO = float(
+        os.environ.get("SCREENSHOT_SMALL_CHANGE_RATIO", "0.1")
+    )
+    SCREENSHOT_SMALL_CHANGE_QUALITY = int(
+        os.environ.get("SCREENSHOT_SMALL_CHANGE_QUALITY", "50")
+    )
+
+    # Desktops leased to sessions, one session per desktop at a time.
+    # A comma separated list of VNC addresses, defaults to VNC_ADDRESS.
+    VNC_ADDRESSES = [
+        address.strip()
+        for address in os.environ.get("VNC_ADDRESSES", VNC_ADDRESS).split(",")
+        if address.strip()
+    ]
+    # When every desktop is leased, up to VNC_POOL_MAX_WAITERS sessions wait
+    # VNC_POOL_ACQUIRE_TIMEOUT seconds for one to be released.
+    VNC_POOL_ACQUIRE_TIMEOUT = float(os.environ.get("VNC_POOL_ACQUIRE_TIMEOUT", "30"))
+    VNC_POOL_MAX_WAITERS = int(os.environ.get("VNC_POOL_MAX_WAITERS", "10"))
+    VNC_POOL_HEALTH_CHECK_INTERVAL = float(
+        os.environ.get("VNC_POOL_HEALTH_CHECK_INTERVAL", "30")
+    )
+    # Key combinations pressed on a desktop before it is leased to another session,
+    # comma separated, e.g. "ctrl+alt+d" shows the desktop in the bundled Xfce image.
+    VNC_RESET_KEYS = [
+        combination.strip().lower().split("+")
+        for combination in os.environ.get("VNC_RESET_KEYS", "ctrl+alt+d").split(",")
+        if combination.strip()
+    ]
+
+    # After each action we wait until the screen stops changing for SETTLE_QUIET_PERIOD
+    # seconds, but never longer than SETTLE_TIMEOUT seconds.
+    SETTLE_TIMEOUT = float(os.environ.get("SETTLE_TIMEOUT", "2.0"))
+    SETTLE_QUIET_PERIOD = float(os.environ.get("SETTLE_QUIET_PERIOD", "0.15"))
+
+    # How the VNC mouse travels between points: "teleport", "eased" or "human".
+    # Each move sends at most VNC_MOUSE_MAX_STEPS events within VNC_MOUSE_MAX_DURATION seconds.
+    VNC_MOUSE_MOTION = os.environ.get("VNC_MOUSE_MOTION", "eased").lower()
+    VNC_MOUSE_MAX_STEPS = int(os.environ.get("VNC_MOUSE_MAX_STEPS", "10"))
+    VNC_MOUSE_MAX_DURATION = float(os.environ.get("VNC_MOUSE_MAX_DURATION", "0.05"))
+
+    # How VNC text is typed: "burst" sends all key events at once, "paste" sets the
+    # clipboard and presses VNC_PASTE_KEYS, "per_key" waits VNC_KEY_DELAY seconds
+    # between keys. VNC_TYPING_MODES overrides the mode of single desktops, for
+    # targets that drop fast key events, e.g. "host:5901=per_key,host:5902=paste".
+    VNC_TYPING_MODE = os.environ.get("VNC_TYPING_MODE", "burst").lower()
+    VNC_TYPING_MODES = dict(
+        (address.strip(), mode.strip().lower())
+        for address, _, mode in (
+            entry.rpartition("=")
+            for entry in os.environ.get("VNC_TYPING_MODES", "").split(",")
+            if entry.strip()
+        )
+    )
+    VNC_KEY_DELAY = float(os.environ.get("VNC_KEY_DELAY", "0.06"))
+    VNC_PASTE_KEYS = os.environ.get("VNC_PASTE_KEYS", "ctrl+v").lower().split("+")
+
+    # Pixels scrolled by one VNC wheel click. With VNC_SCROLL_CALIBRATE the first
+    # scrolls measure the real distance on the target's screen.
+    VNC_SCROLL_PIXELS_PER_CLICK = float(
+        os.environ.get("VNC_SCROLL_PIXELS_PER_CLICK", "50")
+    )
+    VNC_SCROLL_CALIBRATE = (
+        os.environ.get("VNC_SCROLL_CALIBRATE", "true").lower() == "true"
+    )
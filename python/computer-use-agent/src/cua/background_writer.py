@@ -0,0 +1,61 @@
+import asyncio
+import logging
+from pathlib import Path
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+# Writes one file, given the directory it belongs in. Runs on a worker thread.
+Write = Callable[[Path], None]
+
+
+class BackgroundWriter:
+    """
+    Writes files to a directory from a background task, so callers never wait on the
+    disk. The directory is created on the first write. When more than `max_pending`
+    writes are waiting, new ones are dropped.
+    """
+
+    def __init__(self, directory: str | Path, max_pending: int = 32, what: str = "files"):
+        self.directory = Path(directory)
+        # What is written, for the logs
+        self.what = what
+        self._queue: asyncio.Queue[Write | None] = asyncio.Queue(maxsize=max_pending)
+        self._worker: asyncio.Task | None = None
+
+    def submit(self, write: Write) -> bool:
+        """Queue a write without blocking the caller. Returns False when it was dropped."""
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._write_loop())
+        try:
+            self._queue.put_nowait(write)
+        except asyncio.QueueFull:
+            logger.warning(f"Writing {self.what} is falling behind, dropping one")
+            return False
+        return True
+
+    async def close(self) -> None:
+        """Finish the writes still queued and stop the background task."""
+        if self._worker is None:
+            return
+        await self._queue.put(None)
+        await self._worker
+        self._worker = None
+
+    async def _write_loop(self) -> None:
+        try:
+            await asyncio.to_thread(self.directory.mkdir, parents=True, exist_ok=True)
+            writable = True
+        except OSError as e:
+            logger.error(f"Error creating the directory for {self.what} {self.directory}: {e}")
+            writable = False
+        while True:
+            write = await self._queue.get()
+            if write is None:
+                return
+            if not writable:
+                continue
+            try:
+                await asyncio.to_thread(write, self.directory)
+            except OSError as e:
+                logger.error(f"Error writing {self.what} to {self.directory}: {e}")
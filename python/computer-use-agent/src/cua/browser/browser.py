@@ -1,13 +1,17 @@
 import asyncio
 import json
 import logging
+from typing import Literal
 
 from openai.types.responses.function_tool_param import FunctionToolParam
 from openai.types.responses.response_computer_tool_call import Action
 from openai.types.responses.response_function_tool_call import ResponseFunctionToolCall
-from playwright.async_api import async_playwright
+from playwright.async_api import Error as PlaywrightError
+from playwright.async_api import Request
 
+from cua.browser.browser_pool import BrowserPool
 from cua.cua_target import CUATarget, Screenshot
+from cua.screenshot_sink import ScreenshotSink
 
 logger = logging.getLogger(__name__)
 
@@ -48,6 +52,33 @@ CUA_KEY_TO_PLAYWRIGHT_KEY = {
 }
 
 
+# Resolves once the DOM has not mutated for quietMs, after the next paint,
+# or with false once timeoutMs has passed.
+SETTLE_SCRIPT = """
+([quietMs, timeoutMs]) => new Promise((resolve) => {
+    let quietTimer;
+    const finish = (settled) => {
+        observer.disconnect();
+        clearTimeout(quietTimer);
+        clearTimeout(deadline);
+        requestAnimationFrame(() => requestAnimationFrame(() => resolve(settled)));
+    };
+    const observer = new MutationObserver(() => {
+        clearTimeout(quietTimer);
+        quietTimer = setTimeout(() => finish(true), quietMs);
+    });
+    observer.observe(document, {
+        subtree: true, childList: true, attributes: true, characterData: true,
+    });
+    quietTimer = setTimeout(() => finish(true), quietMs);
+    const deadline = setTimeout(() => finish(false), timeoutMs);
+})
+"""
+
+# Long lived connections never finish, so they do not count towards network activity
+IGNORED_RESOURCE_TYPES = ("websocket", "eventsource")
+
+
 def cua_key_to_playwright_key(key: str) -> str:
     """Convert CUA key format to Playwright key format."""
     if not key:
@@ -65,41 +96,73 @@ class Browser(CUATarget):
     def environment(self) -> str:
         return "browser"
 
-    def __init__(self, width=1024, height=768):
+    def __init__(
+        self,
+        width=1024,
+        height=768,
+        settle_timeout: float = 2.0,
+        settle_quiet_period: float = 0.15,
+        pool: BrowserPool | None = None,
+        screenshot_format: Literal["png", "jpeg"] = "png",
+        screenshot_quality: int | None = None,
+        screenshot_scale: Literal["css", "device"] = "device",
+        screenshot_sink: ScreenshotSink | None = None,
+    ):
         super().__init__(width, height)
-        self.playwright = None
-        self.browser = None
+        self.screenshot_format = screenshot_format
+        # Only used for JPEG, between 0 and 100
+        self.screenshot_quality = screenshot_quality
+        self.screenshot_scale = screenshot_scale
+        # Optional place to persist screenshots, they are kept in memory otherwise
+        self.screenshot_sink = screenshot_sink
+        # Without a shared pool the browser gets a Chromium process of its own
+        self._owns_pool = pool is None
+        self.pool = pool or BrowserPool(size=1, width=width, height=height)
         self.context = None
         self.page = None
+        self.settle_timeout = settle_timeout
+        self.settle_quiet_period = settle_quiet_period
+        self._inflight_requests: set[Request] = set()
+        self._network_idle = asyncio.Event()
+        self._network_idle.set()
 
-    async def initialize(self):
-        if self.browser is not None and self.page is not None:
+    async def initialize(self, restore_state: dict | None = None):
+        """
+        Get a browser context from the pool. `restore_state` is what `export_state`
+        returned, the context then starts with its cookies and local storage at its url.
+        """
+        if self.context is not None and self.page is not None:
             # If we already have a fully initialized browser instance, just return
             return
 
-        if self.playwright is None:
-            self.playwright = await async_playwright().start()
+        restore_state = restore_state or {}
+        self.context, self.page = await self.pool.acquire(
+            self.width,
+            self.height,
+            storage_state=restore_state.get("storage_state"),
+            url=restore_state.get("url"),
+        )
+        self._track_network(self.page)
+        await self._setup_popup_handler()
 
-        if self.browser is None:
-            self.browser = await self.playwright.chromium.launch(
-                headless=False,
-                chromium_sandbox=True,
-                env={},
-                args=["--disable-extensions", "--disable-file-system"],
-            )
+    def _track_network(self, page):
+        """Keep count of the requests in flight on the page used for settling."""
+        self._inflight_requests.clear()
+        self._network_idle.set()
 
-        if self.context is None:
-            self.context = await self.browser.new_context()
+        def on_request(request: Request):
+            if page is self.page and request.resource_type not in IGNORED_RESOURCE_TYPES:
+                self._inflight_requests.add(request)
+                self._network_idle.clear()
 
-        if self.page is None:
-            self.page = await self.context.new_page()
-            await self.page.set_viewport_size(
-                {"width": self.width, "height": self.height}
-            )
-            await self.page.goto(
-                "https://bing.com", wait_until="domcontentloaded", timeout=60000
-            )
-            await self._setup_popup_handler()
+        def on_request_done(request: Request):
+            self._inflight_requests.discard(request)
+            if not self._inflight_requests:
+                self._network_idle.set()
+
+        page.on("request", on_request)
+        page.on("requestfinished", on_request_done)
+        page.on("requestfailed", on_request_done)
 
     async def _setup_popup_handler(self):
         """Set up event listener for popups."""
@@ -108,6 +171,7 @@ class Browser(CUATarget):
             logger.info("New popup detected, switching to it")
             await popup.wait_for_load_state("domcontentloaded")
             self.page = popup
+            self._track_network(popup)
             logger.info(f"Switched to popup with title: {await popup.title()}")
             await self._setup_popup_handler()
 
@@ -119,25 +183,73 @@ class Browser(CUATarget):
         if enabled and self.page:
             await self._setup_popup_handler()
 
+    async def export_state(self) -> dict | None:
+        """The cookies, local storage and url needed to open the browser where it was."""
+        if self.context is None or self.page is None:
+            return None
+        try:
+            return {
+                "url": self.page.url,
+                "storage_state": await self.context.storage_state(),
+            }
+        except PlaywrightError as e:
+            logger.warning(f"Could not export the browser state: {e}")
+            return None
+
     async def cleanup(self):
         """Clean up browser resources."""
-        if self.browser:
-            await self.browser.close()
-            self.browser = None
-        if self.playwright:
-            await self.playwright.stop()
-            self.playwright = None
+        if self.context:
+            await self.pool.release(self.context)
+        if self._owns_pool:
+            await self.pool.close()
+        if self.screenshot_sink:
+            await self.screenshot_sink.close()
         self.context = None
         self.page = None
 
-    async def take_screenshot(self) -> Screenshot:
-        return await self._screenshot_and_save("screenshot.png")
+    async def wait_for_settle(self, max_wait: float | None = None) -> bool:
+        """Wait until the network is idle and the DOM stopped changing, within a time budget."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (self.settle_timeout if max_wait is None else max_wait)
+        try:
+            await asyncio.wait_for(
+                self._network_idle.wait(), timeout=deadline - loop.time()
+            )
+        except asyncio.TimeoutError:
+            logger.debug("Network still busy: %d requests", len(self._inflight_requests))
+            return False
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            return False
+        try:
+            return await self.page.evaluate(
+                SETTLE_SCRIPT,
+                [int(self.settle_quiet_period * 1000), int(remaining * 1000)],
+            )
+        except PlaywrightError:
+            # The page navigated while we were waiting, wait for the new document instead
+            try:
+                await self.page.wait_for_load_state(
+                    "domcontentloaded", timeout=max(deadline - loop.time(), 0) * 1000
+                )
+            except PlaywrightError:
+                pass
+            return False
 
-    async def _screenshot_and_save(self, screenshot_name: str) -> Screenshot:
-        screenshot = await self.page.screenshot()
-        with open(screenshot_name, "wb") as f:
-            f.write(screenshot)
-        return Screenshot(screenshot)
+    async def take_screenshot(self, clip: dict | None = None) -> Screenshot:
+        """Capture the viewport, or the `clip` rectangle ({x, y, width, height}) of it."""
+        options = {"type": self.screenshot_format, "scale": self.screenshot_scale}
+        if self.screenshot_format == "jpeg" and self.screenshot_quality is not None:
+            options["quality"] = self.screenshot_quality
+        if clip:
+            options["clip"] = clip
+        screenshot = Screenshot(
+            await self.page.screenshot(**options),
+            mime_type=f"image/{self.screenshot_format}",
+        )
+        if self.screenshot_sink:
+            self.screenshot_sink.submit(screenshot)
+        return screenshot
 
     async def _take_action(self, action: Action) -> Screenshot | None:
         if action.type == "click":
@@ -148,10 +260,10 @@ class Browser(CUATarget):
             path = action.path
             if not path:
                 return
-            await self.page.mouse.move(path[0]["x"], path[0]["y"])
+            await self.page.mouse.move(path[0].x, path[0].y)
             await self.page.mouse.down()
             for point in path[1:]:
-                await self.page.mouse.move(point["x"], point["y"])
+                await self.page.mouse.move(point.x, point.y)
             await self.page.mouse.up()
         elif action.type == "keypress":
             for key in action.keys:
@@ -164,11 +276,12 @@ class Browser(CUATarget):
         elif action.type == "type":
             await self.page.keyboard.type(action.text)
         elif action.type == "wait":
-            await asyncio.sleep(1)  # Keep this async for the wait action
+            pass  # Settling below waits for as long as the page keeps changing
         elif action.type == "screenshot":
             return await self.take_screenshot()
         else:
             raise ValueError(f"Invalid action: {action.type}")
+        await self.wait_for_settle()
 
     async def handle_tool_call(
         self, action: Action | ResponseFunctionToolCall
@@ -178,9 +291,11 @@ class Browser(CUATarget):
             args = json.loads(action.arguments)
             if action.name == "navigate":
                 await self.navigate(args["url"])
+                await self.wait_for_settle()
                 return "Done!"
             elif action.name == "go_back":
                 await self.go_back()
+                await self.wait_for_settle()
                 return "Done!"
             raise ValueError("Browser does not support additional action types")
         return await self._take_action(action)
@@ -0,0 +1,208 @@
+import asyncio
+import logging
+
+from playwright.async_api import Browser as PlaywrightBrowser
+from playwright.async_api import BrowserContext, Page, Playwright, async_playwright
+from playwright.async_api import Error as PlaywrightError
+
+logger = logging.getLogger(__name__)
+
+LAUNCH_OPTIONS = {
+    "headless": False,
+    "chromium_sandbox": True,
+    "env": {},
+    "args": ["--disable-extensions", "--disable-file-system"],
+}
+
+
+class BrowserPoolExhausted(Exception):
+    """Raised when every browser already holds its maximum number of contexts."""
+
+
+class PooledBrowser:
+    """A Chromium process in the pool and the contexts it currently hosts."""
+
+    def __init__(self, browser: PlaywrightBrowser):
+        self.browser = browser
+        self.contexts: set[BrowserContext] = set()
+        # A context with a page already at the start url, ready for the next session
+        self.spare: tuple[BrowserContext, Page] | None = None
+        self.warming: asyncio.Task | None = None
+
+    @property
+    def load(self) -> int:
+        return len(self.contexts) + (1 if self.spare or self.warming else 0)
+
+
+class BrowserPool:
+    """
+    Keeps `size` Chromium processes running and hands out an isolated BrowserContext
+    to each session, so only the first session pays for the Playwright driver and the
+    browser start. Each browser hosts at most `max_contexts_per_browser` contexts and
+    keeps a spare one loaded at `start_url`, when all are full sessions wait up to
+    `acquire_timeout` seconds for a context to be released.
+    """
+
+    def __init__(
+        self,
+        size: int = 1,
+        max_contexts_per_browser: int = 4,
+        start_url: str | None = "https://bing.com",
+        width: int = 1024,
+        height: int = 768,
+        acquire_timeout: float = 30,
+    ):
+        self.size = max(size, 1)
+        self.max_contexts_per_browser = max(max_contexts_per_browser, 1)
+        self.start_url = start_url
+        self.viewport = {"width": width, "height": height}
+        self.acquire_timeout = acquire_timeout
+        self._playwright: Playwright | None = None
+        self._browsers: list[PooledBrowser] = []
+        self._owners: dict[BrowserContext, PooledBrowser] = {}
+        self._lock = asyncio.Lock()
+        # Notified whenever a slot frees up or a spare context becomes ready
+        self._released = asyncio.Condition(self._lock)
+
+    async def start(self) -> None:
+        """Start the Playwright driver and launch every browser of the pool."""
+        async with self._lock:
+            await self._start()
+
+    async def _start(self) -> None:
+        if self._playwright is None:
+            self._playwright = await async_playwright().start()
+        self._browsers = [b for b in self._browsers if b.browser.is_connected()]
+        missing = self.size - len(self._browsers)
+        if missing <= 0:
+            return
+        launched = await asyncio.gather(
+            *(self._playwright.chromium.launch(**LAUNCH_OPTIONS) for _ in range(missing))
+        )
+        for browser in launched:
+            pooled = PooledBrowser(browser)
+            self._browsers.append(pooled)
+            self._warm(pooled)
+        logger.info("Browser pool running %d browsers", len(self._browsers))
+
+    async def acquire(
+        self,
+        width: int | None = None,
+        height: int | None = None,
+        storage_state: dict | None = None,
+        url: str | None = None,
+    ) -> tuple[BrowserContext, Page]:
+        """
+        Return a new context and its first page, opened at `url` or the start url.
+        A spare context is handed out when one with the same viewport is ready,
+        unless the context must be restored with the cookies and local storage of
+        `storage_state`.
+        """
+        viewport = {
+            "width": width or self.viewport["width"],
+            "height": height or self.viewport["height"],
+        }
+        url = url or self.start_url
+        use_spare = viewport == self.viewport and storage_state is None and url == self.start_url
+        try:
+            async with asyncio.timeout(self.acquire_timeout), self._released:
+                while True:
+                    await self._start()
+                    if use_spare:
+                        pooled = min(self._browsers, key=lambda b: b.load)
+                        if pooled.spare:
+                            context, page = pooled.spare
+                            pooled.spare = None
+                            self._assign(pooled, context)
+                            self._warm(pooled)
+                            return context, page
+                    else:
+                        # The spare is of no use for this context, but its slot is
+                        pooled = min(self._browsers, key=lambda b: len(b.contexts))
+                        if pooled.spare and pooled.load >= self.max_contexts_per_browser:
+                            await self._discard_spare(pooled)
+                    if pooled.load < self.max_contexts_per_browser:
+                        context = await pooled.browser.new_context(
+                            viewport=viewport, storage_state=storage_state
+                        )
+                        self._assign(pooled, context)
+                        break
+                    await self._released.wait()
+        except TimeoutError:
+            raise BrowserPoolExhausted(
+                f"All {len(self._browsers)} browsers are busy. Please try again in a few minutes."
+            )
+        try:
+            page = await context.new_page()
+            if url:
+                await page.goto(url, wait_until="domcontentloaded", timeout=60000)
+        except BaseException:
+            await self.release(context)
+            raise
+        return context, page
+
+    async def release(self, context: BrowserContext) -> None:
+        """Close a context handed out by `acquire` and free its slot."""
+        pooled = self._owners.pop(context, None)
+        if pooled:
+            pooled.contexts.discard(context)
+        try:
+            await context.close()
+        except PlaywrightError as e:
+            logger.debug(f"Error closing browser context: {e}")
+        if pooled and pooled.spare is None and pooled.warming is None:
+            self._warm(pooled)
+        async with self._released:
+            self._released.notify_all()
+
+    async def close(self) -> None:
+        async with self._lock:
+            for pooled in self._browsers:
+                if pooled.warming:
+                    pooled.warming.cancel()
+                try:
+                    await pooled.browser.close()
+                except PlaywrightError:
+                    pass
+            self._browsers = []
+            self._owners.clear()
+            if self._playwright:
+                await self._playwright.stop()
+                self._playwright = None
+
+    def _assign(self, pooled: PooledBrowser, context: BrowserContext) -> None:
+        pooled.contexts.add(context)
+        self._owners[context] = pooled
+
+    async def _discard_spare(self, pooled: PooledBrowser) -> None:
+        context, _ = pooled.spare
+        pooled.spare = None
+        try:
+            await context.close()
+        except PlaywrightError as e:
+            logger.debug(f"Error closing the spare browser context: {e}")
+
+    def _warm(self, pooled: PooledBrowser) -> None:
+        """Prepare a spare context in the background if the browser has room for one."""
+        if self.start_url is None or pooled.load >= self.max_contexts_per_browser:
+            return
+        pooled.warming = asyncio.create_task(self._prepare_spare(pooled))
+
+    async def _prepare_spare(self, pooled: PooledBrowser) -> None:
+        context = None
+        try:
+            context = await pooled.browser.new_context(viewport=self.viewport)
+            page = await context.new_page()
+            await page.goto(self.start_url, wait_until="domcontentloaded", timeout=60000)
+            pooled.spare = (context, page)
+        except PlaywrightError as e:
+            logger.warning(f"Could not prepare a spare browser context: {e}")
+            if context:
+                try:
+                    await context.close()
+                except PlaywrightError:
+                    pass
+        finally:
+            pooled.warming = None
+        async with self._released:
+            self._released.notify_all()
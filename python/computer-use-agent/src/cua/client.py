@@ -1,15 +1,37 @@
+import importlib.util
 import logging
 
-from openai import AsyncAzureOpenAI, AsyncOpenAI
+import httpx
+from openai import AsyncAzureOpenAI, AsyncOpenAI, DefaultAsyncHttpxClient
 
 from config import Config
 
 # Get logger for this module
 logger = logging.getLogger(__name__)
 
+# One client per process, so every step reuses the same warm connection pool
+_client: tuple[AsyncOpenAI, str] | None = None
+
+
+def _build_http_client() -> httpx.AsyncClient:
+    # httpx only speaks HTTP/2 when the optional h2 package is installed
+    http2 = Config.OPENAI_HTTP2 and importlib.util.find_spec("h2") is not None
+    return DefaultAsyncHttpxClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=Config.OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=Config.OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=Config.OPENAI_KEEPALIVE_EXPIRY,
+        ),
+    )
+
 
 def setup_openai_client():
-    """Set up and return the appropriate OpenAI client based on configuration."""
+    """Return the shared OpenAI client and model, creating them on first use."""
+    global _client
+    if _client is not None:
+        return _client
+
     if Config.AZURE_OPENAI_API_KEY:
         logger.info("Using Azure OpenAI")
         client = AsyncAzureOpenAI(
@@ -17,15 +39,26 @@ def setup_openai_client():
             azure_deployment=Config.AZURE_OPENAI_DEPLOYMENT,
             api_version=Config.AZURE_OPENAI_API_VERSION,
             api_key=Config.AZURE_OPENAI_API_KEY,
+            http_client=_build_http_client(),
         )
         model = Config.AZURE_OPENAI_DEPLOYMENT
     else:
-        logger.info(
-            "Using OpenAI for computer use using key: %s", Config.OPENAI_API_KEY
-        )
+        logger.info("Using OpenAI for computer use")
         client = AsyncOpenAI(
             api_key=Config.OPENAI_API_KEY,
+            http_client=_build_http_client(),
         )
         model = "computer-use-preview"
 
-    return client, model
+    _client = client, model
+    return _client
+
+
+async def close_openai_client() -> None:
+    """Close the shared client and its connections, e.g. when the app stops."""
+    global _client
+    if _client is None:
+        return
+    client, _ = _client
+    _client = None
+    await client.close()
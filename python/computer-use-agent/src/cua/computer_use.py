@@ -1,13 +1,25 @@
+import asyncio
 import base64
 import logging
+from typing import Awaitable, Callable
 
 from openai.types.responses.response import Response
 from openai.types.responses.tool_param import ToolParam
 
 from cua.client import setup_openai_client
-from cua.cua_target import CUATarget
-from cua.utils import retry_async_operation
+from cua.cua_target import CUATarget, Screenshot
+from cua.hedging import HedgePolicy, hedged_call
+from cua.scaled_cua_target import ScaledCUATarget
+from cua.screenshot_policy import ScreenshotPolicy
+from cua.trajectory import Trajectory, TrajectoryRecorder, TrajectoryStore
+from cua.utils import (
+    RETRYABLE_STREAM_ERROR_CODES,
+    ResponseStreamError,
+    RetryPolicy,
+    retry_async_operation,
+)
 from storage.cua_session import CuaSession
+from storage.response_journal import ResponseJournal
 
 # Get logger for this module
 logger = logging.getLogger(__name__)
@@ -16,11 +28,63 @@ logger = logging.getLogger(__name__)
 class ComputerUse:
     """ComputerUse loop to start and continue task execution"""
 
-    def __init__(self, target: CUATarget, session: CuaSession):
-        self.target = target
+    def __init__(
+        self,
+        target: CUATarget,
+        session: CuaSession,
+        screenshot_policy: ScreenshotPolicy | None = None,
+        stream: bool = False,
+        on_text: Callable[[str], Awaitable[None]] | None = None,
+        retry_policy: RetryPolicy | None = None,
+        hedge_policy: HedgePolicy | None = None,
+        journal: ResponseJournal | None = None,
+        trajectories: TrajectoryStore | None = None,
+        replay: bool = False,
+    ):
+        self.target = self._apply_screenshot_policy(target, screenshot_policy)
         self.session = session
-        self.client, self.model = setup_openai_client()
+        # Stream responses to start actions before the rest of the response arrives
+        self.stream = stream
+        # Receives the reasoning or message text streamed so far
+        self.on_text = on_text
+        self.retry_policy = retry_policy or RetryPolicy()
+        # Send a second copy of slow requests, streamed ones are never hedged since
+        # both copies would start the action
+        self.hedge_policy = hedge_policy
+        # Keeps the raw responses, the session only keeps what it parsed from them
+        self.journal = journal
+        # Tasks are recorded in the store, and with `replay` the recorded actions of
+        # a task are repeated while the screen still looks the same
+        self.trajectories = trajectories
+        self.replay = replay
+        self._recorder: TrajectoryRecorder | None = None
+        self._last_screenshot: Screenshot | None = None
+        client, self.model = setup_openai_client()
+        # Retries are left to the policy, the client would otherwise retry on its own
+        self.client = client.with_options(max_retries=0)
         self.step_count = 0
+        # Mime type and base64 of the last screenshot sent, reused while the screen is unchanged
+        self._last_screenshot_data: tuple[str, str] | None = None
+
+    @staticmethod
+    def _apply_screenshot_policy(
+        target: CUATarget, policy: ScreenshotPolicy | None
+    ) -> CUATarget:
+        """
+        Make the target produce screenshots as the policy asks. The computer tool
+        advertises the target's size, so the model's coordinates always match the
+        screenshots it sees and the scaled target maps them back to the screen.
+        """
+        if policy is None:
+            return target
+        if isinstance(target, ScaledCUATarget):
+            target.width, target.height = policy.fit_size(target.width, target.height)
+            target.policy = policy
+            return target
+        if policy.is_default:
+            return target
+        width, height = policy.fit_size(target.width, target.height)
+        return ScaledCUATarget(width, height, target, policy=policy)
 
     def _build_computer_use_tool(self) -> list[ToolParam]:
         default_tools = [
@@ -37,14 +101,55 @@ class ComputerUse:
     async def start_task(self, user_message: str):
         logger.info("Starting task...")
         tools = self._build_computer_use_tool()
-        response = await self.client.responses.create(
-            model=self.model, input=user_message, tools=tools, truncation="auto"
+
+        if self.trajectories:
+            key = self.trajectories.key(
+                user_message, self.target.environment, self.target.width, self.target.height
+            )
+            self._recorder = self.trajectories.recorder(key, user_message)
+            # The screen the first action is taken on
+            self._last_screenshot = await self.target.take_screenshot()
+            trajectory = await self.trajectories.load(key) if self.replay else None
+            replayed = await self._replay(trajectory) if trajectory else 0
+            if replayed:
+                user_message = (
+                    f"{user_message}\n\nThe first {replayed} actions of this task were "
+                    "already performed, continue from the current screen."
+                )
+
+        async def create_response(timeout: float):
+            return await self.client.responses.create(
+                model=self.model,
+                input=user_message,
+                tools=tools,
+                timeout=timeout,
+                truncation="auto",
+            )
+
+        response = await retry_async_operation(
+            operation=create_response, policy=self.retry_policy
         )
         logger.debug("Response received: %s", response)
-        self.session.add_step(response, None)
+        self._add_step(response, None)
         self.step_count = 0
         logger.info("Task initialization completed")
 
+    async def close(self) -> None:
+        """
+        Wait for an action started while streaming that the run did not get to, and
+        drop the recording of a task that did not get to an end in this run.
+        """
+        step = self.session.current_step
+        if step and step.action_task:
+            task, step.action_task = step.action_task, None
+            try:
+                await task
+            except Exception as e:
+                logger.error(f"Streamed action failed: {e}")
+        if self._recorder:
+            await self._recorder.discard()
+            self._recorder = None
+
     def requires_user_input(self):
         return self.session.current_step.next_action == "user_interaction"
 
@@ -57,16 +162,47 @@ class ComputerUse:
         screenshot: str | None = None
         previous_response_id = self.session.current_step.response_id
         screenshot_base64: str | None = None
+        screenshot_mime_type = "image/png"
 
         if self.session.current_step.next_action == "computer_call_output":
-            action = self.session.current_step.call_action
-            screenshot = await self.target.handle_tool_call(action)
+            step = self.session.current_step
+            action = step.call_action
+            if step.action_task:
+                # The action was started while its response was still streaming
+                task, step.action_task = step.action_task, None
+                screenshot = await task
+            elif step.action_executed:
+                # It ran before the run stopped, only its result is missing
+                logger.info("Action already executed, taking a new screenshot")
+                screenshot = None
+            else:
+                step.action_executed = True
+                self.session.notify_changed()
+                screenshot = await self.target.handle_tool_call(action)
             if not screenshot:
                 screenshot = await self.target.take_screenshot()
-            screenshot_base64 = base64.b64encode(screenshot).decode("utf-8")
-            logger.debug("screenshot %s...", screenshot_base64[:20])
-            # Store the screenshot in the session
-            self.session.current_step.screenshot = screenshot_base64
+            if self._recorder and self._last_screenshot is not None:
+                await self._recorder.record(
+                    action,
+                    self._last_screenshot,
+                    screenshot,
+                    safety_checks=bool(self.session.current_step.pending_safety_checks),
+                )
+            self._last_screenshot = screenshot
+            if self.target.screen_changed or self._last_screenshot_data is None:
+                self._last_screenshot_data = (
+                    getattr(screenshot, "mime_type", screenshot_mime_type),
+                    base64.b64encode(screenshot).decode("utf-8"),
+                )
+            else:
+                # Nothing moved on screen, the previous encoding is still accurate
+                logger.debug("Screen unchanged, reusing the previous screenshot")
+            screenshot_mime_type, screenshot_base64 = self._last_screenshot_data
+            logger.debug(
+                "screenshot %s... changed regions: %s",
+                screenshot_base64[:20],
+                self.target.changed_regions,
+            )
         if self.session.current_step.next_action == "reasoning":
             # For reasoning, we send back the reasoning content
             data = self.session.current_step.call_action
@@ -79,7 +215,7 @@ class ComputerUse:
                     "call_id": self.session.current_step.call_id,
                     "output": {
                         "type": "input_image",
-                        "image_url": f"data:image/png;base64,{screenshot_base64}",
+                        "image_url": f"data:{screenshot_mime_type};base64,{screenshot_base64}",
                     },
                 }
             ]
@@ -91,6 +227,8 @@ class ComputerUse:
             # Handle functional call output
             action = self.session.current_step.call_action
             result = await self.target.handle_tool_call(action)
+            if self._recorder and self._last_screenshot is not None:
+                await self._recorder.record(action, self._last_screenshot, None)
             data = [
                 {
                     "type": "function_call_output",
@@ -102,17 +240,33 @@ class ComputerUse:
         tools = self._build_computer_use_tool()
         logger.debug("Creating next response...")
 
+        action_task: asyncio.Task | None = None
+
         # Define the operation to retry
-        async def create_response():
-            return await self.client.responses.create(
-                model=self.model,
+        async def create_response(timeout: float):
+            nonlocal action_task
+            if not self.stream:
+                def request():
+                    return self.client.responses.create(
+                        model=self.model,
+                        previous_response_id=previous_response_id,
+                        input=data,
+                        tools=tools,
+                        timeout=timeout,
+                        truncation="auto",
+                        parallel_tool_calls=False,
+                    )
+
+                if self.hedge_policy:
+                    return await hedged_call(request, self.hedge_policy)
+                return await request()
+            response, action_task = await self._stream_response(
                 previous_response_id=previous_response_id,
                 input=data,
                 tools=tools,
-                timeout=10,
-                truncation="auto",
-                parallel_tool_calls=False,
+                timeout=timeout,
             )
+            return response
 
         # Define the check function
         def validate_response(response: Response):
@@ -120,8 +274,119 @@ class ComputerUse:
 
         # Use the retry function
         next_response = await retry_async_operation(
-            operation=create_response, max_retries=3, check_result=validate_response
+            operation=create_response,
+            check_result=validate_response,
+            policy=self.retry_policy,
         )
 
         logger.info("Next response created: %s", next_response)
-        self.session.add_step(next_response, screenshot_base64)
+        self._add_step(next_response, screenshot_base64)
+        if action_task:
+            step = self.session.current_step
+            step.action_executed = True
+            if step.next_action == "computer_call_output":
+                step.action_task = action_task
+            else:
+                # The response went on after the call, e.g. with a message, so the
+                # model will not ask for the action's result
+                logger.warning("Streamed action is not part of the next step")
+                await action_task
+
+    def _add_step(self, response: Response, screenshot_base64: str | None) -> None:
+        self.session.add_step(response, screenshot_base64)
+        if self.journal:
+            self.journal.submit(self.session.id, response)
+        if self._recorder and self.requires_user_input():
+            # The task is done or needs the user, what it did so far can be replayed
+            self.trajectories.save_in_background(self._recorder)
+            self._recorder = None
+
+    async def _replay(self, trajectory: Trajectory) -> int:
+        """
+        Repeat the recorded actions as long as the screen matches the one each action
+        was taken on. Returns how many actions were replayed.
+        """
+        screenshot = self._last_screenshot
+        replayed = 0
+        for step in trajectory.steps:
+            if step.safety_checks:
+                break
+            screen = await self._recorder.screen_hash(screenshot)
+            if not self.trajectories.matches(screen, step.before):
+                logger.info(f"Screen differs from the recording at action {replayed + 1}")
+                break
+            result = await self.target.handle_tool_call(step.action)
+            after = result if isinstance(result, bytes) else await self.target.take_screenshot()
+            await self._recorder.record(step.action, screenshot, after)
+            screenshot = after
+            replayed += 1
+        self._last_screenshot = screenshot
+        logger.info(f"Replayed {replayed} of {len(trajectory.steps)} recorded actions")
+        return replayed
+
+    async def _stream_response(
+        self, **kwargs
+    ) -> tuple[Response, asyncio.Task | None]:
+        """
+        Stream the next response. A computer action is handed to the target as soon
+        as its output item is complete, unless it needs a safety check first.
+        Returns the full response and the task running the action, if one started.
+        """
+        stream = await self.client.responses.create(
+            model=self.model,
+            truncation="auto",
+            parallel_tool_calls=False,
+            stream=True,
+            **kwargs,
+        )
+        action_task: asyncio.Task | None = None
+        text = ""
+        response: Response | None = None
+        try:
+            async for event in stream:
+                if event.type in (
+                    "response.output_text.delta",
+                    "response.reasoning_summary_text.delta",
+                ):
+                    text += event.delta
+                    if self.on_text:
+                        await self.on_text(text)
+                elif event.type == "response.output_item.done":
+                    item = event.item
+                    if (
+                        item.type == "computer_call"
+                        and not getattr(item, "pending_safety_checks", None)
+                        and action_task is None
+                    ):
+                        logger.debug("Starting streamed action: %s", item.action)
+                        action_task = asyncio.create_task(
+                            self.target.handle_tool_call(item.action)
+                        )
+                elif event.type == "response.completed":
+                    response = event.response
+                elif event.type == "response.incomplete":
+                    details = event.response.incomplete_details
+                    raise ResponseStreamError(
+                        f"Response incomplete: {details.reason if details else 'unknown'}",
+                        retryable=True,
+                    )
+                elif event.type == "response.failed":
+                    error = event.response.error
+                    raise ResponseStreamError(
+                        f"Response failed: {error}",
+                        retryable=bool(error) and error.code in RETRYABLE_STREAM_ERROR_CODES,
+                    )
+                elif event.type == "error":
+                    raise ResponseStreamError(
+                        f"Response stream error: {event.message}",
+                        retryable=event.code in RETRYABLE_STREAM_ERROR_CODES,
+                    )
+            if response is None:
+                raise RuntimeError("Response stream ended before the response completed")
+        except Exception as e:
+            if action_task is None:
+                raise
+            # The action already ran, sending the request again would repeat it
+            await action_task
+            raise RuntimeError(f"Response stream failed after its action started: {e}") from e
+        return response, action_task
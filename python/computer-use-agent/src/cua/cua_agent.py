@@ -1,7 +1,9 @@
 import asyncio
 import logging
+import os
 import signal
 import traceback
+from functools import partial
 
 from microsoft_teams.api import ConversationReference, MessageActivityInput
 from microsoft_teams.api.models.attachment.attachment import Attachment
@@ -9,22 +11,160 @@ from openai.types.responses.response_function_tool_call import (
     ResponseFunctionToolCall,
 )
 
+from card_budget import THUMBNAIL_MIME_TYPE, fit_card
 from cards import (
     ProgressStepDict,
     create_cua_progress_card,
     create_error_card,
     create_safety_check_card,
+    render_history_step,
 )
 from config import Config
 from cua.browser.browser import Browser
+from cua.browser.browser_pool import BrowserPool
 from cua.computer_use import ComputerUse
 from cua.cua_target import CUATarget
+from cua.hedging import HedgePolicy
+from cua.image_pipeline import ImagePipeline
 from cua.scaled_cua_target import ScaledCUATarget
+from cua.screenshot_policy import ScreenshotPolicy
+from cua.screenshot_sink import ScreenshotSink
+from cua.trajectory import TrajectoryStore
+from cua.utils import RetryPolicy
+from cua.vnc.desktop_pool import DesktopPool
 from cua.vnc.machine import Machine
+from cua.vnc.motion import MotionPlanner
+from cua.vnc.vnc import VNCMachine
+from progress_updater import ConversationRateLimiter, ProgressCardUpdater
 from storage.cua_session import CuaSession
+from storage.response_journal import ResponseJournal
 
 logger = logging.getLogger(__name__)
 
+_desktop_pool: DesktopPool | None = None
+_browser_pool: BrowserPool | None = None
+# Shared by every agent so the limit holds per conversation, not per run
+_card_rate_limiter = ConversationRateLimiter(Config.CARD_UPDATES_PER_SECOND)
+# Shared so timeouts adapt to the latencies seen across all sessions
+_retry_policy = RetryPolicy(
+    max_attempts=Config.RETRY_MAX_ATTEMPTS,
+    base_delay=Config.RETRY_BASE_DELAY,
+    max_delay=Config.RETRY_MAX_DELAY,
+    deadline=Config.RETRY_DEADLINE,
+    min_timeout=Config.RESPONSE_TIMEOUT_MIN,
+    max_timeout=Config.RESPONSE_TIMEOUT_MAX,
+)
+# Raw model responses are only kept on disk, when a directory is configured
+_response_journal = (
+    ResponseJournal(Config.RESPONSE_JOURNAL_DIR) if Config.RESPONSE_JOURNAL_DIR else None
+)
+# Completed tasks are recorded, and replayed when the same task is asked again
+_trajectories = (
+    TrajectoryStore(Config.TRAJECTORY_DIR, max_distance=Config.TRAJECTORY_MAX_DISTANCE)
+    if Config.TRAJECTORY_DIR
+    else None
+)
+_hedge_policy = (
+    HedgePolicy(
+        percentile=Config.HEDGE_PERCENTILE,
+        min_delay=Config.HEDGE_MIN_DELAY,
+        budget=Config.HEDGE_BUDGET,
+    )
+    if Config.HEDGE_REQUESTS
+    else None
+)
+
+
+def _create_vnc_machine(address: str) -> VNCMachine:
+    return VNCMachine(
+        address,
+        Config.VNC_PASSWORD,
+        motion_planner=MotionPlanner(
+            mode=Config.VNC_MOUSE_MOTION,
+            max_steps=Config.VNC_MOUSE_MAX_STEPS,
+            max_duration=Config.VNC_MOUSE_MAX_DURATION,
+        ),
+        typing_mode=Config.VNC_TYPING_MODES.get(address, Config.VNC_TYPING_MODE),
+        key_delay=Config.VNC_KEY_DELAY,
+        paste_keys=Config.VNC_PASTE_KEYS,
+        scroll_pixels_per_click=Config.VNC_SCROLL_PIXELS_PER_CLICK,
+        calibrate_scroll=Config.VNC_SCROLL_CALIBRATE,
+        reset_keys=Config.VNC_RESET_KEYS,
+    )
+
+
+def get_desktop_pool() -> DesktopPool:
+    """Return the pool of VNC desktops shared by all sessions."""
+    global _desktop_pool
+    if _desktop_pool is None:
+        _desktop_pool = DesktopPool(
+            Config.VNC_ADDRESSES,
+            _create_vnc_machine,
+            acquire_timeout=Config.VNC_POOL_ACQUIRE_TIMEOUT,
+            max_waiters=Config.VNC_POOL_MAX_WAITERS,
+            health_check_interval=Config.VNC_POOL_HEALTH_CHECK_INTERVAL,
+        )
+    return _desktop_pool
+
+
+def get_browser_pool() -> BrowserPool:
+    """Return the pool of Chromium processes shared by all browser sessions."""
+    global _browser_pool
+    if _browser_pool is None:
+        _browser_pool = BrowserPool(
+            size=Config.BROWSER_POOL_SIZE,
+            max_contexts_per_browser=Config.BROWSER_POOL_MAX_CONTEXTS,
+            start_url=Config.BROWSER_START_URL or None,
+            acquire_timeout=Config.BROWSER_POOL_ACQUIRE_TIMEOUT,
+        )
+    return _browser_pool
+
+
+async def start_shared_resources() -> None:
+    """Start the browser or desktop pool, so the first session does not wait for it."""
+    try:
+        if Config.USE_BROWSER:
+            await get_browser_pool().start()
+        else:
+            await get_desktop_pool().start()
+    except Exception as e:
+        logger.warning(f"Could not start the pool, sessions will retry: {e}")
+
+
+async def close_shared_resources() -> None:
+    """Close the desktop and browser pools, e.g. when the app stops."""
+    global _desktop_pool, _browser_pool
+    if _desktop_pool:
+        await _desktop_pool.close()
+        _desktop_pool = None
+    if _browser_pool:
+        await _browser_pool.close()
+        _browser_pool = None
+    if _response_journal:
+        await _response_journal.close()
+    if _trajectories:
+        await _trajectories.close()
+    if _hedge_policy:
+        stats = _hedge_policy.stats
+        logger.info(f"Hedged requests: {stats}, hedge win rate {stats.hedge_win_rate:.0%}")
+
+
+def describe_action(call_action) -> str:
+    """Return a short description of a step's action for the progress card."""
+    if not call_action:
+        return "No action"
+    if isinstance(call_action, ResponseFunctionToolCall):
+        # For dict actions (like navigate, go_back), use the name
+        return call_action.name
+    if call_action.type == "reasoning":
+        # concatenate the reasoning content
+        if call_action.content:
+            content = "\n".join([item.text for item in call_action.content])
+            return content if content else "Reasoning"
+        return "Reasoning"
+    # For standard Action type, use the type field
+    return call_action.type
+
 
 class ComputerUseAgent:
     def __init__(
@@ -33,7 +173,14 @@ class ComputerUseAgent:
         self._app = app
         self._conversation_ref = conversation_ref
         self._session = session
-        self._activity_id = activity_id
+        self._last_streamed_update = 0.0
+        # Progress cards are sent in the background, the loop never waits on Teams
+        self._progress = ProgressCardUpdater(
+            self._send_progress_card,
+            activity_id,
+            conversation_id=conversation_ref.conversation.id,
+            rate_limiter=_card_rate_limiter,
+        )
 
     async def _send_activity(self, activity: MessageActivityInput):
         """Send or update an activity via the app's activity sender."""
@@ -58,9 +205,29 @@ class ComputerUseAgent:
         loop = asyncio.get_running_loop()
         loop.add_signal_handler(signal.SIGINT, signal_handler)
 
+        agent: ComputerUse | None = None
         try:
             cua_target = await self._build_cua_target()
-            agent = ComputerUse(cua_target, self._session)
+            agent = ComputerUse(
+                cua_target,
+                self._session,
+                screenshot_policy=ScreenshotPolicy(
+                    format=Config.IMAGE_FORMAT,
+                    quality=Config.IMAGE_QUALITY,
+                    max_width=Config.SCREENSHOT_MAX_WIDTH,
+                    max_height=Config.SCREENSHOT_MAX_HEIGHT,
+                    adaptive=Config.SCREENSHOT_ADAPTIVE,
+                    small_change_ratio=Config.SCREENSHOT_SMALL_CHANGE_RATIO,
+                    small_change_quality=Config.SCREENSHOT_SMALL_CHANGE_QUALITY,
+                ),
+                stream=Config.STREAM_RESPONSES,
+                on_text=self._on_streamed_text,
+                retry_policy=_retry_policy,
+                hedge_policy=_hedge_policy,
+                journal=_response_journal,
+                trajectories=_trajectories,
+                replay=Config.TRAJECTORY_REPLAY,
+            )
 
             user_message = task
             if self._session.current_step or self._session.status in (
@@ -126,6 +293,12 @@ class ComputerUseAgent:
         finally:
             # Remove the signal handler
             loop.remove_signal_handler(signal.SIGINT)
+            if agent:
+                await agent.close()
+            # Make sure the final state of the run reaches the card
+            await self._progress.close()
+            # Snapshot the status the run ended with, e.g. paused or errored
+            self._session.notify_changed()
 
     async def _build_cua_target(self) -> CUATarget:
         width = 1024  # Default width
@@ -134,96 +307,125 @@ class ComputerUseAgent:
         if Config.USE_BROWSER:
             if self._session.browser is None:
                 # Create new browser instance if none exists
-                self._session.browser = Browser(width=width, height=height)
-            # Initialize the browser (will reuse if already initialized)
-            await self._session.browser.initialize()
+                self._session.browser = Browser(
+                    width=width,
+                    height=height,
+                    settle_timeout=Config.SETTLE_TIMEOUT,
+                    settle_quiet_period=Config.SETTLE_QUIET_PERIOD,
+                    pool=get_browser_pool(),
+                    screenshot_format=Config.BROWSER_SCREENSHOT_FORMAT,
+                    screenshot_quality=Config.BROWSER_SCREENSHOT_QUALITY,
+                    screenshot_sink=(
+                        ScreenshotSink(os.path.join(Config.SCREENSHOT_DIR, self._session.id))
+                        if Config.SCREENSHOT_DIR
+                        else None
+                    ),
+                )
+            # Initialize the browser (will reuse if already initialized), a resumed
+            # session reopens the pages it was on with its cookies and local storage
+            await self._session.browser.initialize(restore_state=self._session.browser_state)
+            self._session.browser_state = None
             return self._session.browser
         else:
+            # The session keeps its desktop until it is closed or evicted
+            pool = get_desktop_pool()
+            session_id = self._session.id
+            is_new_lease = not pool.has_lease(session_id)
+            vnc = await pool.acquire(session_id)
+            if is_new_lease:
+                self._session.on_close(lambda: pool.release(session_id))
             machine = Machine(
+                vnc,
                 width=width,
                 height=height,
-                address=Config.VNC_ADDRESS,
-                password=Config.VNC_PASSWORD,
+                settle_timeout=Config.SETTLE_TIMEOUT,
+                settle_quiet_period=Config.SETTLE_QUIET_PERIOD,
+            )
+            pipeline = ImagePipeline(
+                format=Config.IMAGE_FORMAT,
+                quality=Config.IMAGE_QUALITY,
+                png_compress_level=Config.IMAGE_PNG_COMPRESS_LEVEL,
+                resample=Config.IMAGE_RESAMPLE,
+                executor=Config.IMAGE_EXECUTOR,
+                max_workers=Config.IMAGE_MAX_WORKERS,
+            )
+            return ScaledCUATarget(
+                width=width, height=height, target=machine, pipeline=pipeline
             )
-            return ScaledCUATarget(width=width, height=height, target=machine)
 
-    async def _update_progress(self, status: str | None = None):
+    async def _on_streamed_text(self, text: str):
+        """Show the text the model is generating, at most once per update interval."""
+        now = asyncio.get_running_loop().time()
+        if now - self._last_streamed_update < Config.STREAM_CARD_UPDATE_INTERVAL:
+            return
+        self._last_streamed_update = now
+        try:
+            await self._update_progress(message=text)
+        except Exception as e:
+            logger.warning(f"Could not update the progress card: {e}")
+
+    async def _update_progress(
+        self, status: str | None = None, message: str | None = None
+    ):
         """Update the Teams message with a progress card."""
         if status is not None:
             self._session.status = status
 
-        # Map the current step's action to a string representation
-        action_str = "No action"
-        if self._session.current_step.call_action:
-            if isinstance(
-                self._session.current_step.call_action, ResponseFunctionToolCall
-            ):
-                # For dict actions (like navigate, go_back), use the name
-                action_str = self._session.current_step.call_action.name
-            elif self._session.current_step.call_action.type == "reasoning":
-                # concatenate the reasoning content
-                if self._session.current_step.call_action.content:
-                    content = "\n".join(
-                        [
-                            item.text
-                            for item in self._session.current_step.call_action.content
-                        ]
-                    )
-                    action_str = content if content else "Reasoning"
-                else:
-                    action_str = "Reasoning"
-            else:
-                # For standard Action type, use the type field
-                action_str = self._session.current_step.call_action.type
-
         current_step: ProgressStepDict = {
-            "action": action_str,
+            "action": describe_action(self._session.current_step.call_action),
             "next_action": self._session.current_step.next_action,
-            "message": self._session.current_step.last_message,
+            "message": (
+                self._session.current_step.last_message if message is None else message
+            ),
         }
 
-        # Convert history to the format expected by the card
-        history: list[ProgressStepDict] = []
-        for step in self._session.history:
-            action_str = "No action"
-            if step.call_action:
-                if isinstance(step.call_action, ResponseFunctionToolCall):
-                    action_str = step.call_action.name
-                elif step.call_action.type == "reasoning":
-                    # concatenate the reasoning content
-                    if step.call_action.content:
-                        content = "\n".join(
-                            [item.text for item in step.call_action.content]
-                        )
-                        action_str = content if content else "Reasoning"
-                    else:
-                        action_str = "Reasoning"
-                else:
-                    action_str = step.call_action.type
-
-            history.append(
-                {
-                    "action": action_str,
-                    "next_action": self._session.current_step.next_action,
-                    "message": step.last_message,
-                }
+        # Only steps added since the last update need rendering
+        for step in self._session.unrendered_history():
+            self._session.add_rendered_step(
+                render_history_step(
+                    self._session.rendered_steps + 1,
+                    {
+                        "action": describe_action(step.call_action),
+                        "next_action": step.next_action,
+                        "message": step.last_message,
+                    },
+                )
             )
+        rendered_history = list(self._session.rendered_history)
 
-        card = create_cua_progress_card(
-            screenshot=self._session.current_step.screenshot_base64,
-            current_step=current_step,
-            history=history,
-            status=status,
+        history_steps = min(len(rendered_history), Config.CARD_HISTORY_STEPS)
+        screenshot = self._session.current_step.screenshot_base64
+        status = self._session.status
+        total_steps = self._session.rendered_steps
+        # Encoding the thumbnail and fitting the card happen in the updater's worker
+        card = partial(
+            fit_card,
+            lambda thumbnail, history_limit: create_cua_progress_card(
+                screenshot=thumbnail,
+                screenshot_mime_type=THUMBNAIL_MIME_TYPE,
+                current_step=current_step,
+                status=status,
+                rendered_history=rendered_history,
+                total_steps=total_steps,
+                max_history_steps=(
+                    history_steps if history_limit is None else history_limit
+                ),
+            ),
+            screenshot,
+            history_length=history_steps,
+            max_bytes=Config.CARD_MAX_BYTES,
+            thumbnail_width=Config.CARD_THUMBNAIL_WIDTH,
+            thumbnail_quality=Config.CARD_THUMBNAIL_QUALITY,
         )
 
-        if self._activity_id:
-            activity = MessageActivityInput(id=self._activity_id)
-            activity.attachments = [Attachment(content_type="application/vnd.microsoft.card.adaptive", content=card)]
-            await self._send_activity(activity)
-        else:
-            # If no activity_id, send a new message and capture the ID
-            activity = MessageActivityInput()
-            activity.attachments = [Attachment(content_type="application/vnd.microsoft.card.adaptive", content=card)]
-            result = await self._app.activity_sender.send(activity, self._conversation_ref)
-            if result:
-                self._activity_id = result.id
+        self._progress.submit(card)
+
+    async def _send_progress_card(self, card: dict, activity_id: str | None) -> str | None:
+        """Send the progress card, updating the existing message when there is one."""
+        activity = MessageActivityInput(id=activity_id) if activity_id else MessageActivityInput()
+        activity.attachments = [Attachment(content_type="application/vnd.microsoft.card.adaptive", content=card)]
+        result = await self._app.activity_sender.send(activity, self._conversation_ref)
+        if activity_id:
+            return activity_id
+        # If no activity_id, we sent a new message and capture its ID
+        return result.id if result else None
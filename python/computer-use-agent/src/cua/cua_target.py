@@ -1,14 +1,27 @@
 from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING, Callable
 
 from openai.types.responses.function_tool_param import FunctionToolParam
 from openai.types.responses.response_computer_tool_call import Action
 from openai.types.responses.response_function_tool_call import ResponseFunctionToolCall
 
+if TYPE_CHECKING:
+    from cua.image_pipeline import ImageEncoding
+
+Region = tuple[int, int, int, int]
+# Chooses how a screenshot is encoded from the regions that changed and the screen size
+ChooseEncoding = Callable[[list[Region] | None, tuple[int, int]], "ImageEncoding"]
+
 
 class Screenshot(bytes):
-    """A screenshot is just bytes."""
+    """A screenshot is just bytes, tagged with the image format they are encoded in."""
+
+    mime_type: str
 
-    pass
+    def __new__(cls, data: bytes, mime_type: str = "image/png"):
+        screenshot = super().__new__(cls, data)
+        screenshot.mime_type = mime_type
+        return screenshot
 
 
 class CUATarget(ABC):
@@ -29,11 +42,35 @@ class CUATarget(ABC):
         """Return additional tool schemas for the target."""
         return []
 
+    @property
+    def screen_changed(self) -> bool:
+        """Whether the last screenshot differs from the previous one, True when unknown."""
+        return True
+
+    @property
+    def changed_regions(self) -> list[tuple[int, int, int, int]] | None:
+        """Rectangles (x, y, width, height) that changed in the last screenshot, None if unknown."""
+        return None
+
+    async def wait_for_settle(self, max_wait: float | None = None) -> bool:
+        """Wait until the screen is stable after an action. Returns False if it never settled."""
+        return True
+
     @abstractmethod
     async def take_screenshot(self) -> Screenshot:
         """Take a screenshot of the target and return the bytes."""
         pass
 
+    async def take_fitted_screenshot(
+        self, size: tuple[int, int], choose_encoding: ChooseEncoding
+    ) -> tuple[Screenshot, tuple[int, int]] | None:
+        """
+        Take a screenshot already fitted to `size` and encoded, and return it with the
+        size of the screen. Returns None when the target only takes full size
+        screenshots, which the caller then fits itself.
+        """
+        return None
+
     @abstractmethod
     async def handle_tool_call(
         self, action: Action | ResponseFunctionToolCall
@@ -0,0 +1,92 @@
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, TypeVar
+
+from cua.utils import LatencyTracker
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+@dataclass
+class HedgeStats:
+    requests: int = 0
+    # Requests that got a second, identical request sent alongside them
+    hedged: int = 0
+    # Hedges that answered before the original request
+    hedge_won: int = 0
+    # Requests that were slow enough to hedge but the budget was used up
+    budget_exhausted: int = 0
+
+    @property
+    def hedge_win_rate(self) -> float:
+        return self.hedge_won / self.hedged if self.hedged else 0.0
+
+
+@dataclass
+class HedgePolicy:
+    """
+    When to send a second copy of a slow request. A request that has not answered
+    after the given percentile of recent latencies is hedged, at most `budget` extra
+    requests per request sent, so a slow backend is not flooded with duplicates.
+    """
+
+    percentile: float = 0.9
+    # Never hedge sooner than this many seconds
+    min_delay: float = 1.0
+    budget: float = 0.1
+    # Latencies needed before hedging starts
+    min_samples: int = 10
+    latency: LatencyTracker = field(default_factory=LatencyTracker)
+    stats: HedgeStats = field(default_factory=HedgeStats)
+
+    def delay(self) -> float | None:
+        if len(self.latency) < self.min_samples:
+            return None
+        return max(self.latency.percentile(self.percentile), self.min_delay)
+
+    def can_hedge(self) -> bool:
+        return self.stats.hedged + 1 <= self.budget * self.stats.requests
+
+
+async def hedged_call(operation: Callable[[], Awaitable[T]], policy: HedgePolicy) -> T:
+    """
+    Run the operation, and if it is still running after the policy's delay run it a
+    second time. The first one to succeed is returned and the other one is cancelled.
+    The operation must be safe to run twice.
+    """
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    policy.stats.requests += 1
+    primary = asyncio.create_task(operation())
+    pending = {primary}
+    try:
+        delay = policy.delay()
+        if delay is not None:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if not done:
+                if policy.can_hedge():
+                    policy.stats.hedged += 1
+                    logger.debug(f"No answer after {delay:.1f}s, sending a hedged request")
+                    pending.add(asyncio.create_task(operation()))
+                else:
+                    policy.stats.budget_exhausted += 1
+
+        error: BaseException | None = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    error = error or task.exception()
+                    continue
+                if task is not primary:
+                    policy.stats.hedge_won += 1
+                    logger.info(f"Hedged request answered first: {policy.stats}")
+                policy.latency.observe(loop.time() - started)
+                return task.result()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
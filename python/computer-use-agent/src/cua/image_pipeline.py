@@ -0,0 +1,171 @@
+import asyncio
+import io
+import logging
+import struct
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Literal
+
+from PIL import Image
+
+from cua.cua_target import Screenshot
+
+logger = logging.getLogger(__name__)
+
+ImageFormat = Literal["png", "jpeg", "webp"]
+ExecutorKind = Literal["thread", "process"]
+
+RESAMPLE_FILTERS = {
+    "nearest": Image.Resampling.NEAREST,
+    "box": Image.Resampling.BOX,
+    "bilinear": Image.Resampling.BILINEAR,
+    "hamming": Image.Resampling.HAMMING,
+    "bicubic": Image.Resampling.BICUBIC,
+    "lanczos": Image.Resampling.LANCZOS,
+}
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+_executors: dict[ExecutorKind, Executor] = {}
+
+
+def read_image_size(data: bytes) -> tuple[int, int] | None:
+    """Return the size of a PNG from its IHDR chunk, without decoding it."""
+    if data[:8] != PNG_SIGNATURE or data[12:16] != b"IHDR":
+        return None
+    return struct.unpack("!II", data[16:24])
+
+
+def get_executor(kind: ExecutorKind, max_workers: int | None = None) -> Executor:
+    """Return the process-wide executor images are encoded on."""
+    if kind not in _executors:
+        if kind == "process":
+            _executors[kind] = ProcessPoolExecutor(max_workers=max_workers)
+        else:
+            _executors[kind] = ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix="image"
+            )
+    return _executors[kind]
+
+
+def shutdown_executors() -> None:
+    for executor in _executors.values():
+        executor.shutdown(wait=False, cancel_futures=True)
+    _executors.clear()
+
+
+@dataclass(frozen=True)
+class ImageEncoding:
+    """How a screenshot is scaled and encoded."""
+
+    format: ImageFormat = "png"
+    quality: int = 80
+    png_compress_level: int = 1
+    resample: str = "bilinear"
+
+    @property
+    def mime_type(self) -> str:
+        return f"image/{self.format}"
+
+
+def fit_to_size(image: Image.Image, size: tuple[int, int], resample: str) -> Image.Image:
+    """
+    Scale an image to fit `size`, keeping its aspect ratio and padding the rest
+    with black.
+    """
+    source_size = image.size
+    if source_size != size:
+        ratio = min(size[0] / source_size[0], size[1] / source_size[1])
+        scaled = (int(source_size[0] * ratio), int(source_size[1] * ratio))
+        image = image.convert("RGB").resize(scaled, RESAMPLE_FILTERS[resample])
+        if scaled != size:
+            canvas = Image.new("RGB", size, (0, 0, 0))
+            canvas.paste(image, (0, 0))
+            image = canvas
+    elif image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    return image
+
+
+def encode_image(image: Image.Image, encoding: ImageEncoding) -> bytes:
+    buffer = io.BytesIO()
+    if encoding.format == "png":
+        image.save(buffer, format="PNG", compress_level=encoding.png_compress_level)
+    else:
+        image.save(buffer, format=encoding.format.upper(), quality=encoding.quality)
+    return buffer.getvalue()
+
+
+def fit_image(
+    data: bytes, size: tuple[int, int], encoding: ImageEncoding
+) -> tuple[bytes, tuple[int, int]]:
+    """
+    Fit an encoded image to `size` and encode it again. Returns the encoded image
+    and the source size. Runs on an executor, possibly in another process.
+    """
+    image = Image.open(io.BytesIO(data))
+    source_size = image.size
+    return encode_image(fit_to_size(image, size, encoding.resample), encoding), source_size
+
+
+class ImagePipeline:
+    """
+    Fits screenshots to the size the model sees and encodes them off the event loop.
+    A PNG that already has the right size is passed through untouched.
+    """
+
+    def __init__(
+        self,
+        format: ImageFormat = "png",
+        quality: int = 80,
+        png_compress_level: int = 1,
+        resample: str = "bilinear",
+        executor: ExecutorKind = "thread",
+        max_workers: int | None = None,
+    ):
+        if format not in ("png", "jpeg", "webp"):
+            raise ValueError(f"Invalid image format: {format}")
+        if resample not in RESAMPLE_FILTERS:
+            raise ValueError(f"Invalid resampling filter: {resample}")
+        self.format = format
+        self.quality = quality
+        self.png_compress_level = png_compress_level
+        self.resample = resample
+        self.executor = executor
+        self.max_workers = max_workers
+
+    def encoding(
+        self, format: ImageFormat | None = None, quality: int | None = None
+    ) -> ImageEncoding:
+        """The pipeline's encoding, `format` and `quality` override its defaults."""
+        return ImageEncoding(
+            format=format or self.format,
+            quality=self.quality if quality is None else quality,
+            png_compress_level=self.png_compress_level,
+            resample=self.resample,
+        )
+
+    async def fit(
+        self,
+        screenshot: bytes,
+        size: tuple[int, int],
+        format: ImageFormat | None = None,
+        quality: int | None = None,
+    ) -> tuple[Screenshot, tuple[int, int]]:
+        """
+        Return the screenshot fitted to `size` and the size of the source image.
+        `format` and `quality` override the pipeline's defaults for this image.
+        """
+        encoding = self.encoding(format, quality)
+        source_size = read_image_size(screenshot)
+        if source_size == size and encoding.format == "png":
+            return Screenshot(screenshot, mime_type=encoding.mime_type), source_size
+
+        data, source_size = await asyncio.get_running_loop().run_in_executor(
+            get_executor(self.executor, self.max_workers),
+            fit_image,
+            bytes(screenshot),
+            size,
+            encoding,
+        )
+        return Screenshot(data, mime_type=encoding.mime_type), source_size
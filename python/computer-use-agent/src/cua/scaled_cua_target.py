@@ -1,11 +1,10 @@
-import io
-
-import PIL
 from openai.types.responses.function_tool_param import FunctionToolParam
 from openai.types.responses.response_computer_tool_call import Action
 from openai.types.responses.response_function_tool_call import ResponseFunctionToolCall
 
-from cua.cua_target import CUATarget, Screenshot
+from cua.cua_target import CUATarget, Region, Screenshot
+from cua.image_pipeline import ImageEncoding, ImagePipeline
+from cua.screenshot_policy import ScreenshotPolicy
 
 
 class ScaledCUATarget(CUATarget):
@@ -15,16 +14,51 @@ class ScaledCUATarget(CUATarget):
     def environment(self) -> str:
         return self.target.environment
 
-    def __init__(self, width, height, target: CUATarget):
+    def __init__(
+        self,
+        width,
+        height,
+        target: CUATarget,
+        pipeline: ImagePipeline | None = None,
+        policy: ScreenshotPolicy | None = None,
+    ):
         self.width = width
         self.height = height
         self.target = target
+        self.pipeline = pipeline or ImagePipeline()
+        self.policy = policy
         self.screen_width = -1
         self.screen_height = -1
+        self._last_scaled_screenshot: Screenshot | None = None
 
     async def take_screenshot(self) -> Screenshot:
-        screenshot = await self.target.take_screenshot()
-        return self._scale_screenshot(screenshot)
+        fitted = await self.target.take_fitted_screenshot(
+            (self.width, self.height), self._encoding
+        )
+        if fitted is None:
+            screenshot = await self.target.take_screenshot()
+            return await self._scale_screenshot(screenshot)
+        screenshot, (self.screen_width, self.screen_height) = fitted
+        self._last_scaled_screenshot = screenshot
+        return screenshot
+
+    async def wait_for_settle(self, max_wait: float | None = None) -> bool:
+        return await self.target.wait_for_settle(max_wait)
+
+    @property
+    def screen_changed(self) -> bool:
+        return self.target.screen_changed
+
+    @property
+    def changed_regions(self) -> list[tuple[int, int, int, int]] | None:
+        regions = self.target.changed_regions
+        if regions is None or self.screen_width <= 0:
+            return regions
+        ratio = min(self.width / self.screen_width, self.height / self.screen_height)
+        return [
+            (int(x * ratio), int(y * ratio), round(w * ratio), round(h * ratio))
+            for x, y, w, h in regions
+        ]
 
     async def handle_tool_call(
         self, action: Action | ResponseFunctionToolCall
@@ -34,42 +68,54 @@ class ScaledCUATarget(CUATarget):
             return await self.target.handle_tool_call(action)
 
         # For standard Action types, adjust coordinates and pass through
+        if action.type == "screenshot":
+            return await self.take_screenshot()
+        if self.screen_width <= 0:
+            # The model can act before seeing a screenshot, learn the screen size first
+            await self.take_screenshot()
+        # Adjust a copy, the session and recorded trajectories keep the model's coordinates
+        action = action.model_copy(deep=True)
         self._adjust_action_args(action)
         tool_call_result = await self.target.handle_tool_call(action)
         if tool_call_result is None:
             return None
         if isinstance(tool_call_result, Screenshot):
-            return self._scale_screenshot(tool_call_result)
+            return await self._scale_screenshot(tool_call_result)
 
     @property
     def additional_tool_schemas(self) -> list[FunctionToolParam]:
         return self.target.additional_tool_schemas
 
     def _adjust_action_args(self, action: Action) -> None:
-        if action.type in ("click", "double_click", "move"):
+        if action.type in ("click", "double_click", "move", "scroll"):
             action.x, action.y = self._point_to_screen_coords(action.x, action.y)
+        if action.type == "scroll":
+            action.scroll_x, action.scroll_y = self._point_to_screen_coords(
+                action.scroll_x, action.scroll_y
+            )
         elif action.type == "drag":
             for point in action.path:
-                x, y = self._point_to_screen_coords(point[0], point[1])
-                point["x"] = x
-                point["y"] = y
-
-    def _scale_screenshot(self, screenshot: Screenshot) -> Screenshot:
-        buffer = io.BytesIO(screenshot)
-        image = PIL.Image.open(buffer)
-        self.screen_width, self.screen_height = image.size
-        ratio = min(self.width / self.screen_width, self.height / self.screen_height)
-        new_width = int(self.screen_width * ratio)
-        new_height = int(self.screen_height * ratio)
-        resized_image = image.resize(
-            (new_width, new_height), PIL.Image.Resampling.LANCZOS
+                point.x, point.y = self._point_to_screen_coords(point.x, point.y)
+
+    def _encoding(
+        self, changed_regions: list[Region] | None, screen_size: tuple[int, int]
+    ) -> ImageEncoding:
+        format, quality = None, None
+        if self.policy:
+            format, quality = self.policy.encoding(changed_regions, screen_size)
+        return self.pipeline.encoding(format, quality)
+
+    async def _scale_screenshot(self, screenshot: Screenshot) -> Screenshot:
+        if not self.target.screen_changed and self._last_scaled_screenshot:
+            return self._last_scaled_screenshot
+        encoding = self._encoding(
+            self.target.changed_regions, (self.screen_width, self.screen_height)
+        )
+        scaled, (self.screen_width, self.screen_height) = await self.pipeline.fit(
+            screenshot, (self.width, self.height), encoding.format, encoding.quality
         )
-        image = PIL.Image.new("RGB", (self.width, self.height), (0, 0, 0))
-        image.paste(resized_image, (0, 0))
-        buffer = io.BytesIO()
-        image.save(buffer, format="PNG")
-        buffer.seek(0)
-        return Screenshot(buffer.getvalue())
+        self._last_scaled_screenshot = scaled
+        return scaled
 
     def _point_to_screen_coords(self, x, y):
         ratio = min(self.width / self.screen_width, self.height / self.screen_height)
@@ -0,0 +1,61 @@
+from dataclasses import dataclass
+
+from cua.cua_target import Region
+from cua.image_pipeline import ImageFormat
+
+
+@dataclass
+class ScreenshotPolicy:
+    """
+    How screenshots are sent to the model: the image format and quality, and the
+    largest size the model sees. The computer tool advertises the fitted size, so
+    the model's coordinates are in that space and mapped back to the screen.
+
+    With `adaptive`, screenshots where less than `small_change_ratio` of the screen
+    changed since the previous one are sent as JPEG at `small_change_quality`.
+    """
+
+    format: ImageFormat = "png"
+    quality: int = 80
+    max_width: int | None = None
+    max_height: int | None = None
+    adaptive: bool = False
+    small_change_ratio: float = 0.1
+    small_change_quality: int = 50
+
+    def __post_init__(self):
+        if self.format not in ("png", "jpeg", "webp"):
+            raise ValueError(f"Invalid screenshot format: {self.format}")
+
+    @property
+    def is_default(self) -> bool:
+        """Whether screenshots can be sent exactly as the target captured them."""
+        return (
+            self.format == "png"
+            and self.max_width is None
+            and self.max_height is None
+            and not self.adaptive
+        )
+
+    def fit_size(self, width: int, height: int) -> tuple[int, int]:
+        """Scale a display size down to the maximum dimensions, keeping its aspect ratio."""
+        ratio = min(
+            1.0,
+            (self.max_width or width) / width,
+            (self.max_height or height) / height,
+        )
+        return max(int(width * ratio), 1), max(int(height * ratio), 1)
+
+    def encoding(
+        self, changed_regions: list[Region] | None, screen_size: tuple[int, int]
+    ) -> tuple[ImageFormat, int]:
+        """Return the format and quality to encode the next screenshot with."""
+        if not self.adaptive or changed_regions is None:
+            return self.format, self.quality
+        screen_area = screen_size[0] * screen_size[1]
+        if screen_area <= 0:
+            return self.format, self.quality
+        changed_area = sum(w * h for _, _, w, h in changed_regions)
+        if changed_area / screen_area < self.small_change_ratio:
+            return "jpeg", min(self.small_change_quality, self.quality)
+        return self.format, self.quality
@@ -0,0 +1,34 @@
+import mimetypes
+from pathlib import Path
+
+from cua.background_writer import BackgroundWriter
+from cua.cua_target import Screenshot
+
+
+class ScreenshotSink:
+    """
+    Persists screenshots to a directory from a background task, so capturing a
+    screenshot never waits on the disk. When more than `max_pending` screenshots
+    are waiting to be written, new ones are dropped.
+    """
+
+    def __init__(self, directory: str | Path, max_pending: int = 32):
+        self.directory = Path(directory)
+        self._writer = BackgroundWriter(self.directory, max_pending, "screenshots")
+        self._count = 0
+
+    def submit(self, screenshot: Screenshot) -> str | None:
+        """
+        Queue a screenshot to be written, without blocking the caller. Returns the
+        name of its file, or None when it was dropped.
+        """
+        self._count += 1
+        extension = mimetypes.guess_extension(screenshot.mime_type) or ".png"
+        name = f"{self._count:05d}{extension}"
+        if not self._writer.submit(lambda directory: (directory / name).write_bytes(screenshot)):
+            return None
+        return name
+
+    async def close(self) -> None:
+        """Write the screenshots still queued and stop the background task."""
+        await self._writer.close()
@@ -0,0 +1,220 @@
+import asyncio
+import hashlib
+import io
+import json
+import logging
+import shutil
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from openai.types.responses.response_computer_tool_call import Action
+from openai.types.responses.response_function_tool_call import ResponseFunctionToolCall
+from PIL import Image
+from pydantic import TypeAdapter
+
+from cua.cua_target import Screenshot
+from cua.screenshot_sink import ScreenshotSink
+
+logger = logging.getLogger(__name__)
+
+_action_adapter = TypeAdapter(Action | ResponseFunctionToolCall)
+
+# Actions that leave the screen as it is, there is nothing to replay
+SKIPPED_ACTION_TYPES = ("screenshot",)
+
+
+def dhash(screenshot: bytes, hash_size: int = 16) -> int:
+    """
+    Difference hash of an image: whether each pixel of a small grayscale version is
+    brighter than its right neighbour. Similar screens have hashes a few bits apart.
+    """
+    image = Image.open(io.BytesIO(screenshot)).convert("L")
+    image = image.resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR)
+    pixels = image.tobytes()
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+@dataclass(slots=True)
+class TrajectoryStep:
+    action: Action | ResponseFunctionToolCall
+    # Hash of the screen the action was decided on, and of the screen it led to
+    before: int
+    after: int | None
+    before_image: str | None = None
+    after_image: str | None = None
+    # The model asked the user to approve this action, it is never replayed
+    safety_checks: bool = False
+
+    def to_dict(self) -> dict:
+        return {
+            "action": _action_adapter.dump_python(self.action, mode="json"),
+            "before": f"{self.before:x}",
+            "after": f"{self.after:x}" if self.after is not None else None,
+            "before_image": self.before_image,
+            "after_image": self.after_image,
+            "safety_checks": self.safety_checks,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "TrajectoryStep":
+        return cls(
+            action=_action_adapter.validate_python(data["action"]),
+            before=int(data["before"], 16),
+            after=int(data["after"], 16) if data["after"] is not None else None,
+            before_image=data["before_image"],
+            after_image=data["after_image"],
+            safety_checks=data["safety_checks"],
+        )
+
+
+@dataclass
+class Trajectory:
+    task: str
+    steps: list[TrajectoryStep] = field(default_factory=list)
+
+
+class TrajectoryRecorder:
+    """
+    Records the actions of one task with the hashes of the screens around them. The
+    screenshots are written as the task goes, so only the hashes stay in memory.
+    """
+
+    def __init__(self, store: "TrajectoryStore", key: str, task: str):
+        self.store = store
+        self.key = key
+        self.trajectory = Trajectory(task)
+        self.directory = store.directory / f".recording-{uuid.uuid4().hex}"
+        self._sink = ScreenshotSink(self.directory)
+        # The last screenshot hashed, most screenshots end one step and start the next
+        self._last: tuple[Screenshot, int, str | None] | None = None
+
+    async def record(
+        self,
+        action: Action | ResponseFunctionToolCall,
+        before: Screenshot,
+        after: Screenshot | None,
+        safety_checks: bool = False,
+    ) -> None:
+        if getattr(action, "type", None) in SKIPPED_ACTION_TYPES:
+            return
+        before_hash, before_image = await self._hash(before)
+        after_hash, after_image = (
+            await self._hash(after) if after is not None else (None, None)
+        )
+        self.trajectory.steps.append(
+            TrajectoryStep(
+                action=action,
+                before=before_hash,
+                after=after_hash,
+                before_image=before_image,
+                after_image=after_image,
+                safety_checks=safety_checks,
+            )
+        )
+
+    async def screen_hash(self, screenshot: Screenshot) -> int:
+        return (await self._hash(screenshot))[0]
+
+    async def _hash(self, screenshot: Screenshot) -> tuple[int, str | None]:
+        if self._last is not None and self._last[0] is screenshot:
+            return self._last[1], self._last[2]
+        value = await asyncio.to_thread(dhash, screenshot, self.store.hash_size)
+        name = self._sink.submit(screenshot)
+        self._last = (screenshot, value, name)
+        return value, name
+
+    async def save(self) -> None:
+        """Keep the recording as the trajectory of its task, replacing the previous one."""
+        await self._sink.close()
+        self._last = None
+        if not self.trajectory.steps:
+            await self.discard()
+            return
+        await asyncio.to_thread(self.store.write, self.key, self.directory, self.trajectory)
+        logger.info(f"Recorded a trajectory of {len(self.trajectory.steps)} steps")
+
+    async def discard(self) -> None:
+        await self._sink.close()
+        self._last = None
+        await asyncio.to_thread(shutil.rmtree, self.directory, True)
+
+
+class TrajectoryStore:
+    """
+    Trajectories of completed tasks, one directory per task holding the actions, the
+    screen hashes and the screenshots. A task is recognized by its text and the
+    screen it runs on, so only repeats of the very same request are replayed.
+    """
+
+    def __init__(self, directory: str | Path, max_distance: int = 10, hash_size: int = 16):
+        self.directory = Path(directory)
+        # Bits two screen hashes may differ by and still count as the same screen
+        self.max_distance = max_distance
+        self.hash_size = hash_size
+        # Recordings being saved, so they are not garbage collected halfway
+        self._saving: set[asyncio.Task] = set()
+
+    @staticmethod
+    def key(task: str, environment: str, width: int, height: int) -> str:
+        normalized = " ".join(task.lower().split())
+        return hashlib.sha256(
+            f"{environment}:{width}x{height}:{normalized}".encode()
+        ).hexdigest()[:32]
+
+    def matches(self, a: int, b: int) -> bool:
+        return hamming_distance(a, b) <= self.max_distance
+
+    def recorder(self, key: str, task: str) -> TrajectoryRecorder:
+        return TrajectoryRecorder(self, key, task)
+
+    def save_in_background(self, recorder: TrajectoryRecorder) -> None:
+        task = asyncio.create_task(recorder.save())
+        self._saving.add(task)
+        task.add_done_callback(self._saving.discard)
+
+    async def close(self) -> None:
+        """Wait for the recordings being saved."""
+        if self._saving:
+            await asyncio.gather(*self._saving, return_exceptions=True)
+
+    async def load(self, key: str) -> Trajectory | None:
+        return await asyncio.to_thread(self._load, key)
+
+    def _load(self, key: str) -> Trajectory | None:
+        path = self.directory / key / "trajectory.json"
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+            return Trajectory(
+                task=data["task"],
+                steps=[TrajectoryStep.from_dict(step) for step in data["steps"]],
+            )
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Could not load trajectory {key}: {e}")
+            return None
+
+    def write(self, key: str, recording: Path, trajectory: Trajectory) -> None:
+        data = {
+            "task": trajectory.task,
+            "steps": [step.to_dict() for step in trajectory.steps],
+        }
+        recording.mkdir(parents=True, exist_ok=True)
+        (recording / "trajectory.json").write_text(json.dumps(data), encoding="utf-8")
+        target = self.directory / key
+        if target.exists():
+            # Move the old trajectory aside first, a directory cannot replace another
+            stale = self.directory / f".stale-{uuid.uuid4().hex}"
+            target.rename(stale)
+            shutil.rmtree(stale, ignore_errors=True)
+        recording.rename(target)
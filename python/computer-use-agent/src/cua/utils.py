@@ -1,7 +1,15 @@
 import asyncio
 import logging
+import math
+import random
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from typing import Awaitable, Callable, Optional, TypeVar
 
+from openai import APIConnectionError, APITimeoutError
+
 logger = logging.getLogger(__name__)
 
 
@@ -17,29 +25,151 @@ class MaxRetriesExceeded(Exception):
 # Define a generic type variable for the return type of the operation
 T = TypeVar("T")
 
+# Request timeouts, conflicts, throttling and server errors are worth another try
+RETRYABLE_STATUS_CODES = frozenset({408, 409, 429})
+
+
+def retry_after_seconds(error: BaseException) -> float | None:
+    """
+    How long the server asked us to wait before retrying, from the Retry-After or
+    retry-after-ms header of the error's response. None if it did not say.
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value is not None:
+        try:
+            return max(float(value) / 1000, 0.0)
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+        return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+# Error codes of failed streamed responses that may succeed if sent again
+RETRYABLE_STREAM_ERROR_CODES = frozenset({"server_error", "rate_limit_exceeded"})
+
+
+class ResponseStreamError(Exception):
+    """A failure the server reported inside a response stream rather than with a status code."""
+
+    def __init__(self, message: str, retryable: bool = False):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Whether the error is transient, so the same request may succeed if sent again."""
+    if isinstance(error, ResponseStreamError):
+        return error.retryable
+    # Covers the OpenAI client's timeouts as well as dropped connections
+    if isinstance(error, (APIConnectionError, TimeoutError, ConnectionError)):
+        return True
+    status = getattr(error, "status_code", None)
+    return isinstance(status, int) and (status in RETRYABLE_STATUS_CODES or status >= 500)
+
+
+class LatencyTracker:
+    """Keeps the most recent latencies to derive timeouts from what is actually observed."""
+
+    def __init__(self, window: int = 100):
+        self._samples: deque[float] = deque(maxlen=window)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def observe(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, fraction: float) -> float | None:
+        if not self._samples:
+            return None
+        samples = sorted(self._samples)
+        index = min(math.ceil(fraction * len(samples)) - 1, len(samples) - 1)
+        return samples[max(index, 0)]
+
+
+@dataclass
+class RetryPolicy:
+    """
+    How an operation is retried: transient errors and failed checks are retried with
+    exponential backoff and full jitter, a server's Retry-After is honored, and no
+    attempt starts or sleeps past the overall deadline. Each attempt gets a timeout
+    derived from the latencies seen so far, so slow responses are not cut off while
+    stuck requests are abandoned sooner than a fixed limit would.
+    """
+
+    max_attempts: int = 4
+    base_delay: float = 0.5
+    max_delay: float = 8.0
+    # Seconds for all attempts and the waits between them together
+    deadline: float | None = 120.0
+    # Per-attempt timeout, a multiple of the latency percentile within the bounds
+    timeout_percentile: float = 0.95
+    timeout_multiplier: float = 2.0
+    min_timeout: float = 10.0
+    max_timeout: float = 60.0
+    # Samples needed before the percentile is trusted, until then max_timeout is used
+    min_samples: int = 5
+    latency: LatencyTracker = field(default_factory=LatencyTracker)
+    classify: Callable[[BaseException], bool] = is_retryable
+
+    def attempt_timeout(self) -> float:
+        if len(self.latency) < self.min_samples:
+            return self.max_timeout
+        timeout = self.latency.percentile(self.timeout_percentile) * self.timeout_multiplier
+        return min(max(timeout, self.min_timeout), self.max_timeout)
+
+    def backoff(self, attempt: int, error: BaseException | None = None) -> float:
+        """Seconds to wait after the given (1-based) attempt failed."""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        retry_after = retry_after_seconds(error) if error is not None else None
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
 
 async def retry_async_operation(
-    operation: Callable[[], Awaitable[T]],
+    operation: Callable[..., Awaitable[T]],
     max_retries: int = 3,
     check_result: Optional[Callable[[T], bool]] = None,
     retry_delay: float = 0,
+    policy: RetryPolicy | None = None,
 ) -> T:
     """
     Generic retry function for async operations.
 
     Args:
-        operation: An async callable to execute
+        operation: An async callable to execute. With a policy it is called with the
+                   `timeout` in seconds for the attempt.
         max_retries: Maximum number of retry attempts
         check_result: Optional function to validate the result and determine if retry is needed
                      Should return True if result is valid, False if retry is needed
         retry_delay: Optional delay between retries in seconds
+        policy: Optional retry policy, also retries transient errors (see RetryPolicy).
+                Replaces max_retries and retry_delay.
 
     Returns:
         The result of the operation with its original type preserved
 
     Raises:
         MaxRetriesExceeded: When the maximum number of retries is reached without a successful result
+        Exception: The last error when it is not retryable, or attempts or time ran out
     """
+    if policy is not None:
+        return await _retry_with_policy(operation, policy, check_result)
+
     retry_count = 0
 
     while retry_count < max_retries:
@@ -65,3 +195,48 @@ async def retry_async_operation(
     # This line should never be reached due to the exception above
     # but keeping it for type safety
     return result
+
+
+async def _retry_with_policy(
+    operation: Callable[..., Awaitable[T]],
+    policy: RetryPolicy,
+    check_result: Optional[Callable[[T], bool]],
+) -> T:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + policy.deadline if policy.deadline is not None else math.inf
+
+    for attempt in range(1, policy.max_attempts + 1):
+        timeout = min(policy.attempt_timeout(), max(deadline - loop.time(), 0.0))
+        started = loop.time()
+        error: BaseException | None = None
+        try:
+            result = await operation(timeout=timeout)
+        except Exception as e:
+            if not policy.classify(e):
+                raise
+            error = e
+            if isinstance(e, (TimeoutError, APITimeoutError)):
+                # A timed out attempt took at least this long, count it so the
+                # next timeout is not tighter than the one that just expired
+                policy.latency.observe(loop.time() - started)
+        else:
+            policy.latency.observe(loop.time() - started)
+            if check_result is None or check_result(result):
+                return result
+
+        if attempt == policy.max_attempts:
+            break
+        delay = policy.backoff(attempt, error)
+        if loop.time() + delay >= deadline:
+            logger.error("Retry deadline reached")
+            break
+        logger.warning(
+            f"Attempt {attempt}/{policy.max_attempts} failed"
+            f" ({error or 'check failed'}), retrying in {delay:.1f}s..."
+        )
+        await asyncio.sleep(delay)
+
+    if error is not None:
+        raise error
+    logger.error("Max retries reached")
+    raise MaxRetriesExceeded(policy.max_attempts, result)
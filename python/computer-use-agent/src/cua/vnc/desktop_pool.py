@@ -0,0 +1,216 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Callable
+
+from cua.vnc.vnc import VNCMachine
+
+logger = logging.getLogger(__name__)
+
+
+class DesktopPoolExhausted(Exception):
+    """Raised when no desktop could be leased to a session."""
+
+    def __init__(self, pool_size: int):
+        self.pool_size = pool_size
+        super().__init__(
+            f"All {pool_size} desktops are busy. Please try again in a few minutes."
+        )
+
+
+class Desktop:
+    """A VNC endpoint in the pool and the session currently leasing it."""
+
+    def __init__(self, address: str, machine: VNCMachine):
+        self.address = address
+        self.machine = machine
+        self.session_id: str | None = None
+        # The session that used the desktop last, its screen still shows that session's work
+        self.last_session_id: str | None = None
+        self.healthy = False
+
+
+class DesktopPool:
+    """
+    Leases VNC desktops to sessions for their lifetime.
+    Connections are opened when the pool starts and kept warm between leases, idle
+    desktops are health-checked in the background. A session only gets another desktop
+    when its own is unreachable. A desktop is reset before it is handed to a session
+    other than the one that used it last, so the session does not see what another
+    session left. When every desktop is leased,
+    new sessions wait in a FIFO queue, or are rejected once the queue is full or
+    they waited for `acquire_timeout` seconds.
+    """
+
+    def __init__(
+        self,
+        addresses: list[str],
+        machine_factory: Callable[[str], VNCMachine],
+        acquire_timeout: float = 30,
+        max_waiters: int = 10,
+        health_check_interval: float = 30,
+    ):
+        if not addresses:
+            raise ValueError("The desktop pool needs at least one VNC address")
+        self._desktops = [Desktop(address, machine_factory(address)) for address in addresses]
+        self._leases: dict[str, Desktop] = {}
+        self._waiters: deque[asyncio.Future] = deque()
+        self.acquire_timeout = acquire_timeout
+        self.max_waiters = max_waiters
+        self.health_check_interval = health_check_interval
+        self._start_lock = asyncio.Lock()
+        self._started = False
+        self._health_task: asyncio.Task | None = None
+
+    @property
+    def size(self) -> int:
+        return len(self._desktops)
+
+    @property
+    def idle_count(self) -> int:
+        return sum(1 for desktop in self._desktops if desktop.session_id is None)
+
+    @property
+    def waiting_count(self) -> int:
+        return sum(1 for waiter in self._waiters if not waiter.done())
+
+    def has_lease(self, session_id: str) -> bool:
+        return session_id in self._leases
+
+    async def start(self) -> None:
+        """Connect to every desktop and start the background health checks."""
+        async with self._start_lock:
+            if self._started:
+                return
+            await asyncio.gather(*(self._check(desktop) for desktop in self._desktops))
+            self._health_task = asyncio.create_task(self._health_check_loop())
+            self._started = True
+            logger.info(
+                "Desktop pool started with %d/%d healthy desktops",
+                sum(1 for desktop in self._desktops if desktop.healthy),
+                self.size,
+            )
+
+    async def close(self) -> None:
+        if self._health_task:
+            self._health_task.cancel()
+            self._health_task = None
+        for waiter in self._waiters:
+            waiter.cancel()
+        self._waiters.clear()
+        await asyncio.gather(
+            *(desktop.machine.close() for desktop in self._desktops),
+            return_exceptions=True,
+        )
+        self._leases.clear()
+        self._started = False
+
+    async def acquire(self, session_id: str) -> VNCMachine:
+        """
+        Lease a desktop to the session, or return the one it already holds. A held
+        desktop that became unreachable is returned and replaced by another one.
+        """
+        if not self._started:
+            await self.start()
+        leased = self._leases.get(session_id)
+        if leased is not None:
+            if await self._check(leased):
+                return leased.machine
+            logger.warning(
+                "Desktop %s of session %s is unreachable, leasing another",
+                leased.address,
+                session_id,
+            )
+            self.release(session_id)
+
+        desktop = await self._take_idle_desktop(session_id)
+        if desktop is None:
+            desktop = await self._wait_for_desktop()
+        desktop.session_id = session_id
+        self._leases[session_id] = desktop
+        logger.info("Leased desktop %s to session %s", desktop.address, session_id)
+        if desktop.last_session_id not in (None, session_id):
+            try:
+                await desktop.machine.reset()
+            except Exception as e:
+                logger.warning("Could not reset desktop %s: %s", desktop.address, e)
+        desktop.last_session_id = session_id
+        return desktop.machine
+
+    def release(self, session_id: str) -> None:
+        """Return the session's desktop to the pool, handing it to the next waiter."""
+        desktop = self._leases.pop(session_id, None)
+        if desktop is None:
+            return
+        logger.info("Session %s released desktop %s", session_id, desktop.address)
+        desktop.session_id = None
+        if desktop.healthy:
+            self._hand_over(desktop)
+
+    def _hand_over(self, desktop: Desktop) -> None:
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # Reserve the desktop until the waiter records its own lease
+                desktop.session_id = ""
+                waiter.set_result(desktop)
+                return
+
+    async def _take_idle_desktop(self, session_id: str) -> Desktop | None:
+        idle = [desktop for desktop in self._desktops if desktop.session_id is None]
+        # Prefer the desktop the session used last, then desktops no other session
+        # is coming back to, then those that passed their last health check, and
+        # finally try to revive the rest
+        for desktop in sorted(
+            idle,
+            key=lambda desktop: (
+                desktop.last_session_id != session_id,
+                desktop.last_session_id is not None,
+                not desktop.healthy,
+            ),
+        ):
+            desktop.session_id = ""
+            if desktop.healthy or await self._check(desktop):
+                return desktop
+            desktop.session_id = None
+        return None
+
+    async def _wait_for_desktop(self) -> Desktop:
+        if self.waiting_count >= self.max_waiters:
+            raise DesktopPoolExhausted(self.size)
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        logger.info("No idle desktop, %d sessions waiting", self.waiting_count)
+        try:
+            return await asyncio.wait_for(waiter, timeout=self.acquire_timeout)
+        except asyncio.TimeoutError:
+            # The desktop may have been handed over just as the wait timed out
+            if waiter.done() and not waiter.cancelled():
+                return waiter.result()
+            raise DesktopPoolExhausted(self.size)
+        except asyncio.CancelledError:
+            # We were cancelled after a desktop was handed to us, pass it on
+            if waiter.done() and not waiter.cancelled():
+                desktop = waiter.result()
+                desktop.session_id = None
+                self._hand_over(desktop)
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    async def _check(self, desktop: Desktop) -> bool:
+        desktop.healthy = await desktop.machine.check_connection()
+        if not desktop.healthy:
+            logger.warning("Desktop %s is not reachable", desktop.address)
+        return desktop.healthy
+
+    async def _health_check_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.health_check_interval)
+            idle = [desktop for desktop in self._desktops if desktop.session_id is None]
+            await asyncio.gather(*(self._check(desktop) for desktop in idle))
+            # Desktops that came back can serve the sessions waiting for one
+            for desktop in idle:
+                if desktop.healthy and desktop.session_id is None:
+                    self._hand_over(desktop)
@@ -0,0 +1,162 @@
+from PIL import Image
+
+from cua.image_pipeline import ImageEncoding, encode_image, fit_to_size
+
+# Pixels are stored exactly as they arrive from the server, see PIXEL_FORMAT in rfb.py
+BYTES_PER_PIXEL = 4
+RAW_MODE = "BGRX"
+# Collapse the dirty map into its bounding box once it holds more rectangles than this
+MAX_DIRTY_RECTS = 64
+
+Rect = tuple[int, int, int, int]
+
+
+def bounding_box(rects: list[Rect]) -> Rect:
+    left = min(x for x, _, _, _ in rects)
+    top = min(y for _, y, _, _ in rects)
+    right = max(x + w for x, _, w, _ in rects)
+    bottom = max(y + h for _, y, _, h in rects)
+    return left, top, right - left, bottom - top
+
+
+class Framebuffer:
+    """In-memory copy of the remote screen, kept up to date by FramebufferUpdate rectangles."""
+
+    def __init__(self, width: int = 0, height: int = 0):
+        self.width = width
+        self.height = height
+        self.pixels = bytearray(width * height * BYTES_PER_PIXEL)
+        self.dirty: list[Rect] = []
+        # Incremented whenever pixels change, unlike `dirty` it is never reset
+        self.version = 0
+
+    @property
+    def stride(self) -> int:
+        return self.width * BYTES_PER_PIXEL
+
+    def resize(self, width: int, height: int) -> None:
+        self.width = width
+        self.height = height
+        self.pixels = bytearray(width * height * BYTES_PER_PIXEL)
+        self.dirty = [(0, 0, width, height)]
+
+    def mark_dirty(self, x: int, y: int, w: int, h: int) -> None:
+        if w <= 0 or h <= 0:
+            return
+        self.version += 1
+        self.dirty.append((x, y, w, h))
+        if len(self.dirty) > MAX_DIRTY_RECTS:
+            self.dirty = [bounding_box(self.dirty)]
+
+    def take_dirty(self) -> list[Rect]:
+        """Return the rectangles that changed since the last call and reset the map."""
+        dirty, self.dirty = self.dirty, []
+        return dirty
+
+    def blit(self, x: int, y: int, w: int, h: int, data: bytes) -> None:
+        """Copy a rectangle of raw pixels into the framebuffer."""
+        stride = self.stride
+        row_length = w * BYTES_PER_PIXEL
+        # Servers may resend pixels that did not change, only those that did count as dirty
+        if self.read_rect(x, y, w, h) == data[: row_length * h]:
+            return
+        self.mark_dirty(x, y, w, h)
+        if x == 0 and w == self.width:
+            start = y * stride
+            self.pixels[start : start + row_length * h] = data[: row_length * h]
+            return
+        for row in range(h):
+            start = (y + row) * stride + x * BYTES_PER_PIXEL
+            self.pixels[start : start + row_length] = data[
+                row * row_length : (row + 1) * row_length
+            ]
+
+    def copy_rect(self, src_x: int, src_y: int, x: int, y: int, w: int, h: int) -> None:
+        """Copy a rectangle from one place in the framebuffer to another."""
+        self.blit(x, y, w, h, self.read_rect(src_x, src_y, w, h))
+
+    def read_rect(self, x: int, y: int, w: int, h: int) -> bytes:
+        stride = self.stride
+        row_length = w * BYTES_PER_PIXEL
+        rows = []
+        for row in range(h):
+            start = (y + row) * stride + x * BYTES_PER_PIXEL
+            rows.append(self.pixels[start : start + row_length])
+        return b"".join(rows)
+
+    def snapshot(self) -> "Framebuffer":
+        """Return a copy that is safe to encode off the event loop while updates keep arriving."""
+        copy = Framebuffer()
+        copy.width = self.width
+        copy.height = self.height
+        copy.pixels = bytearray(self.pixels)
+        return copy
+
+    def to_image(self) -> Image.Image:
+        return Image.frombuffer(
+            "RGB", (self.width, self.height), self.pixels, "raw", RAW_MODE, 0, 1
+        )
+
+    def encode(
+        self, size: tuple[int, int] | None = None, encoding: ImageEncoding | None = None
+    ) -> bytes:
+        """
+        Encode the framebuffer as an image, optionally fitted to the given size the
+        way the image pipeline fits screenshots.
+        """
+        encoding = encoding or ImageEncoding()
+        image = self.to_image()
+        if size:
+            image = fit_to_size(image, size, encoding.resample)
+        return encode_image(image, encoding)
+
+
+def estimate_vertical_shift(
+    before: Framebuffer,
+    after: Framebuffer,
+    x: int,
+    strip_width: int = 200,
+    max_shift: int = 400,
+    min_matches: int = 8,
+) -> int | None:
+    """
+    Estimate how many pixels the content around column `x` moved between two frames,
+    e.g. after a scroll: positive when it moved up, negative when it moved down.
+    Returns None if no shift explains the change.
+    """
+    if (before.width, before.height) != (after.width, after.height):
+        return None
+    left = max(min(x - strip_width // 2, before.width - strip_width), 0)
+    right = min(left + strip_width, before.width)
+
+    def row_hashes(framebuffer: Framebuffer) -> list[int]:
+        stride = framebuffer.stride
+        return [
+            hash(
+                bytes(
+                    framebuffer.pixels[
+                        y * stride
+                        + left * BYTES_PER_PIXEL : y * stride
+                        + right * BYTES_PER_PIXEL
+                    ]
+                )
+            )
+            for y in range(framebuffer.height)
+        ]
+
+    old_rows, new_rows = row_hashes(before), row_hashes(after)
+    # Rows equal to the row above (e.g. blank background) match any shift, ignore them
+    distinctive = [
+        y > 0 and old_rows[y] != old_rows[y - 1] for y in range(len(old_rows))
+    ]
+    best_shift, best_matches = None, min_matches - 1
+    max_shift = min(max_shift, before.height - 1)
+    for shift in (*range(1, max_shift + 1), *range(-1, -max_shift - 1, -1)):
+        matches = sum(
+            1
+            for y in range(max(-shift, 0), before.height - max(shift, 0))
+            if distinctive[y + shift] and new_rows[y] == old_rows[y + shift]
+        )
+        if matches > best_matches:
+            best_shift, best_matches = shift, matches
+    return best_shift
@@ -1,10 +1,9 @@
-import asyncio
 import logging
 
 from openai.types.responses.response_computer_tool_call import Action
 from openai.types.responses.response_function_tool_call import ResponseFunctionToolCall
 
-from cua.cua_target import CUATarget, Screenshot
+from cua.cua_target import ChooseEncoding, CUATarget, Screenshot
 from cua.vnc.vnc import VNCMachine
 
 logger = logging.getLogger(__name__)
@@ -17,15 +16,46 @@ class Machine(CUATarget):
     def environment(self) -> str:
         return "linux"
 
-    def __init__(self, width=1024, height=768, address=None, password=None):
+    def __init__(
+        self,
+        vnc: VNCMachine,
+        width=1024,
+        height=768,
+        settle_timeout: float = 2.0,
+        settle_quiet_period: float = 0.15,
+    ):
         super().__init__(width, height)
-        self.vnc = VNCMachine(address, password)
+        # The connection is owned by whoever created it, e.g. the desktop pool
+        self.vnc = vnc
+        self.settle_timeout = settle_timeout
+        self.settle_quiet_period = settle_quiet_period
+
+    @property
+    def screen_changed(self) -> bool:
+        return self.vnc.screen_changed
+
+    @property
+    def changed_regions(self) -> list[tuple[int, int, int, int]] | None:
+        return self.vnc.changed_rects
+
+    async def wait_for_settle(self, max_wait: float | None = None) -> bool:
+        return await self.vnc.wait_for_settle(
+            max_wait=self.settle_timeout if max_wait is None else max_wait,
+            quiet_period=self.settle_quiet_period,
+        )
 
     async def take_screenshot(self) -> Screenshot:
-        image_path = "screenshot.png"
-        await self.vnc.screenshot(screenshot_name=image_path, keys=None)
-        with open(image_path, "rb") as image_file:
-            return Screenshot(image_file.read())
+        return Screenshot(await self.vnc.screenshot())
+
+    async def take_fitted_screenshot(
+        self, size: tuple[int, int], choose_encoding: ChooseEncoding
+    ) -> tuple[Screenshot, tuple[int, int]]:
+        # Encoded once, straight from the framebuffer at the size the model sees
+        await self.vnc.collect_changes()
+        screen_size = self.vnc.screen_size
+        encoding = choose_encoding(self.changed_regions, screen_size)
+        data = await self.vnc.encode_screenshot(size, encoding)
+        return Screenshot(data, mime_type=encoding.mime_type), screen_size
 
     async def _take_action(self, action: Action) -> Screenshot | None:
         if action.type == "click":
@@ -40,7 +70,7 @@ class Machine(CUATarget):
             )
         elif action.type == "drag":
             await self.vnc.drag_mouse(
-                path=[(point["x"], point["y"]) for point in action.path],
+                path=[(point.x, point.y) for point in action.path],
             )
         elif action.type == "keypress":
             await self.vnc.multi_key_press(
@@ -61,11 +91,12 @@ class Machine(CUATarget):
                 text=action.text,
             )
         elif action.type == "wait":
-            await asyncio.sleep(1)  # Default wait time of 1 second
+            pass  # Settling below waits for as long as the screen keeps changing
         elif action.type == "screenshot":
             return await self.take_screenshot()
         else:
             raise ValueError(f"Invalid action: {action.type}")
+        await self.wait_for_settle()
 
     async def handle_tool_call(
         self, action: Action | ResponseFunctionToolCall
@@ -0,0 +1,91 @@
+import math
+import random
+from typing import Literal
+
+MotionMode = Literal["teleport", "eased", "human"]
+
+Point = tuple[int, int]
+
+
+def _ease_in_out(t: float) -> float:
+    return t * t * (3 - 2 * t)
+
+
+class MotionPlanner:
+    """
+    Plans the pointer events used to move the mouse between two points.
+
+    - teleport: a single event at the destination.
+    - eased: evenly eased waypoints along a straight line.
+    - human: eased waypoints along a slightly curved, jittered path, for apps
+      that rely on hover trails.
+
+    Every move is capped at `max_steps` events and `max_duration` seconds,
+    whatever the distance.
+    """
+
+    def __init__(
+        self,
+        mode: MotionMode = "eased",
+        max_steps: int = 10,
+        max_duration: float = 0.05,
+        pixels_per_step: int = 40,
+    ):
+        if mode not in ("teleport", "eased", "human"):
+            raise ValueError(f"Invalid mouse motion mode: {mode}")
+        self.mode = mode
+        self.max_steps = max(max_steps, 1)
+        self.max_duration = max(max_duration, 0.0)
+        self.pixels_per_step = max(pixels_per_step, 1)
+
+    def plan(self, start: Point, end: Point) -> list[Point]:
+        """Return the points to send, ending exactly at `end`."""
+        distance = math.hypot(end[0] - start[0], end[1] - start[1])
+        if self.mode == "teleport" or distance < 1:
+            return [end]
+        steps = min(self.max_steps, max(math.ceil(distance / self.pixels_per_step), 1))
+        if self.mode == "eased":
+            points = [
+                self._lerp(start, end, _ease_in_out(i / steps))
+                for i in range(1, steps + 1)
+            ]
+        else:
+            points = self._curve(start, end, steps, distance)
+        points[-1] = end
+        return points
+
+    def step_delay(self, steps: int) -> float:
+        """Seconds to wait between events so the whole move fits in `max_duration`."""
+        if self.mode == "teleport" or steps <= 1:
+            return 0.0
+        return self.max_duration / steps
+
+    @staticmethod
+    def _lerp(start: Point, end: Point, t: float) -> Point:
+        return (
+            round(start[0] + (end[0] - start[0]) * t),
+            round(start[1] + (end[1] - start[1]) * t),
+        )
+
+    @staticmethod
+    def _curve(start: Point, end: Point, steps: int, distance: float) -> list[Point]:
+        # Quadratic bezier with the control point pushed off the straight line
+        dx, dy = end[0] - start[0], end[1] - start[1]
+        bend = random.uniform(-0.2, 0.2) * distance
+        control = (
+            (start[0] + end[0]) / 2 - dy / distance * bend,
+            (start[1] + end[1]) / 2 + dx / distance * bend,
+        )
+        points = []
+        for i in range(1, steps + 1):
+            t = _ease_in_out(i / steps)
+            x = (1 - t) ** 2 * start[0] + 2 * (1 - t) * t * control[0] + t**2 * end[0]
+            y = (1 - t) ** 2 * start[1] + 2 * (1 - t) * t * control[1] + t**2 * end[1]
+            jitter = 0 if i == steps else 1
+            points.append(
+                (
+                    max(round(x) + random.randint(-jitter, jitter), 0),
+                    max(round(y) + random.randint(-jitter, jitter), 0),
+                )
+            )
+        return points
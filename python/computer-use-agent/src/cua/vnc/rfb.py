@@ -0,0 +1,485 @@
+import asyncio
+import logging
+import struct
+import zlib
+
+from Cryptodome.Cipher import DES
+
+from cua.vnc.framebuffer import BYTES_PER_PIXEL, Framebuffer
+
+logger = logging.getLogger(__name__)
+
+# https://github.com/rfbproto/rfbproto/blob/master/rfbproto.rst
+SECURITY_NONE = 1
+SECURITY_VNC_AUTH = 2
+
+ENCODING_RAW = 0
+ENCODING_COPY_RECT = 1
+ENCODING_ZLIB = 6
+ENCODING_DESKTOP_SIZE = -223
+
+SERVER_FRAMEBUFFER_UPDATE = 0
+SERVER_SET_COLOUR_MAP_ENTRIES = 1
+SERVER_BELL = 2
+SERVER_CUT_TEXT = 3
+
+CLIENT_SET_PIXEL_FORMAT = 0
+CLIENT_SET_ENCODINGS = 2
+CLIENT_FRAMEBUFFER_UPDATE_REQUEST = 3
+CLIENT_KEY_EVENT = 4
+CLIENT_POINTER_EVENT = 5
+CLIENT_CUT_TEXT = 6
+
+# 32 bits per pixel, 24 bit depth, little endian, true colour with 8 bits per channel.
+# On the wire every pixel is laid out as B, G, R, X which PIL reads with the "BGRX" raw mode.
+PIXEL_FORMAT = struct.pack("!BBBBHHHBBBxxx", 32, 24, 0, 1, 255, 255, 255, 16, 8, 0)
+
+# X11 keysyms, using the same key names as vncdotool
+# https://github.com/sibson/vncdotool/blob/0.13/vncdotool/client.py#L21
+KEYSYMS: dict[str, int] = {
+    "bsp": 0xFF08,
+    "tab": 0xFF09,
+    "return": 0xFF0D,
+    "enter": 0xFF0D,
+    "esc": 0xFF1B,
+    "ins": 0xFF63,
+    "delete": 0xFFFF,
+    "del": 0xFFFF,
+    "home": 0xFF50,
+    "end": 0xFF57,
+    "pgup": 0xFF55,
+    "pgdn": 0xFF56,
+    "left": 0xFF51,
+    "up": 0xFF52,
+    "right": 0xFF53,
+    "down": 0xFF54,
+    "slash": 0x002F,
+    "fslash": 0x002F,
+    "bslash": 0x005C,
+    "spacebar": 0x0020,
+    "space": 0x0020,
+    "pause": 0xFF13,
+    "scrlk": 0xFF14,
+    "sysrq": 0xFF15,
+    "numlk": 0xFF7F,
+    "caplk": 0xFFE5,
+    "shift": 0xFFE1,
+    "lshift": 0xFFE1,
+    "rshift": 0xFFE2,
+    "ctrl": 0xFFE3,
+    "lctrl": 0xFFE3,
+    "rctrl": 0xFFE4,
+    "meta": 0xFFE7,
+    "lmeta": 0xFFE7,
+    "rmeta": 0xFFE8,
+    "alt": 0xFFE9,
+    "lalt": 0xFFE9,
+    "ralt": 0xFFEA,
+    "super": 0xFFEB,
+    "lsuper": 0xFFEB,
+    "rsuper": 0xFFEC,
+    "menu": 0xFF67,
+    **{f"f{i}": 0xFFBE + i - 1 for i in range(1, 13)},
+}
+
+
+def keysym_for(key: str) -> int:
+    """Return the X11 keysym for a vncdotool style key name or a single character."""
+    if key in KEYSYMS:
+        return KEYSYMS[key]
+    if len(key) == 1:
+        codepoint = ord(key)
+        # Latin-1 characters map directly, everything else uses the unicode keysym range.
+        return codepoint if codepoint <= 0xFF else 0x01000000 | codepoint
+    lowered = key.lower()
+    if lowered in KEYSYMS:
+        return KEYSYMS[lowered]
+    raise ValueError(f"Unknown key: {key}")
+
+
+def parse_vnc_address(address: str, default_port: int = 5900) -> tuple[str, int]:
+    """
+    Parse a vncdotool style address.
+    "host::port" selects a port, "host:display" selects display N on port 5900 + N.
+    """
+    if "::" in address:
+        host, port = address.rsplit("::", 1)
+        return host or "localhost", int(port)
+    if ":" in address:
+        host, display = address.rsplit(":", 1)
+        return host or "localhost", default_port + int(display)
+    return address or "localhost", default_port
+
+
+class RFBError(Exception):
+    """Raised when the VNC server rejects the connection or violates the protocol."""
+
+
+def _vnc_auth_response(password: str, challenge: bytes) -> bytes:
+    # VNC authentication uses the password as a DES key with the bits of every byte reversed.
+    key = (password or "").encode("latin-1")[:8].ljust(8, b"\0")
+    key = bytes(int(f"{byte:08b}"[::-1], 2) for byte in key)
+    return DES.new(key, DES.MODE_ECB).encrypt(challenge)
+
+
+class RFBClient:
+    """
+    Minimal asyncio implementation of the client side of the RFB (VNC) protocol.
+    All input events and framebuffer requests are awaitable, so many clients can
+    share a single event loop without blocking each other.
+    """
+
+    def __init__(self, host: str, port: int, password: str | None = None):
+        self.host = host
+        self.port = port
+        self.password = password
+        self.name = ""
+        self.framebuffer = Framebuffer()
+        self.update_count = 0
+        self._reader: asyncio.StreamReader | None = None
+        self._writer: asyncio.StreamWriter | None = None
+        self._read_task: asyncio.Task | None = None
+        self._live_task: asyncio.Task | None = None
+        self._update_condition = asyncio.Condition()
+        self._zlib = zlib.decompressobj()
+        self._button_mask = 0
+        self._pointer = (0, 0)
+        self._running = False
+
+    @property
+    def width(self) -> int:
+        return self.framebuffer.width
+
+    @property
+    def height(self) -> int:
+        return self.framebuffer.height
+
+    @property
+    def connected(self) -> bool:
+        return (
+            self._running and self._writer is not None and not self._writer.is_closing()
+        )
+
+    async def connect(self, timeout: float = 10) -> None:
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), timeout=timeout
+        )
+        try:
+            await asyncio.wait_for(self._handshake(), timeout=timeout)
+        except BaseException:
+            await self.close()
+            raise
+        self._running = True
+        self._read_task = asyncio.create_task(self._read_loop())
+
+    async def close(self) -> None:
+        self._running = False
+        if self._live_task is not None:
+            self._live_task.cancel()
+            self._live_task = None
+        if self._read_task is not None:
+            self._read_task.cancel()
+            self._read_task = None
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+            self._writer = None
+        self._reader = None
+
+    async def _handshake(self) -> None:
+        server_version = await self._reader.readexactly(12)
+        if not server_version.startswith(b"RFB "):
+            raise RFBError(f"Not a VNC server: {server_version!r}")
+        major, minor = int(server_version[4:7]), int(server_version[8:11])
+        minor = 8 if (major, minor) >= (3, 8) else 7 if (major, minor) >= (3, 7) else 3
+        self._writer.write(b"RFB 003.%03d\n" % minor)
+
+        if minor == 3:
+            (security_type,) = struct.unpack("!I", await self._reader.readexactly(4))
+            if security_type == 0:
+                raise RFBError(await self._read_reason())
+        else:
+            (count,) = await self._reader.readexactly(1)
+            if count == 0:
+                raise RFBError(await self._read_reason())
+            offered = await self._reader.readexactly(count)
+            if SECURITY_VNC_AUTH in offered and self.password:
+                security_type = SECURITY_VNC_AUTH
+            elif SECURITY_NONE in offered:
+                security_type = SECURITY_NONE
+            elif SECURITY_VNC_AUTH in offered:
+                security_type = SECURITY_VNC_AUTH
+            else:
+                raise RFBError(f"No supported security types in {list(offered)}")
+            self._writer.write(bytes([security_type]))
+
+        if security_type == SECURITY_VNC_AUTH:
+            challenge = await self._reader.readexactly(16)
+            self._writer.write(_vnc_auth_response(self.password, challenge))
+        elif security_type != SECURITY_NONE:
+            raise RFBError(f"Unsupported security type: {security_type}")
+
+        if security_type == SECURITY_VNC_AUTH or minor == 8:
+            (result,) = struct.unpack("!I", await self._reader.readexactly(4))
+            if result != 0:
+                reason = await self._read_reason() if minor == 8 else ""
+                raise RFBError(f"VNC authentication failed {reason}".strip())
+
+        # ClientInit, ask for a shared session so other viewers (e.g. noVNC) stay connected
+        self._writer.write(b"\x01")
+        header = await self._reader.readexactly(24)
+        width, height = struct.unpack("!HH", header[:4])
+        (name_length,) = struct.unpack("!I", header[20:24])
+        self.name = (await self._reader.readexactly(name_length)).decode(
+            "utf-8", "replace"
+        )
+        self.framebuffer.resize(width, height)
+
+        self._writer.write(struct.pack("!Bxxx", CLIENT_SET_PIXEL_FORMAT) + PIXEL_FORMAT)
+        encodings = [
+            ENCODING_COPY_RECT,
+            ENCODING_ZLIB,
+            ENCODING_RAW,
+            ENCODING_DESKTOP_SIZE,
+        ]
+        self._writer.write(
+            struct.pack(
+                f"!BxH{len(encodings)}i",
+                CLIENT_SET_ENCODINGS,
+                len(encodings),
+                *encodings,
+            )
+        )
+        await self._writer.drain()
+        logger.info(
+            "Connected to VNC server %s (%sx%s) at %s:%s",
+            self.name,
+            self.width,
+            self.height,
+            self.host,
+            self.port,
+        )
+
+    async def _read_reason(self) -> str:
+        (length,) = struct.unpack("!I", await self._reader.readexactly(4))
+        return (await self._reader.readexactly(length)).decode("utf-8", "replace")
+
+    async def _read_loop(self) -> None:
+        try:
+            while True:
+                (message_type,) = await self._reader.readexactly(1)
+                if message_type == SERVER_FRAMEBUFFER_UPDATE:
+                    await self._read_framebuffer_update()
+                elif message_type == SERVER_SET_COLOUR_MAP_ENTRIES:
+                    _, count = struct.unpack("!xHH", await self._reader.readexactly(5))
+                    await self._reader.readexactly(count * 6)
+                elif message_type == SERVER_BELL:
+                    pass
+                elif message_type == SERVER_CUT_TEXT:
+                    (length,) = struct.unpack(
+                        "!xxxI", await self._reader.readexactly(7)
+                    )
+                    await self._reader.readexactly(length)
+                else:
+                    raise RFBError(f"Unknown server message type: {message_type}")
+        except asyncio.CancelledError:
+            raise
+        except (asyncio.IncompleteReadError, ConnectionError, RFBError) as e:
+            logger.warning(
+                "VNC connection to %s:%s closed: %s", self.host, self.port, e
+            )
+        finally:
+            self._running = False
+            async with self._update_condition:
+                self._update_condition.notify_all()
+
+    async def _read_framebuffer_update(self) -> None:
+        (rect_count,) = struct.unpack("!xH", await self._reader.readexactly(3))
+        for _ in range(rect_count):
+            x, y, w, h, encoding = struct.unpack(
+                "!HHHHi", await self._reader.readexactly(12)
+            )
+            if encoding == ENCODING_RAW:
+                self.framebuffer.blit(
+                    x, y, w, h, await self._reader.readexactly(w * h * BYTES_PER_PIXEL)
+                )
+            elif encoding == ENCODING_ZLIB:
+                (length,) = struct.unpack("!I", await self._reader.readexactly(4))
+                self.framebuffer.blit(
+                    x,
+                    y,
+                    w,
+                    h,
+                    self._zlib.decompress(await self._reader.readexactly(length)),
+                )
+            elif encoding == ENCODING_COPY_RECT:
+                src_x, src_y = struct.unpack("!HH", await self._reader.readexactly(4))
+                self.framebuffer.copy_rect(src_x, src_y, x, y, w, h)
+            elif encoding == ENCODING_DESKTOP_SIZE:
+                self.framebuffer.resize(w, h)
+            else:
+                raise RFBError(f"Unsupported encoding: {encoding}")
+        async with self._update_condition:
+            self.update_count += 1
+            self._update_condition.notify_all()
+
+    async def _send(self, message: bytes) -> None:
+        if self._writer is None:
+            raise RFBError("Not connected to a VNC server")
+        self._writer.write(message)
+        await self._writer.drain()
+
+    async def key_event(self, keysym: int, down: bool) -> None:
+        await self.key_events([(keysym, down)])
+
+    async def key_events(self, events: list[tuple[int, bool]]) -> None:
+        """Send a batch of (keysym, down) key events in a single write."""
+        await self._send(
+            b"".join(
+                struct.pack("!BBxxI", CLIENT_KEY_EVENT, int(down), keysym)
+                for keysym, down in events
+            )
+        )
+
+    async def key_down(self, key: str) -> None:
+        await self.key_event(keysym_for(key), True)
+
+    async def key_up(self, key: str) -> None:
+        await self.key_event(keysym_for(key), False)
+
+    @staticmethod
+    def key_press_events(key: str) -> list[tuple[int, bool]]:
+        """Events to press and release a key. Upper case letters are sent with shift held."""
+        if len(key) == 1 and key.isupper():
+            shift = KEYSYMS["shift"]
+            return [
+                (shift, True),
+                *RFBClient.key_press_events(key.lower()),
+                (shift, False),
+            ]
+        keysym = keysym_for(key)
+        return [(keysym, True), (keysym, False)]
+
+    async def key_press(self, key: str) -> None:
+        await self.key_events(self.key_press_events(key))
+
+    async def pointer_event(self, x: int, y: int, button_mask: int) -> None:
+        self._pointer = (x, y)
+        self._button_mask = button_mask
+        await self._send(
+            struct.pack(
+                "!BBHH", CLIENT_POINTER_EVENT, button_mask, max(x, 0), max(y, 0)
+            )
+        )
+
+    async def mouse_move(self, x: int, y: int) -> None:
+        await self.pointer_event(x, y, self._button_mask)
+
+    async def mouse_down(self, button: int) -> None:
+        x, y = self._pointer
+        await self.pointer_event(x, y, self._button_mask | (1 << (button - 1)))
+
+    async def mouse_up(self, button: int) -> None:
+        x, y = self._pointer
+        await self.pointer_event(x, y, self._button_mask & ~(1 << (button - 1)))
+
+    async def mouse_press(self, button: int) -> None:
+        await self.mouse_down(button)
+        await self.mouse_up(button)
+
+    async def mouse_clicks(self, button: int, count: int) -> None:
+        """Press and release a button `count` times in a single write, e.g. wheel clicks."""
+        x, y = self._pointer
+        pressed = self._button_mask | (1 << (button - 1))
+        released = self._button_mask & ~(1 << (button - 1))
+        await self._send(
+            b"".join(
+                struct.pack("!BBHH", CLIENT_POINTER_EVENT, mask, max(x, 0), max(y, 0))
+                for _ in range(count)
+                for mask in (pressed, released)
+            )
+        )
+        self._button_mask = released
+
+    async def client_cut_text(self, text: str) -> None:
+        data = text.encode("latin-1")
+        await self._send(struct.pack("!BxxxI", CLIENT_CUT_TEXT, len(data)) + data)
+
+    async def request_framebuffer_update(
+        self,
+        incremental: bool = False,
+        x: int = 0,
+        y: int = 0,
+        width: int | None = None,
+        height: int | None = None,
+    ) -> None:
+        width = self.width - x if width is None else width
+        height = self.height - y if height is None else height
+        await self._send(
+            struct.pack(
+                "!BBHHHH",
+                CLIENT_FRAMEBUFFER_UPDATE_REQUEST,
+                int(incremental),
+                x,
+                y,
+                width,
+                height,
+            )
+        )
+
+    async def refresh(self, incremental: bool = False, timeout: float = 10) -> None:
+        """Request a framebuffer update and wait until the server has delivered it."""
+        async with self._update_condition:
+            expected = self.update_count + 1
+        await self.request_framebuffer_update(incremental=incremental)
+        async with self._update_condition:
+            await asyncio.wait_for(
+                self._update_condition.wait_for(
+                    lambda: self.update_count >= expected or not self.connected
+                ),
+                timeout=timeout,
+            )
+        if not self.connected:
+            raise RFBError(
+                "VNC connection closed while waiting for a framebuffer update"
+            )
+
+    async def wait_for_update(self, timeout: float) -> bool:
+        """Wait for the next framebuffer update. Returns False if none arrived in time."""
+        async with self._update_condition:
+            seen = self.update_count
+            try:
+                await asyncio.wait_for(
+                    self._update_condition.wait_for(
+                        lambda: self.update_count > seen or not self.connected
+                    ),
+                    timeout=timeout,
+                )
+            except asyncio.TimeoutError:
+                return False
+        return self.update_count > seen
+
+    async def start_live_updates(self, interval: float = 0.05) -> None:
+        """
+        Keep an incremental update request outstanding so the framebuffer follows the
+        remote screen. The server only answers once something changed, so an idle
+        screen costs nothing. `interval` caps the update rate.
+        """
+        if self._live_task is None or self._live_task.done():
+            self._live_task = asyncio.create_task(self._live_update_loop(interval))
+
+    async def _live_update_loop(self, interval: float) -> None:
+        try:
+            while self.connected:
+                seen = self.update_count
+                await self.request_framebuffer_update(incremental=True)
+                async with self._update_condition:
+                    await self._update_condition.wait_for(
+                        lambda: self.update_count > seen or not self.connected
+                    )
+                await asyncio.sleep(interval)
+        except (ConnectionError, RFBError) as e:
+            logger.warning("Stopped live VNC updates: %s", e)
@@ -1,16 +1,19 @@
+import asyncio
 import logging
-import math
-import time
-from contextlib import contextmanager
-from typing import Any, Iterator, Literal
-
-from vncdotool import api
-from vncdotool.client import VNCDoToolClient
+import re
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Literal
 
+from cua.image_pipeline import ImageEncoding
+from cua.vnc.framebuffer import Rect, estimate_vertical_shift
+from cua.vnc.motion import MotionPlanner
+from cua.vnc.rfb import RFBClient, keysym_for, parse_vnc_address
 
 # Initialize logger
 logger = logging.getLogger(__name__)
 
+TypingMode = Literal["burst", "paste", "per_key"]
+
 # https://github.com/sibson/vncdotool/blob/0.13/vncdotool/client.py#L21
 CUA_KEY_TO_VNC_KEY: dict[str, str] = {
     "/": "fslash",
@@ -41,6 +44,14 @@ CUA_KEY_TO_VNC_KEY: dict[str, str] = {
 }
 
 
+# VNC mouse button constants - http://xahlee.info/linux/linux_x11_mouse_button_number.html
+BUTTON_SCROLL_UP = 4  # linux maapping to scroll up
+BUTTON_SCROLL_DOWN = 5  # linux maapping to scroll down
+
+# Keys a session may have left held down
+MODIFIER_KEYS = ("alt", "ctrl", "shift", "super")
+
+
 def cua_key_to_vnc_key(key: str) -> str:
     """
     Maps from our standard key definition to the VNC key definition
@@ -49,45 +60,150 @@ def cua_key_to_vnc_key(key: str) -> str:
     return CUA_KEY_TO_VNC_KEY.get(key) or key
 
 
+def text_to_vnc_keys(text: str) -> list[str]:
+    """
+    Maps typed text to the VNC keys to press
+    """
+    return ["enter" if c == "\n" else "tab" if c == "\t" else c for c in text]
+
+
 class VNCMachine:
-    def __init__(self, address: str, password: str = None) -> None:
+    def __init__(
+        self,
+        address: str,
+        password: str = None,
+        motion_planner: MotionPlanner | None = None,
+        typing_mode: TypingMode = "burst",
+        key_delay: float = 0.06,
+        paste_keys: list[str] | None = None,
+        scroll_pixels_per_click: float = 50.0,
+        calibrate_scroll: bool = True,
+        reset_keys: list[list[str]] | None = None,
+    ) -> None:
         self.address = address
         self.mouse_last_position = None
         self.password = password
-        self.cached_client = None
-        self._api = None
+        self.motion_planner = motion_planner or MotionPlanner()
+        self.typing_mode = typing_mode
+        self.key_delay = key_delay
+        self.paste_keys = paste_keys or ["ctrl", "v"]
+        self.scroll_pixels_per_click = scroll_pixels_per_click
+        # Measure how far one wheel click scrolls on the first vertical scrolls
+        self._scroll_calibration_attempts = 2 if calibrate_scroll else 0
+        # Key combinations pressed to clear the screen before another session uses it
+        self.reset_keys = reset_keys or []
+        self.cached_client: RFBClient | None = None
+        self._connect_lock = asyncio.Lock()
+        self._last_screenshot: bytes | None = None
+        self._last_screenshot_options: tuple | None = None
+        # Rectangles of the remote screen that changed between the last two screenshots
+        self.changed_rects: list[Rect] = []
 
-    async def _get_vnc_client(self) -> Any:
+    async def _get_vnc_client(self) -> RFBClient:
         """
         Return the VNC client connected to this machine.
         """
-        if self.cached_client:
+        if self.cached_client and self.cached_client.connected:
             return self.cached_client
-        try:
-            logger.info(
-                f"Connecting to vnc client with address: {self.address} and password: {self.password}"
-            )
-            self.cached_client = api.connect(self.address, password=self.password)
-        except Exception as e:
-            logger.error(f"Error connecting to VNC: {e}")
-            raise e
+        async with self._connect_lock:
+            if self.cached_client and self.cached_client.connected:
+                return self.cached_client
+            try:
+                logger.info(f"Connecting to vnc client with address: {self.address}")
+                host, port = parse_vnc_address(self.address)
+                client = RFBClient(host, port, password=self.password)
+                await client.connect()
+                await client.refresh(incremental=False)
+                await client.start_live_updates()
+            except Exception as e:
+                logger.error(f"Error connecting to VNC: {e}")
+                raise e
+            self.cached_client = client
+            self._last_screenshot = None
         return self.cached_client
 
+    async def close(self) -> None:
+        if self.cached_client:
+            await self.cached_client.close()
+            self.cached_client = None
+
+    async def check_connection(self) -> bool:
+        """
+        Connect if needed and return whether the machine is reachable.
+        """
+        try:
+            await self._get_vnc_client()
+        except Exception:
+            return False
+        return True
+
+    async def reset(self) -> None:
+        """
+        Clear what a previous session left behind: release every button and modifier,
+        empty the clipboard and press the reset key combinations.
+        """
+        client = await self._get_vnc_client()
+        x, y = self.mouse_last_position or (100, 100)
+        await client.pointer_event(x, y, 0)
+        await client.key_events(
+            [(keysym_for(cua_key_to_vnc_key(key)), False) for key in MODIFIER_KEYS]
+        )
+        await client.client_cut_text("")
+        for keys in self.reset_keys:
+            async with self.hold_keys(client, keys):
+                pass
+        if self.reset_keys:
+            await self.wait_for_settle()
+
     async def type(self, text: str) -> None:
+        """
+        Type text with the configured typing mode. Targets that drop fast key events
+        are configured with the "per_key" mode.
+        """
+        if not text:
+            return
         client = await self._get_vnc_client()
-        client.factory.force_caps = True
-        for char in text:
-            if char == "\n":
-                client.keyPress("enter")
-            elif char == "\t":
-                client.keyPress("tab")
-            else:
-                client.keyPress(char)
-            time.sleep(0.06)
+        if self.typing_mode == "per_key":
+            await self._type_per_key(text, client)
+        elif self.typing_mode == "paste" and self._can_paste(text):
+            await self._type_paste(text, client)
+        else:
+            await client.key_events(
+                [
+                    event
+                    for key in text_to_vnc_keys(text)
+                    for event in client.key_press_events(key)
+                ]
+            )
+
+    async def _type_per_key(self, text: str, client: RFBClient) -> None:
+        for key in text_to_vnc_keys(text):
+            await client.key_press(key)
+            if self.key_delay:
+                await asyncio.sleep(self.key_delay)
+
+    @staticmethod
+    def _can_paste(text: str) -> bool:
+        # ClientCutText only carries Latin-1
+        try:
+            text.encode("latin-1")
+        except UnicodeEncodeError:
+            return False
+        return True
+
+    async def _type_paste(self, text: str, client: RFBClient) -> None:
+        # Newlines and tabs are pressed as keys so they still submit forms and move focus
+        for segment in re.split(r"([\n\t])", text):
+            if segment in ("\n", "\t"):
+                await client.key_press(text_to_vnc_keys(segment)[0])
+            elif segment:
+                await client.client_cut_text(segment)
+                async with self.hold_keys(client, self.paste_keys):
+                    pass
 
     async def multi_key_press(self, keys: list[str]) -> None:
         client = await self._get_vnc_client()
-        with self.hold_keys(client, keys):
+        async with self.hold_keys(client, keys):
             pass
 
     async def move_mouse(
@@ -96,8 +212,8 @@ class VNCMachine:
         keys: list[str] | None = None,
     ) -> None:
         client = await self._get_vnc_client()
-        with self.hold_keys(client, keys):
-            self._move_mouse_internal(position, client, 0.0002)
+        async with self.hold_keys(client, keys):
+            await self._move_mouse_internal(position, client)
 
     async def mouse_click(
         self,
@@ -107,23 +223,84 @@ class VNCMachine:
         keys: list[str] | None = None,
     ) -> None:
         client = await self._get_vnc_client()
-        with self.hold_keys(client, keys):
-            self._move_mouse_internal(position, client)
-            time.sleep(0.05)  # wait for mouse to stabalize
+        async with self.hold_keys(client, keys):
+            await self._move_mouse_internal(position, client)
             if action == "click":
-                client.mousePress(button)
+                await client.mouse_press(button)
             elif action == "double_click":
-                client.mousePress(1)
-                time.sleep(0.05)
-                client.mousePress(1)
+                await client.mouse_press(1)
+                await client.mouse_press(1)
+
+    async def collect_changes(self) -> list[Rect]:
+        """
+        Take the rectangles that changed since the last call, they describe the
+        next screenshot.
+        """
+        client = await self._get_vnc_client()
+        self.changed_rects = client.framebuffer.take_dirty()
+        if self.changed_rects:
+            self._last_screenshot = None
+        return self.changed_rects
+
+    @property
+    def screen_size(self) -> tuple[int, int] | None:
+        if self.cached_client is None:
+            return None
+        return self.cached_client.width, self.cached_client.height
+
+    async def encode_screenshot(
+        self, size: tuple[int, int] | None = None, encoding: ImageEncoding | None = None
+    ) -> bytes:
+        """
+        Encode the live framebuffer without touching the filesystem, fitted to `size`.
+        If nothing changed since the last screenshot with the same options, the
+        previous bytes are returned as is.
+        """
+        client = await self._get_vnc_client()
+        options = (size, encoding)
+        if self._last_screenshot is not None and self._last_screenshot_options == options:
+            return self._last_screenshot
+        framebuffer = client.framebuffer.snapshot()
+        self._last_screenshot = await asyncio.to_thread(framebuffer.encode, size, encoding)
+        self._last_screenshot_options = options
+        return self._last_screenshot
 
     async def screenshot(
-        self, keys: list[str] | None = None, screenshot_name="screenshot.png"
-    ) -> None:
+        self, size: tuple[int, int] | None = None, encoding: ImageEncoding | None = None
+    ) -> bytes:
+        await self.collect_changes()
+        return await self.encode_screenshot(size, encoding)
+
+    async def wait_for_settle(
+        self, max_wait: float = 2.0, quiet_period: float = 0.15
+    ) -> bool:
+        """
+        Wait until the framebuffer has not changed for `quiet_period` seconds.
+        Returns False if the screen was still changing after `max_wait` seconds.
+        """
         client = await self._get_vnc_client()
-        with self.hold_keys(client, keys or []):
-            client.local_cursor = True
-            client.captureScreen(screenshot_name)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + max_wait
+        last_change = loop.time()
+        version = client.framebuffer.version
+        while True:
+            now = loop.time()
+            if now - last_change >= quiet_period:
+                return True
+            if now >= deadline:
+                logger.debug("Screen did not settle within %ss", max_wait)
+                return False
+            await client.wait_for_update(
+                timeout=min(last_change + quiet_period, deadline) - now
+            )
+            if client.framebuffer.version != version:
+                version = client.framebuffer.version
+                last_change = loop.time()
+
+    @property
+    def screen_changed(self) -> bool:
+        """Whether the last screenshot differs from the one before it."""
+        return bool(self.changed_rects)
 
     async def drag_mouse(
         self,
@@ -134,18 +311,17 @@ class VNCMachine:
             raise ValueError("At least two points are required for a multi-point drag.")
 
         client = await self._get_vnc_client()
-        with self.hold_keys(client, keys):
-            self._move_mouse_internal(path[0], client)
+        async with self.hold_keys(client, keys):
+            await self._move_mouse_internal(path[0], client)
 
-            time.sleep(0.05)
-            client.mouseDown(1)
-            time.sleep(0.05)
+            await asyncio.sleep(0.05)
+            await client.mouse_down(1)
+            await asyncio.sleep(0.05)
 
             for point in path[1:]:
-                self._move_mouse_internal(point, client, delay=0.005)
+                await self._move_mouse_internal(point, client)
 
-            client.mouseUp(1)
-            time.sleep(0.05)
+            await client.mouse_up(1)
 
     async def scroll(
         self,
@@ -158,73 +334,93 @@ class VNCMachine:
         keys = keys or []
 
         client = await self._get_vnc_client()
-        self._move_mouse_internal((x, y), client)
-
-        # VNC mouse button constants - http://xahlee.info/linux/linux_x11_mouse_button_number.html
-        BUTTON_SCROLL_UP = 4  # linux maapping to scroll up
-        BUTTON_SCROLL_DOWN = 5  # linux maapping to scroll down
+        await self._move_mouse_internal((x, y), client)
 
-        with self.hold_keys(client, keys):
+        async with self.hold_keys(client, keys):
             if vertical != 0:
                 direction = BUTTON_SCROLL_DOWN if vertical > 0 else BUTTON_SCROLL_UP
-                self._scroll(abs(vertical), direction, client)
+                await self._scroll(abs(vertical), direction, client, calibrate=True)
 
             if horizontal != 0:
-                with self.hold_keys(client, ["shift"]):
+                async with self.hold_keys(client, ["shift"]):
                     direction = (
                         BUTTON_SCROLL_DOWN if horizontal > 0 else BUTTON_SCROLL_UP
                     )
-                    self._scroll(abs(horizontal), direction, client)
+                    await self._scroll(abs(horizontal), direction, client)
 
-    def _scroll(
+    async def _scroll(
         self,
         scroll_amount: int,
         direction: int,
-        client: VNCDoToolClient,
-        delay: float = 0.5,
-        scroll_factor: float = 50.0,
+        client: RFBClient,
+        calibrate: bool = False,
     ) -> None:
-        # Calculate number of scroll events
-        num_events = max(int(abs(scroll_amount) / scroll_factor), 1)
+        if calibrate and self._scroll_calibration_attempts > 0:
+            # The calibration click counts towards the scroll, measured or not
+            scroll_amount -= await self._calibrate_scroll(direction, client)
+            num_events = round(max(scroll_amount, 0) / self.scroll_pixels_per_click)
+        else:
+            num_events = max(round(scroll_amount / self.scroll_pixels_per_click), 1)
+
+        # All wheel clicks go out in one write, the caller waits for the screen to settle once
+        if num_events > 0:
+            await client.mouse_clicks(direction, num_events)
 
-        for _ in range(num_events):
-            client.mousePress(direction)
-            time.sleep(delay)
+    async def _calibrate_scroll(self, direction: int, client: RFBClient) -> float:
+        """
+        Scroll by one wheel click and measure how many pixels the content moved.
+        Returns the pixels scrolled, the current estimate if they could not be measured.
+        """
+        self._scroll_calibration_attempts -= 1
+        before = client.framebuffer.snapshot()
+        await client.mouse_clicks(direction, 1)
+        await self.wait_for_settle(max_wait=0.5)
+        shift = await asyncio.to_thread(
+            estimate_vertical_shift,
+            before,
+            client.framebuffer.snapshot(),
+            self.mouse_last_position[0],
+        )
+        # Scrolling down moves the content up
+        if shift is not None and direction == BUTTON_SCROLL_UP:
+            shift = -shift
+        if shift is None or shift <= 0:
+            logger.debug("Could not measure the scroll distance of a wheel click")
+            return self.scroll_pixels_per_click
+        logger.info("Calibrated scrolling to %s pixels per wheel click", shift)
+        self.scroll_pixels_per_click = shift
+        self._scroll_calibration_attempts = 0
+        return shift
 
-    def _move_mouse_internal(
+    async def _move_mouse_internal(
         self,
         position: tuple[int, int],
-        client: VNCDoToolClient,
-        delay: float = 0.0002,
+        client: RFBClient,
     ) -> None:
         if (
             not hasattr(self, "mouse_last_position") or self.mouse_last_position is None
         ):  # assuming some arbitrary initial position
             self.mouse_last_position = (100, 100)
-        x1, y1 = self.mouse_last_position
-        x2, y2 = position
-        steps = max(int(math.hypot(x2 - x1, y2 - y1)), 1)
-        for i in range(1, steps + 1):
-            client.mouseMove(
-                int(x1 + (x2 - x1) * i / steps), int(y1 + (y2 - y1) * i / steps)
-            )
-            time.sleep(delay)
+        points = self.motion_planner.plan(self.mouse_last_position, tuple(position))
+        delay = self.motion_planner.step_delay(len(points))
+        for i, (x, y) in enumerate(points):
+            if delay and i:
+                await asyncio.sleep(delay)
+            await client.mouse_move(x, y)
         self.mouse_last_position = position
-        time.sleep(0.05)  # Wait for the mouse to settle
 
     @staticmethod
-    @contextmanager
-    def hold_keys(
-        client: VNCDoToolClient, keys: list[str] | None = None
-    ) -> Iterator[None]:
+    @asynccontextmanager
+    async def hold_keys(
+        client: RFBClient, keys: list[str] | None = None
+    ) -> AsyncIterator[None]:
         keys = keys or []
-        client.factory.force_caps = True
         try:
             for key in keys:
                 key = cua_key_to_vnc_key(key=key)
-                client.keyDown(key)
+                await client.key_down(key)
             yield
         finally:
             for key in reversed(keys):
                 key = cua_key_to_vnc_key(key=key)
-                client.keyUp(key)
+                await client.key_up(key)
@@ -0,0 +1,141 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+# Called with the 1-based position of a run in the queue, each time it changes
+OnQueued = Callable[[int], Awaitable[None]]
+
+
+class SessionBusy(Exception):
+    """Raised when a session already has a run that is queued or in progress."""
+
+
+class RunQueueFull(Exception):
+    """Raised when every run slot is taken and the queue cannot take another run."""
+
+
+class _Run:
+    def __init__(self, session_id: str, on_queued: OnQueued | None):
+        self.session_id = session_id
+        self.on_queued = on_queued
+        # Resolved once the run holds one of the slots
+        self.admitted = asyncio.get_running_loop().create_future()
+        self.position = 0
+
+
+class AgentScheduler:
+    """
+    Runs agent tasks in the background: one run at a time per session, at most
+    `max_concurrent_runs` overall, and the rest wait their turn in order. Handles of
+    every run are kept so runs can be cancelled and drained when the app stops.
+    """
+
+    def __init__(self, max_concurrent_runs: int = 4, max_queued_runs: int = 20):
+        self.max_concurrent_runs = max_concurrent_runs
+        self.max_queued_runs = max_queued_runs
+        self._running = 0
+        self._queue: deque[_Run] = deque()
+        self._tasks: dict[str, asyncio.Task] = {}
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    @property
+    def queued(self) -> int:
+        return len(self._queue)
+
+    def is_active(self, session_id: str) -> bool:
+        return session_id in self._tasks
+
+    def submit(
+        self,
+        session_id: str,
+        run: Callable[[], Awaitable[None]],
+        on_queued: OnQueued | None = None,
+    ) -> asyncio.Task:
+        """Start the run, or queue it when all slots are taken."""
+        if session_id in self._tasks:
+            raise SessionBusy(f"Session {session_id} already has a run")
+        entry = _Run(session_id, on_queued)
+        if self._running < self.max_concurrent_runs and not self._queue:
+            self._running += 1
+            entry.admitted.set_result(None)
+        elif len(self._queue) >= self.max_queued_runs:
+            raise RunQueueFull(f"{len(self._queue)} runs are already waiting")
+        else:
+            self._queue.append(entry)
+            self._notify_positions()
+        task = asyncio.create_task(self._run(entry, run))
+        # Cleaning up in a callback also covers runs cancelled before they started
+        task.add_done_callback(lambda _: self._finish(entry))
+        self._tasks[session_id] = task
+        return task
+
+    def cancel(self, session_id: str) -> bool:
+        """Cancel the session's run, queued or in progress."""
+        task = self._tasks.get(session_id)
+        if task is None:
+            return False
+        task.cancel()
+        return True
+
+    async def drain(self, timeout: float) -> None:
+        """Give active runs `timeout` seconds to finish, then cancel the rest."""
+        # Queued runs would only start to be cancelled right away
+        for entry in list(self._queue):
+            self.cancel(entry.session_id)
+        tasks = list(self._tasks.values())
+        if not tasks:
+            return
+        logger.info(f"Waiting for {len(tasks)} agent runs to finish")
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.warning(f"Cancelled {len(pending)} agent runs at shutdown")
+            await asyncio.wait(pending)
+
+    async def _run(self, entry: _Run, run: Callable[[], Awaitable[None]]) -> None:
+        try:
+            await entry.admitted
+            await run()
+        except asyncio.CancelledError:
+            logger.info(f"Agent run for session {entry.session_id} was cancelled")
+        except Exception as e:
+            logger.error(f"Agent run for session {entry.session_id} failed: {e}")
+
+    def _finish(self, entry: _Run) -> None:
+        self._tasks.pop(entry.session_id, None)
+        if entry.admitted.done() and not entry.admitted.cancelled():
+            self._running -= 1
+        elif entry in self._queue:
+            self._queue.remove(entry)
+        self._admit_waiting()
+
+    def _admit_waiting(self) -> None:
+        while self._queue and self._running < self.max_concurrent_runs:
+            entry = self._queue.popleft()
+            if entry.admitted.cancelled():
+                # Cancelled while queued, its task is about to finish
+                continue
+            self._running += 1
+            entry.admitted.set_result(None)
+        self._notify_positions()
+
+    def _notify_positions(self) -> None:
+        for position, entry in enumerate(self._queue, 1):
+            if entry.position != position:
+                entry.position = position
+                if entry.on_queued:
+                    asyncio.create_task(self._send_position(entry, position))
+
+    @staticmethod
+    async def _send_position(entry: _Run, position: int) -> None:
+        try:
+            await entry.on_queued(position)
+        except Exception as e:
+            logger.error(f"Error sending the queue position: {e}")
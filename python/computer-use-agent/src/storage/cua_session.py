@@ -1,9 +1,13 @@
+import asyncio
+import inspect
 import logging
 import typing
 import uuid
+from collections import deque
 from dataclasses import dataclass, field
 from datetime import datetime
-from typing import Literal
+from itertools import islice
+from typing import Awaitable, Callable, Literal
 
 from openai.types.responses.response import Response
 from openai.types.responses.response_computer_tool_call import (
@@ -14,93 +18,291 @@ from openai.types.responses.response_function_tool_call import (
     ResponseFunctionToolCall,
 )
 from openai.types.responses.response_input_param import Reasoning
+from openai.types.responses.response_reasoning_item import ResponseReasoningItem
+from pydantic import TypeAdapter
 
 from cua.browser.browser import Browser
 
 # Get logger for this module
 logger = logging.getLogger(__name__)
 
+# Step actions are told apart by their "type" when a session is restored
+_call_action_adapter = TypeAdapter(
+    Action | ResponseFunctionToolCall | ResponseReasoningItem | None
+)
+_safety_checks_adapter = TypeAdapter(list[PendingSafetyCheck])
+
 
-@dataclass
+@dataclass(slots=True)
 class CuaSessionHistory:
     call_action: Action | ResponseFunctionToolCall | None = None
     pending_safety_checks: list[PendingSafetyCheck] = field(default_factory=list)
     last_message: str = ""
+    next_action: str = ""
 
 
 class CuaSessionStepState:
-    "Tracking and controlling the state."
+    """
+    Tracking and controlling the state. Only what the next steps need is kept from
+    the response, the response itself is dropped once parsed.
+    """
+
+    __slots__ = (
+        "response_id",
+        "next_action",
+        "call_id",
+        "call_action",
+        "pending_safety_checks",
+        "last_message",
+        "screenshot_base64",
+        "action_task",
+        "action_executed",
+    )
 
     response_id: str
     next_action: typing.Literal[
-        "user_interaction", "computer_call_output", "functional_call", "reasoning"
+        "user_interaction", "computer_call_output", "functional_call", "reasoning", ""
     ]
-    call_id: str = ""
-    call_action: Action | ResponseFunctionToolCall | Reasoning | None = None
-    pending_safety_checks: list[PendingSafetyCheck] = []
-    last_message: str = ""
-    response: Response
-    screenshot_base64: str | None = None
+    call_id: str
+    call_action: Action | ResponseFunctionToolCall | Reasoning | None
+    pending_safety_checks: list[PendingSafetyCheck]
+    last_message: str
+    screenshot_base64: str | None
+    # The computer action, when it was started while the response was streaming
+    action_task: asyncio.Task | None
+    # The computer action already ran, or started to, and must not run again
+    action_executed: bool
+
+    def __init__(
+        self,
+        response_id: str,
+        next_action: str = "",
+        call_id: str = "",
+        call_action: Action | ResponseFunctionToolCall | Reasoning | None = None,
+        pending_safety_checks: list[PendingSafetyCheck] | None = None,
+        last_message: str = "",
+        screenshot_base64: str | None = None,
+        action_executed: bool = False,
+    ):
+        self.response_id = response_id
+        self.next_action = next_action
+        self.call_id = call_id
+        self.call_action = call_action
+        self.pending_safety_checks = pending_safety_checks or []
+        self.last_message = last_message
+        self.screenshot_base64 = screenshot_base64
+        self.action_task = None
+        self.action_executed = action_executed
 
-    def __init__(self, response: Response, screenshot_base64: str | None = None):
+    @classmethod
+    def from_response(
+        cls, response: Response, screenshot_base64: str | None = None
+    ) -> "CuaSessionStepState":
         logger.debug("Initializing state with response: %s", response)
         assert response.status == "completed"
-        self.response = response
-        self.next_action = ""
-        self.response_id = response.id
-        self.screenshot_base64 = screenshot_base64
+        step = cls(response.id, screenshot_base64=screenshot_base64)
         # If the item is a computer call, setting the next action and passing the action arguments.
         for item in response.output:
             if item.type == "function_call":  # Add handling for function type
-                self.next_action = "functional_call"
-                self.call_id = item.call_id
-                self.call_action = item
+                step.next_action = "functional_call"
+                step.call_id = item.call_id
+                step.call_action = item
             elif item.type == "computer_call":
-                self.next_action = "computer_call_output"
+                step.next_action = "computer_call_output"
                 # Ensure we always have a valid string ID
-                self.call_id = item.call_id
-                self.call_action = item.action
-                self.pending_safety_checks = getattr(item, "pending_safety_checks", [])
+                step.call_id = item.call_id
+                step.call_action = item.action
+                step.pending_safety_checks = getattr(item, "pending_safety_checks", None) or []
             elif item.type == "reasoning":
-                self.next_action = "reasoning"
-                self.call_action = item
+                step.next_action = "reasoning"
+                step.call_action = item
             else:
-                self.next_action = "user_interaction"
+                step.next_action = "user_interaction"
                 if item.type == "message":
                     for content in item.content:
                         if content.type == "output_text":
-                            self.last_message += content.text
+                            step.last_message += content.text
+        return step
 
 
 class CuaSession:
-    history: list[CuaSessionHistory]
+    # Only the latest steps are kept, `step_count` counts all of them
+    history: deque[CuaSessionHistory]
+    step_count: int
     current_step: CuaSessionStepState | None
     id: str
     created_at: datetime
     signal: Literal["acknowledged_pending_safety_checks", "pause_requested"] | None
     status: Literal["Running", "Paused", "Error"] | None
     browser: Browser | None
+    # Card elements for the latest steps, `rendered_steps` counts all rendered steps
+    rendered_history: deque[dict]
+    rendered_steps: int
+    # Where the browser was when the session was snapshotted, used to reopen it
+    browser_state: dict | None
 
-    def __init__(self):
-        self.history = []
+    def __init__(self, max_history: int = 50):
+        self.history = deque(maxlen=max_history)
+        self.step_count = 0
         self.current_step = None
         self.id = str(uuid.uuid4())
         self.created_at = datetime.now()
         self.signal = None
         self.status = "Running"
         self.browser = None
+        self.rendered_history = deque(maxlen=max_history)
+        self.rendered_steps = 0
+        self.browser_state = None
+        self._close_callbacks: list[Callable[[], Awaitable[None] | None]] = []
+        self._change_callbacks: list[Callable[[], None]] = []
+
+    def on_close(self, callback: Callable[[], Awaitable[None] | None]) -> None:
+        """Register a callback that releases a resource held by this session."""
+        self._close_callbacks.append(callback)
+
+    def on_change(self, callback: Callable[[], None]) -> None:
+        """Register a callback that runs when a step is added or the session changed."""
+        self._change_callbacks.append(callback)
+
+    def notify_changed(self) -> None:
+        """Let the callbacks know the session changed, e.g. its status."""
+        for callback in self._change_callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Error in change callback of session {self.id}: {e}")
+
+    async def close(self) -> None:
+        """Release everything the session holds, e.g. its browser or leased desktop."""
+        callbacks, self._close_callbacks = self._close_callbacks, []
+        for callback in callbacks:
+            try:
+                result = callback()
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                logger.error(f"Error closing session {self.id}: {e}")
+        if self.browser:
+            await self.browser.cleanup()
+            self.browser = None
 
     def add_step(self, response: Response, screenshot_base64: str | None = None):
-        step = CuaSessionStepState(response, screenshot_base64=screenshot_base64)
+        step = CuaSessionStepState.from_response(
+            response, screenshot_base64=screenshot_base64
+        )
         self.history.append(
             CuaSessionHistory(
                 call_action=step.call_action,
                 pending_safety_checks=step.pending_safety_checks,
                 last_message=step.last_message,
+                next_action=step.next_action,
             )
         )
+        self.step_count += 1
         self.current_step = step
+        self.notify_changed()
+
+    def unrendered_history(self) -> list[CuaSessionHistory]:
+        """Steps added since the history was last rendered, at most the ones still kept."""
+        missing = min(self.step_count - self.rendered_steps, len(self.history))
+        return list(islice(self.history, len(self.history) - missing, None))
+
+    def add_rendered_step(self, element: dict) -> None:
+        self.rendered_history.append(element)
+        self.rendered_steps += 1
+
+    def to_state(self) -> dict:
+        """
+        Serialize what is needed to resume the session later. Live resources such as
+        the browser are not part of it, a resumed session gets new ones. Neither are
+        screenshots or rendered cards: a resumed session takes a new screenshot before
+        its next request, and its kept history is rendered again.
+        """
+        step = self.current_step
+        return {
+            "id": self.id,
+            "created_at": self.created_at.isoformat(),
+            "signal": self.signal,
+            "status": self.status,
+            "max_history": self.history.maxlen,
+            "step_count": self.step_count,
+            "history": [
+                {
+                    "call_action": _call_action_adapter.dump_python(
+                        entry.call_action, mode="json"
+                    ),
+                    "pending_safety_checks": _safety_checks_adapter.dump_python(
+                        entry.pending_safety_checks, mode="json"
+                    ),
+                    "last_message": entry.last_message,
+                    "next_action": entry.next_action,
+                }
+                for entry in self.history
+            ],
+            "current_step": (
+                {
+                    "response_id": step.response_id,
+                    "next_action": step.next_action,
+                    "call_id": step.call_id,
+                    "call_action": _call_action_adapter.dump_python(
+                        step.call_action, mode="json"
+                    ),
+                    "pending_safety_checks": _safety_checks_adapter.dump_python(
+                        step.pending_safety_checks, mode="json"
+                    ),
+                    "last_message": step.last_message,
+                    "action_executed": step.action_executed,
+                }
+                if step
+                else None
+            ),
+            "browser": self.browser_state,
+        }
+
+    async def snapshot(self) -> dict:
+        """Like `to_state`, with the current state of the browser when there is one."""
+        state = self.to_state()
+        if self.browser:
+            state["browser"] = await self.browser.export_state() or self.browser_state
+        return state
+
+    @classmethod
+    def from_state(cls, state: dict) -> "CuaSession":
+        session = cls(state["max_history"])
+        session.id = state["id"]
+        session.created_at = datetime.fromisoformat(state["created_at"])
+        session.signal = state["signal"]
+        session.status = state["status"]
+        session.step_count = state["step_count"]
+        session.history.extend(
+            CuaSessionHistory(
+                call_action=_call_action_adapter.validate_python(entry["call_action"]),
+                pending_safety_checks=_safety_checks_adapter.validate_python(
+                    entry["pending_safety_checks"]
+                ),
+                last_message=entry["last_message"],
+                next_action=entry["next_action"],
+            )
+            for entry in state["history"]
+        )
+        step = state["current_step"]
+        if step:
+            session.current_step = CuaSessionStepState(
+                step["response_id"],
+                next_action=step["next_action"],
+                call_id=step["call_id"],
+                call_action=_call_action_adapter.validate_python(step["call_action"]),
+                pending_safety_checks=_safety_checks_adapter.validate_python(
+                    step["pending_safety_checks"]
+                ),
+                last_message=step["last_message"],
+                action_executed=step.get("action_executed", False),
+            )
+        # Only the kept history is rendered again, the older steps still count
+        session.rendered_steps = session.step_count - len(session.history)
+        session.browser_state = state.get("browser")
+        return session
 
     @classmethod
-    def create(cls) -> "CuaSession":
-        return cls()
+    def create(cls, max_history: int = 50) -> "CuaSession":
+        return cls(max_history)
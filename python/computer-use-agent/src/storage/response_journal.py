@@ -0,0 +1,30 @@
+from pathlib import Path
+
+from openai.types.responses.response import Response
+
+from cua.background_writer import BackgroundWriter
+
+
+class ResponseJournal:
+    """
+    Appends the raw model responses of each session to `<directory>/<session id>.jsonl`
+    from a background task, so sessions only keep what they parsed from a response.
+    When more than `max_pending` responses are waiting to be written, new ones are dropped.
+    """
+
+    def __init__(self, directory: str | Path, max_pending: int = 64):
+        self.directory = Path(directory)
+        self._writer = BackgroundWriter(self.directory, max_pending, "model responses")
+
+    def submit(self, session_id: str, response: Response) -> None:
+        """Queue a response to be written, without blocking the caller."""
+        self._writer.submit(lambda directory: self._append(directory, session_id, response))
+
+    async def close(self) -> None:
+        """Write the responses still queued and stop the background task."""
+        await self._writer.close()
+
+    @staticmethod
+    def _append(directory: Path, session_id: str, response: Response) -> None:
+        with open(directory / f"{session_id}.jsonl", "a", encoding="utf-8") as f:
+            f.write(response.model_dump_json() + "\n")
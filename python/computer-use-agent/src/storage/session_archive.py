@@ -0,0 +1,82 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from contextlib import closing
+
+from storage.cua_session import CuaSession
+
+logger = logging.getLogger(__name__)
+
+
+class SessionArchive:
+    """
+    Keeps serialized sessions in a SQLite database, so sessions evicted from memory or
+    lost in a restart can still be resumed. Queries run on a worker thread to keep
+    the event loop free.
+    """
+
+    def __init__(self, path: str, max_age: float | None = None):
+        self.path = path
+        # Seconds an archived session is kept before it is pruned
+        self.max_age = max_age
+        with closing(self._connect()) as db, db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                " user_id TEXT PRIMARY KEY, state TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path)
+
+    async def save(self, user_id: str, session: CuaSession) -> None:
+        state = await session.snapshot()
+        await asyncio.to_thread(self._save, user_id, state)
+
+    def _save(self, user_id: str, state: dict) -> None:
+        state = json.dumps(state)
+        with closing(self._connect()) as db, db:
+            db.execute(
+                "INSERT OR REPLACE INTO sessions (user_id, state, updated_at) VALUES (?, ?, ?)",
+                (user_id, state, time.time()),
+            )
+
+    async def load(self, user_id: str) -> CuaSession | None:
+        """Restore a user's session from the archive, if there is one."""
+        state = await asyncio.to_thread(self._load, user_id)
+        if state is None:
+            return None
+        try:
+            return CuaSession.from_state(json.loads(state))
+        except Exception as e:
+            logger.error(f"Could not restore the archived session of {user_id}: {e}")
+            return None
+
+    def _load(self, user_id: str) -> str | None:
+        with closing(self._connect()) as db, db:
+            row = db.execute(
+                "SELECT state FROM sessions WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    async def delete(self, user_id: str) -> None:
+        await asyncio.to_thread(self._delete, user_id)
+
+    def _delete(self, user_id: str) -> None:
+        with closing(self._connect()) as db, db:
+            db.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+
+    async def prune(self) -> None:
+        """Remove sessions that were archived longer than `max_age` ago."""
+        if self.max_age is None:
+            return
+        await asyncio.to_thread(self._prune, time.time() - self.max_age)
+
+    def _prune(self, before: float) -> None:
+        with closing(self._connect()) as db, db:
+            deleted = db.execute(
+                "DELETE FROM sessions WHERE updated_at < ?", (before,)
+            ).rowcount
+        if deleted:
+            logger.info(f"Pruned {deleted} archived sessions")
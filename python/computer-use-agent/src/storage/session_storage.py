@@ -1,21 +1,187 @@
+import asyncio
+import inspect
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable
+
 from storage.cua_session import CuaSession
+from storage.session_archive import SessionArchive
+
+logger = logging.getLogger(__name__)
+
+# Called with the user id and the session before an evicted session is closed
+EvictionHook = Callable[[str, CuaSession], Awaitable[None] | None]
 
 
 class SessionStorage:
-    """A simple in-memory storage for browser sessions."""
+    """
+    An in-memory storage for sessions, bounded by `max_sessions` and by how long a
+    session may stay idle. Evicted sessions are closed, which releases their browser
+    or desktop, and are kept in the archive when there is one so they can be resumed.
+    Sessions for which `is_busy` returns True are never evicted.
+
+    With an archive, sessions are also snapshotted in the background after every
+    change, so they survive a restart of the process. Only the latest state of a
+    session is written, changes made while a snapshot is written are coalesced.
+    """
+
+    def __init__(
+        self,
+        max_sessions: int | None = None,
+        idle_ttl: float | None = None,
+        archive: SessionArchive | None = None,
+        is_busy: Callable[[str], bool] | None = None,
+        sweep_interval: float = 60,
+    ):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.archive = archive
+        self.is_busy = is_busy or (lambda user_id: False)
+        self.sweep_interval = sweep_interval
+        # Least recently used first
+        self._sessions: OrderedDict[str, CuaSession] = OrderedDict()
+        self._last_used: dict[str, float] = {}
+        self._eviction_hooks: list[EvictionHook] = []
+        self._sweep_task: asyncio.Task | None = None
+        # Sessions changed since their last snapshot, by user
+        self._dirty: dict[str, CuaSession] = {}
+        self._snapshot_task: asyncio.Task | None = None
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def on_evict(self, hook: EvictionHook) -> None:
+        """Register a hook that runs when a session is evicted."""
+        self._eviction_hooks.append(hook)
+
+    def start(self) -> None:
+        """Start evicting idle sessions in the background."""
+        if self._sweep_task is None and (self.idle_ttl is not None or self.archive):
+            self._sweep_task = asyncio.create_task(self._sweep_loop())
 
-    def __init__(self):
-        self._sessions = {}
+    async def close(self) -> None:
+        """Stop sweeping and close every session, archiving them if possible."""
+        if self._sweep_task:
+            self._sweep_task.cancel()
+            self._sweep_task = None
+        if self._snapshot_task:
+            await self._snapshot_task
+        for user_id in list(self._sessions):
+            await self._evict(user_id)
 
     async def get_session(self, user_id: str) -> CuaSession | None:
         """Get a session for a user if it exists."""
-        return self._sessions.get(user_id)
+        session = self._sessions.get(user_id)
+        if session is None and self.archive:
+            session = await self.archive.load(user_id)
+            if session is not None:
+                logger.info(f"Resuming archived session {session.id}")
+                if session.status == "Running":
+                    # Its run was interrupted, the user resumes it like a paused one
+                    session.status = "Paused"
+                self._sessions[user_id] = session
+                self._track(user_id, session)
+        if session is not None:
+            self._touch(user_id)
+            await self._evict_over_capacity()
+        return session
 
     async def set_session(self, user_id: str, session: CuaSession) -> None:
-        """Store a session for a user."""
+        """Store a session for a user, closing the one it replaces."""
+        previous = self._sessions.get(user_id)
         self._sessions[user_id] = session
+        self._touch(user_id)
+        if previous is not session:
+            if previous is not None:
+                await previous.close()
+            self._track(user_id, session)
+            self._schedule_snapshot(user_id, session)
+        await self._evict_over_capacity()
 
     async def delete_session(self, user_id: str) -> None:
         """Delete a user's session if it exists."""
+        self._dirty.pop(user_id, None)
         if user_id in self._sessions:
-            del self._sessions[user_id]
+            session = self._sessions.pop(user_id)
+            self._last_used.pop(user_id, None)
+            await session.close()
+        if self.archive:
+            if self._snapshot_task:
+                # A snapshot being written would bring the session back
+                await asyncio.shield(self._snapshot_task)
+            await self.archive.delete(user_id)
+
+    async def evict_idle(self) -> None:
+        """Evict the sessions that were not used for longer than `idle_ttl`."""
+        if self.idle_ttl is None:
+            return
+        expired_before = time.monotonic() - self.idle_ttl
+        for user_id in list(self._sessions):
+            if self._last_used[user_id] < expired_before and not self.is_busy(user_id):
+                await self._evict(user_id)
+
+    def _track(self, user_id: str, session: CuaSession) -> None:
+        if self.archive:
+            session.on_change(lambda: self._schedule_snapshot(user_id, session))
+
+    def _schedule_snapshot(self, user_id: str, session: CuaSession) -> None:
+        if not self.archive or self._sessions.get(user_id) is not session:
+            return
+        self._dirty[user_id] = session
+        if self._snapshot_task is None or self._snapshot_task.done():
+            self._snapshot_task = asyncio.create_task(self._snapshot_loop())
+
+    async def _snapshot_loop(self) -> None:
+        while self._dirty:
+            user_id = next(iter(self._dirty))
+            session = self._dirty.pop(user_id)
+            try:
+                await self.archive.save(user_id, session)
+            except Exception as e:
+                logger.error(f"Error snapshotting session {session.id}: {e}")
+
+    def _touch(self, user_id: str) -> None:
+        self._sessions.move_to_end(user_id)
+        self._last_used[user_id] = time.monotonic()
+
+    async def _evict_over_capacity(self) -> None:
+        if self.max_sessions is None:
+            return
+        # Walk from the least recently used, skipping sessions that are in use
+        for user_id in list(self._sessions):
+            if len(self._sessions) <= self.max_sessions:
+                return
+            if not self.is_busy(user_id):
+                await self._evict(user_id)
+
+    async def _evict(self, user_id: str) -> None:
+        session = self._sessions.pop(user_id, None)
+        self._last_used.pop(user_id, None)
+        self._dirty.pop(user_id, None)
+        if session is None:
+            return
+        logger.info(f"Evicting session {session.id}")
+        for hook in self._eviction_hooks:
+            try:
+                result = hook(user_id, session)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                logger.error(f"Error in session eviction hook: {e}")
+        if self.archive:
+            try:
+                await self.archive.save(user_id, session)
+            except Exception as e:
+                logger.error(f"Error archiving session {session.id}: {e}")
+        await session.close()
+
+    async def _sweep_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self.evict_idle()
+                if self.archive:
+                    await self.archive.prune()
+            except Exception as e:
+                logger.error(f"Error evicting idle sessions: {e}")
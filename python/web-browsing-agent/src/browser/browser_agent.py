@@ -1,5 +1,6 @@
 import asyncio
 import os
+from functools import partial
 from typing import Callable, Coroutine
 
 from browser_use import Agent, Browser, BrowserConfig
@@ -10,12 +11,17 @@ from langchain_openai import AzureChatOpenAI, ChatOpenAI
 from microsoft_teams.api import ConversationReference, MessageActivityInput
 from microsoft_teams.api.models.attachment.attachment import Attachment
 
+from card_budget import THUMBNAIL_MIME_TYPE, fit_card
 from cards import create_final_card, create_progress_card
 from config import Config
+from progress_updater import ConversationRateLimiter, ProgressCardUpdater
 from storage.session import Session, SessionState, SessionStepState
 
 MAX_EXECUTION_TIME_SECONDS = 600  # 10 minutes
 
+# Shared by every agent so the limit holds per conversation, not per run
+_card_rate_limiter = ConversationRateLimiter(Config.CARD_UPDATES_PER_SECOND)
+
 
 class WrappedAgent(Agent):
     """
@@ -49,6 +55,13 @@ class BrowserAgent:
         self.conversation_ref = conversation_ref
         self.session = session
         self.activity_id = activity_id
+        # Progress cards are coalesced and sent in the background
+        self.progress = ProgressCardUpdater(
+            self._send_progress_card,
+            activity_id,
+            conversation_id=conversation_ref.conversation.id,
+            rate_limiter=_card_rate_limiter,
+        )
         self.browser = Browser(
             config=BrowserConfig(
                 headless=True if os.environ.get("IS_DOCKER_ENV", None) else False,
@@ -76,6 +89,12 @@ class BrowserAgent:
         """Send or update an activity via the app's activity sender."""
         await self.app.activity_sender.send(activity, self.conversation_ref)
 
+    async def _send_progress_card(self, card: dict, activity_id: str | None) -> str | None:
+        activity = MessageActivityInput(id=activity_id)
+        activity.attachments = [Attachment(content_type="application/vnd.microsoft.card.adaptive", content=card)]
+        await self._send_activity(activity)
+        return activity_id
+
     async def _handle_screenshot_and_emit(
         self,
         output: AgentOutput,
@@ -100,16 +119,32 @@ class BrowserAgent:
         # Transform agent history into simple facts list
         history_facts = self._build_history_facts()
 
-        # Update the Teams message with card
-        card = create_progress_card(
-            screenshot=step.screenshot,
-            next_goal=step.next_goal,
-            action=step.action,
-            history_facts=history_facts,
+        # Update the Teams message with card, built in the updater's worker
+        card = self._card_builder(
+            lambda thumbnail, history_limit: create_progress_card(
+                screenshot=thumbnail,
+                screenshot_mime_type=THUMBNAIL_MIME_TYPE,
+                next_goal=step.next_goal,
+                action=step.action,
+                history_facts=history_facts,
+                max_history_steps=history_limit,
+            ),
+            step.screenshot,
+            history_length=len(history_facts or []),
+        )
+        self.progress.submit(card)
+
+    def _card_builder(self, build, screenshot: str | None, history_length: int = 0):
+        """Return a function building the card within the size budget, with the screenshot as a thumbnail."""
+        return partial(
+            fit_card,
+            build,
+            screenshot,
+            history_length=history_length,
+            max_bytes=Config.CARD_MAX_BYTES,
+            thumbnail_width=Config.CARD_THUMBNAIL_WIDTH,
+            thumbnail_quality=Config.CARD_THUMBNAIL_QUALITY,
         )
-        activity = MessageActivityInput(id=self.activity_id)
-        activity.attachments = [Attachment(content_type="application/vnd.microsoft.card.adaptive", content=card)]
-        await self._send_activity(activity)
 
     def _build_history_facts(self) -> list[dict] | None:
         if not self.agent_history or not self.agent_history.history:
@@ -163,17 +198,29 @@ class BrowserAgent:
         step = SessionStepState(action=message, screenshot=last_screenshot)
         self.session.session_state.append(step)
 
-        card = create_progress_card(
-            screenshot=None,
-            action="The session concluded",
-            history_facts=history_facts,
+        card = self._card_builder(
+            lambda _, history_limit: create_progress_card(
+                screenshot=None,
+                action="The session concluded",
+                history_facts=history_facts,
+                max_history_steps=history_limit,
+            ),
+            None,
+            history_length=len(history_facts or []),
         )
-        activity = MessageActivityInput(id=self.activity_id)
-        activity.attachments = [Attachment(content_type="application/vnd.microsoft.card.adaptive", content=card)]
-        await self._send_activity(activity)
+        self.progress.submit(card)
+        # The final state always goes out, before the results card
+        await self.progress.close()
 
         # Then send a final results card
-        final_card = create_final_card(message, last_screenshot, override_title)
+        final_card = await asyncio.to_thread(
+            self._card_builder(
+                lambda thumbnail, _: create_final_card(
+                    message, thumbnail, override_title, screenshot_mime_type=THUMBNAIL_MIME_TYPE
+                ),
+                last_screenshot,
+            )
+        )
         final_activity = MessageActivityInput()
         final_activity.attachments = [Attachment(content_type="application/vnd.microsoft.card.adaptive", content=final_card)]
         await self._send_activity(final_activity)
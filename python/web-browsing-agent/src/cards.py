@@ -29,6 +29,8 @@ def create_progress_card(
     next_goal: str = None,
     action: str = None,
     history_facts: list[dict] = None,
+    max_history_steps: int = None,
+    screenshot_mime_type: str = "image/png",
 ) -> dict:
     """Create a progress card showing the current state of the browsing session.
     
@@ -38,6 +40,8 @@ def create_progress_card(
         action: Current action being performed
         history_facts: List of dictionaries containing history facts with format:
                       [{"thought": str, "goal": str, "action": str}, ...]
+        max_history_steps: Only show the last steps of the history
+        screenshot_mime_type: Image format of the screenshot
     """
     card = {
         "type": "AdaptiveCard",
@@ -50,7 +54,7 @@ def create_progress_card(
         card["body"].append(
             {
                 "type": "Image",
-                "url": f"data:image/png;base64,{screenshot}",
+                "url": f"data:{screenshot_mime_type};base64,{screenshot}",
                 "msTeams": {
                     "allowExpand": True,
                 },
@@ -106,8 +110,13 @@ def create_progress_card(
         card["body"].append(status_section)
 
     if history_facts:
+        first_step = 0
+        if max_history_steps is not None and len(history_facts) > max_history_steps:
+            first_step = len(history_facts) - max_history_steps
         facts = []
-        for i, fact in enumerate(history_facts):
+        if first_step:
+            facts.append({"title": "...", "value": f"{first_step} earlier steps not shown"})
+        for i, fact in enumerate(history_facts[first_step:], first_step):
             facts.append(
                 {
                     "title": f"Step {i+1}",
@@ -138,7 +147,12 @@ def create_progress_card(
 
     return card
 
-def create_final_card(message: str, screenshot: str = None, override_title: str = None) -> dict:
+def create_final_card(
+    message: str,
+    screenshot: str = None,
+    override_title: str = None,
+    screenshot_mime_type: str = "image/png",
+) -> dict:
     """Create a final card showing the completion of the browsing session."""
     card = {
         "type": "AdaptiveCard",
@@ -176,7 +190,7 @@ def create_final_card(message: str, screenshot: str = None, override_title: str
             1,
             {
                 "type": "Image",
-                "url": f"data:image/png;base64,{screenshot}",
+                "url": f"data:{screenshot_mime_type};base64,{screenshot}",
                 "msTeams": {
                     "allowExpand": True,
                 },
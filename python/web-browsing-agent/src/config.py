@@ -20,3 +20,13 @@ class Config:
     AZURE_OPENAI_API_VERSION = os.environ.get("AZURE_OPENAI_API_VERSION", None)
     OPENAI_MODEL_NAME = os.environ.get("OPENAI_MODEL_NAME", None)
     OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", None)
+
+    # Progress card updates sent per second to a conversation, newer cards replace
+    # the ones still waiting.
+    CARD_UPDATES_PER_SECOND = float(os.environ.get("CARD_UPDATES_PER_SECOND", "1.0"))
+
+    # Cards are kept under CARD_MAX_BYTES, screenshots are shown as JPEG thumbnails
+    # at most CARD_THUMBNAIL_WIDTH pixels wide.
+    CARD_MAX_BYTES = int(os.environ.get("CARD_MAX_BYTES", "80000"))
+    CARD_THUMBNAIL_WIDTH = int(os.environ.get("CARD_THUMBNAIL_WIDTH", "512"))
+    CARD_THUMBNAIL_QUALITY = int(os.environ.get("CARD_THUMBNAIL_QUALITY", "60"))
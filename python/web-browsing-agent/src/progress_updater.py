@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import random
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+# Sends a card, updating the activity with the given id if there is one,
+# and returns the id of the activity that holds the card
+SendCard = Callable[[dict, str | None], Awaitable[str | None]]
+# Builds a card when it is about to be sent, on a worker thread
+BuildCard = Callable[[], dict]
+
+
+@dataclass
+class UpdaterStats:
+    submitted: int = 0
+    sent: int = 0
+    # Replaced by a newer card before they could be sent
+    dropped: int = 0
+    # Rejected by Teams with a 429 and retried
+    throttled: int = 0
+    failed: int = 0
+
+
+# Counters across every updater in the process
+total_stats = UpdaterStats()
+
+
+def _count(stats: UpdaterStats, name: str) -> None:
+    setattr(stats, name, getattr(stats, name) + 1)
+    setattr(total_stats, name, getattr(total_stats, name) + 1)
+
+
+def retry_after_seconds(error: BaseException) -> float | None:
+    """
+    How long the server asked us to wait before retrying, from the Retry-After or
+    retry-after-ms header of the error's response. None if it did not say.
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value is not None:
+        try:
+            return max(float(value) / 1000, 0.0)
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+        return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def throttle_delay(error: Exception) -> float | None:
+    """Return how long to wait if the error is a 429 from Teams, None otherwise."""
+    response = getattr(error, "response", None)
+    status = getattr(response, "status_code", None) or getattr(response, "status", None)
+    if status != 429:
+        return None
+    delay = retry_after_seconds(error)
+    return 1.0 if delay is None else delay
+
+
+class ConversationRateLimiter:
+    """Spaces out sends to the same conversation to at most `rate` per second."""
+
+    def __init__(self, rate: float = 1.0):
+        self.interval = 1 / rate if rate > 0 else 0.0
+        self._next_send: dict[str, float] = {}
+
+    async def wait(self, conversation_id: str) -> None:
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        send_at = max(self._next_send.get(conversation_id, now), now)
+        self._next_send[conversation_id] = send_at + self.interval
+        if send_at > now:
+            await asyncio.sleep(send_at - now)
+
+    def defer(self, conversation_id: str, seconds: float) -> None:
+        """Hold back every send to the conversation, e.g. after Teams asked to retry later."""
+        send_at = asyncio.get_running_loop().time() + seconds
+        self._next_send[conversation_id] = max(
+            self._next_send.get(conversation_id, 0.0), send_at
+        )
+
+
+class ProgressCardUpdater:
+    """
+    Delivers progress cards from a background task so the agent never waits on Teams.
+    Only the latest card matters: one submitted while another is waiting replaces it,
+    so intermediate states are skipped and the final state is always the one sent.
+    Sends to a conversation are spaced out by the rate limiter, and 429 responses
+    are retried after the delay Teams asks for. A card can be submitted as a function
+    that builds it, e.g. to encode its images, which then runs on a worker thread
+    only for the cards that are actually sent.
+    """
+
+    def __init__(
+        self,
+        send_card: SendCard,
+        activity_id: str | None = None,
+        conversation_id: str = "",
+        rate_limiter: ConversationRateLimiter | None = None,
+        max_retries: int = 3,
+    ):
+        self._send_card = send_card
+        self.activity_id = activity_id
+        self.conversation_id = conversation_id
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.stats = UpdaterStats()
+        self._pending: dict | BuildCard | None = None
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._worker: asyncio.Task | None = None
+
+    def submit(self, card: dict | BuildCard) -> None:
+        """Queue a card, or a function building it, replacing any card that was not sent yet."""
+        _count(self.stats, "submitted")
+        if self._pending is not None:
+            _count(self.stats, "dropped")
+        self._pending = card
+        self._idle.clear()
+        self._wakeup.set()
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    async def flush(self) -> None:
+        """Wait until the latest submitted card was sent."""
+        if self._worker is None or self._worker.done():
+            return
+        await self._idle.wait()
+
+    async def close(self) -> None:
+        """Send the latest card, then stop the background task."""
+        await self.flush()
+        if self._worker:
+            self._worker.cancel()
+            self._worker = None
+        logger.debug("Progress card updates: %s", self.stats)
+
+    async def _run(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if self._pending is not None:
+                if self.rate_limiter:
+                    # Cards submitted while we wait replace the pending one
+                    await self.rate_limiter.wait(self.conversation_id)
+                card, self._pending = self._pending, None
+                if callable(card):
+                    card = await self._build(card)
+                if card is not None:
+                    await self._deliver(card)
+            if self._pending is None:
+                self._idle.set()
+            else:
+                self._wakeup.set()
+
+    async def _build(self, build: BuildCard) -> dict | None:
+        try:
+            return await asyncio.to_thread(build)
+        except Exception as e:
+            _count(self.stats, "failed")
+            logger.error(f"Error building progress card: {e}")
+            return None
+
+    async def _deliver(self, card: dict) -> None:
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.activity_id = await self._send_card(card, self.activity_id)
+                _count(self.stats, "sent")
+                return
+            except Exception as e:
+                delay = throttle_delay(e)
+                if delay is None or attempt == self.max_retries:
+                    _count(self.stats, "failed")
+                    logger.error(f"Error sending progress card: {e}")
+                    return
+                _count(self.stats, "throttled")
+                logger.warning(f"Teams throttled a progress card, retrying in {delay:.1f}s")
+                if self.rate_limiter:
+                    self.rate_limiter.defer(self.conversation_id, delay)
+                await asyncio.sleep(delay + random.uniform(0, 0.1))
+                if self._pending is not None:
+                    # A newer card arrived while we waited, send that one instead
+                    _count(self.stats, "dropped")
+                    return